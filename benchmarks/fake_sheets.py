@@ -0,0 +1,147 @@
+"""In-process stand-in for the Google Sheets database.
+
+The fake worksheets behave like the gspread worksheets used by `database.py`, and enforce the limits of Google
+Sheets: the read and write request quotas, the characters in a cell and the cells in a spreadsheet. As with
+gspread, clearing a worksheet keeps its grid, so the spreadsheet holds both the old and new rows while saving.
+"""
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+import database as db
+
+MAX_CELL_CHARACTERS = 50000
+MAX_SPREADSHEET_CELLS = 10000000
+REQUESTS_PER_MINUTE = 60  # For each of reads and writes, per user
+DEFAULT_ROW_COUNT = 1000
+DEFAULT_COL_COUNT = 26
+
+
+class SheetsApiError(Exception):
+    """Error returned by the Sheets API, with the HTTP status code."""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(f"APIError: [{code}]: {message}")
+        self.code = code
+
+
+class FakeSpreadsheet(object):
+    """Holds the fake worksheets, and applies latency, quotas and injected failures to every request sent to them.
+
+    Each request takes the latency plus the cell latency for each cell sent or received. Each request has the
+    failure probability of failing with a server error.
+    """
+
+    def __init__(self, latency=0.0, cell_latency=0.0, requests_per_minute: Optional[int] = REQUESTS_PER_MINUTE,
+                 failure_probability=0.0, seed: Optional[int] = None) -> None:
+        self.latency = latency
+        self.cell_latency = cell_latency
+        self.requests_per_minute = requests_per_minute
+        self.failure_probability = failure_probability
+        self.request_counts = Counter()
+        self.error_counts = Counter()
+        self.worksheets = {sheet_name: FakeWorksheet(self, title) for sheet_name, title in db.SHEET_TITLES.items()}
+        self._random = random.Random(seed)
+        self._request_times: Dict[str, Deque[float]] = {"read": deque(), "write": deque()}
+        self._lock = threading.Lock()
+
+    @property
+    def cell_count(self) -> int:
+        return sum(worksheet.row_count * worksheet.col_count for worksheet in self.worksheets.values())
+
+    def request(self, kind: str, cell_count=0) -> None:
+        """Takes the time of a read or write request, and raises the error the request would fail with, if any."""
+        with self._lock:
+            self.request_counts[kind] += 1
+            try:
+                self.check_quota(kind)
+                if self._random.random() < self.failure_probability:
+                    raise SheetsApiError(503, "The service is currently unavailable.")
+            except SheetsApiError as error:
+                self.error_counts[f"{kind} {error.code}"] += 1
+                raise
+        if self.latency or self.cell_latency:
+            time.sleep(self.latency + cell_count * self.cell_latency)
+        return
+
+    def check_quota(self, kind: str) -> None:
+        if not self.requests_per_minute:
+            return
+        request_times = self._request_times[kind]
+        now = time.monotonic()
+        while request_times and request_times[0] <= now - 60:
+            request_times.popleft()
+        if len(request_times) >= self.requests_per_minute:
+            raise SheetsApiError(
+                429, f"Quota exceeded for quota metric '{kind.title()} requests' and limit "
+                     f"'{kind.title()} requests per minute per user'"
+            )
+        request_times.append(now)
+        return
+
+    def check_cell_count(self, added_cell_count: int) -> None:
+        if self.cell_count + added_cell_count > MAX_SPREADSHEET_CELLS:
+            with self._lock:
+                self.error_counts["write 400"] += 1
+            raise SheetsApiError(
+                400, f"This action would increase the number of cells in the workbook above the limit of "
+                     f"{MAX_SPREADSHEET_CELLS} cells."
+            )
+        return
+
+    def get_stats(self) -> dict:
+        return {
+            "requests": dict(self.request_counts),
+            "errors": dict(self.error_counts),
+            "cells": self.cell_count,
+        }
+
+
+class FakeWorksheet(db.MemoryWorksheet):
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str) -> None:
+        super().__init__()
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.row_count = DEFAULT_ROW_COUNT
+        self.col_count = DEFAULT_COL_COUNT
+
+    def clear(self) -> dict:
+        self.spreadsheet.request("write")
+        return super().clear()
+
+    def insert_rows(self, values: List[List[str]], row: int = 1, value_input_option: str = "RAW") -> dict:
+        cell_count = sum(len(row_values) for row_values in values)
+        self.spreadsheet.request("write", cell_count)
+        for row_values in values:
+            for value in row_values:
+                if len(str(value)) > MAX_CELL_CHARACTERS:
+                    raise SheetsApiError(
+                        400, f"Your input contains more than the maximum of {MAX_CELL_CHARACTERS} characters in a "
+                             f"single cell."
+                    )
+        col_count = max([self.col_count] + [len(row_values) for row_values in values])
+        self.spreadsheet.check_cell_count(
+            (self.row_count + len(values)) * col_count - self.row_count * self.col_count
+        )
+        self.row_count, self.col_count = self.row_count + len(values), col_count
+        return super().insert_rows(values, row, value_input_option)
+
+    def resize(self, rows: int = None, cols: int = None) -> dict:
+        self.spreadsheet.request("write")
+        self.row_count = rows if rows is not None else self.row_count
+        self.col_count = cols if cols is not None else self.col_count
+        return super().resize(rows, cols)
+
+    def get_all_records(self, numericise_ignore: List[str] = None) -> List[Dict[str, str]]:
+        self.spreadsheet.request("read", sum(len(row_values) for row_values in self.rows))
+        return super().get_all_records(numericise_ignore)
+
+
+class FakeSheetsBackend(object):
+    def __init__(self, spreadsheet: FakeSpreadsheet) -> None:
+        self.spreadsheet = spreadsheet
+
+    def get_worksheet(self, sheet_name: str) -> db.Worksheet:
+        return self.spreadsheet.worksheets[sheet_name]
@@ -0,0 +1,275 @@
+"""Local stand-in for the Telegram Bot API server.
+
+Run with `python -m benchmarks.fake_telegram --port 8081`, then start the bot with `BOT_API_URL` set to
+`http://localhost:8081/bot`. The server keeps the messages it sends in memory, so edits that change nothing fail
+with "message is not modified" and edits of deleted messages fail with "message to edit not found", like Telegram.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+BOT_ID = 100000
+NOT_MODIFIED_ERROR = "Bad Request: message is not modified: specified new message content and reply markup are " \
+                     "exactly the same as a current content and reply markup of the message"
+EDIT_NOT_FOUND_ERROR = "Bad Request: message to edit not found"
+DELETE_NOT_FOUND_ERROR = "Bad Request: message to delete not found"
+
+MessageKey = Tuple[str, ...]
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, description: str, retry_after: int = 0) -> None:
+        super().__init__(description)
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+    def to_json(self) -> dict:
+        response = {"ok": False, "error_code": self.status, "description": self.description}
+        if self.retry_after:
+            response["parameters"] = {"retry_after": self.retry_after}
+        return response
+
+
+class FakeTelegram(object):
+    """Handles Bot API calls against messages kept in memory.
+
+    Requests take the latency plus up to the jitter in seconds. Each request to a chat has the flood probability
+    of blocking the chat for the retry after seconds, during which requests to the chat fail with 429 errors.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_probability=0.0, retry_after=1, seed: Optional[int] = None) \
+            -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_probability = flood_probability
+        self.retry_after = retry_after
+        self.call_counts = Counter()
+        self.error_counts = Counter()
+        self._random = random.Random(seed)
+        self._messages: Dict[MessageKey, Tuple[str, str]] = dict()
+        self._message_ids = itertools.count(1)
+        self._blocked_chats: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+        self._methods = {
+            "getMe": self.get_me,
+            "setWebhook": self.accept,
+            "deleteWebhook": self.accept,
+            "sendMessage": self.send_message,
+            "editMessageText": self.edit_message_text,
+            "editMessageReplyMarkup": self.edit_message_reply_markup,
+            "deleteMessage": self.delete_message,
+            "answerCallbackQuery": self.accept,
+            "answerInlineQuery": self.accept,
+        }
+
+    def call(self, method: str, params: Dict[str, Any]) -> Tuple[int, dict]:
+        """Calls the API method, returning the HTTP status and the response body."""
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.random() * self.jitter)
+        with self._lock:
+            self.call_counts[method] += 1
+        try:
+            if method not in self._methods:
+                raise ApiError(404, "Not Found: method not found")
+            self.check_flood(params)
+            return 200, {"ok": True, "result": self._methods[method](params)}
+        except ApiError as error:
+            with self._lock:
+                self.error_counts[f"{method} {error.status}"] += 1
+            return error.status, error.to_json()
+
+    def check_flood(self, params: Dict[str, Any]) -> None:
+        chat_id = str(params.get("chat_id", ""))
+        if not chat_id:
+            return
+        now = time.monotonic()
+        with self._lock:
+            blocked_until = self._blocked_chats.get(chat_id, 0.0)
+            if blocked_until <= now and self._random.random() < self.flood_probability:
+                blocked_until = self._blocked_chats[chat_id] = now + self.retry_after
+        if blocked_until > now:
+            retry_after = max(1, round(blocked_until - now))
+            raise ApiError(429, f"Too Many Requests: retry after {retry_after}", retry_after)
+        return
+
+    @staticmethod
+    def get_message_key(params: Dict[str, Any]) -> MessageKey:
+        if params.get("inline_message_id", ""):
+            return str(params["inline_message_id"]),
+        if not params.get("chat_id", "") or not params.get("message_id", ""):
+            raise ApiError(400, "Bad Request: message identifier is not specified")
+        return str(params["chat_id"]), str(params["message_id"])
+
+    @staticmethod
+    def build_message(chat_id: str, message_id: int, text: str) -> dict:
+        chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"
+        return {
+            "message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": chat_type},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}, "text": text,
+        }
+
+    @staticmethod
+    def get_me(params: Dict[str, Any]) -> dict:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    @staticmethod
+    def accept(params: Dict[str, Any]) -> bool:
+        return True
+
+    def send_message(self, params: Dict[str, Any]) -> dict:
+        chat_id = str(params.get("chat_id", ""))
+        if not chat_id or not params.get("text", ""):
+            raise ApiError(400, "Bad Request: message text is empty" if chat_id else "Bad Request: chat not found")
+        message_id = next(self._message_ids)
+        with self._lock:
+            self._messages[(chat_id, str(message_id))] = (params["text"], json.dumps(params.get("reply_markup", "")))
+        return self.build_message(chat_id, message_id, params["text"])
+
+    def receive_message(self, chat_id: int, text: str) -> int:
+        """Adds a message sent by a user to the bot, returning its message id."""
+        message_id = next(self._message_ids)
+        with self._lock:
+            self._messages[(str(chat_id), str(message_id))] = (text, json.dumps(""))
+        return message_id
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.call_counts.clear()
+            self.error_counts.clear()
+        return
+
+    def edit_message_text(self, params: Dict[str, Any]) -> Any:
+        return self.edit_message(params, params.get("text", ""), json.dumps(params.get("reply_markup", "")))
+
+    def edit_message_reply_markup(self, params: Dict[str, Any]) -> Any:
+        return self.edit_message(params, None, json.dumps(params.get("reply_markup", "")))
+
+    def edit_message(self, params: Dict[str, Any], text: Optional[str], reply_markup: str) -> Any:
+        """Edits a message. Inline messages are sent by users, so unknown inline messages are taken to exist."""
+        key = self.get_message_key(params)
+        with self._lock:
+            if key not in self._messages and len(key) > 1:
+                raise ApiError(400, EDIT_NOT_FOUND_ERROR)
+            old_text, old_reply_markup = self._messages.get(key, (None, None))
+            new_text = old_text if text is None else text
+            if (new_text, reply_markup) == (old_text, old_reply_markup):
+                raise ApiError(400, NOT_MODIFIED_ERROR)
+            self._messages[key] = (new_text, reply_markup)
+        return True if len(key) == 1 else self.build_message(key[0], int(key[1]), new_text or "")
+
+    def delete_message(self, params: Dict[str, Any]) -> bool:
+        key = self.get_message_key(params)
+        with self._lock:
+            if self._messages.pop(key, None) is None:
+                raise ApiError(400, DELETE_NOT_FOUND_ERROR)
+        return True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.call_counts.most_common()),
+                "errors": dict(self.error_counts.most_common()),
+                "messages": len(self._messages),
+            }
+
+
+class FakeTelegramRequestHandler(BaseHTTPRequestHandler):
+    """Serves /bot<token>/<method> like the Bot API, and the call statistics on /stats."""
+    server: "FakeTelegramServer"
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self.send_json(200, self.server.telegram.get_stats())
+            return
+        self.handle_call({})
+        return
+
+    def do_POST(self) -> None:
+        self.handle_call(self.read_params())
+        return
+
+    def read_params(self) -> Dict[str, Any]:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8", "replace")
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or "{}")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return dict(parse_qsl(body))
+        return dict()
+
+    def handle_call(self, params: Dict[str, Any]) -> None:
+        path_parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(path_parts) != 2 or not path_parts[0].startswith("bot"):
+            self.send_json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        status, response = self.server.telegram.call(path_parts[1], params)
+        self.send_json(status, response)
+        return
+
+    def send_json(self, status: int, response: dict) -> None:
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, telegram: FakeTelegram, host="127.0.0.1", port=0) -> None:
+        super().__init__((host, port), FakeTelegramRequestHandler)
+        self.telegram = telegram
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to give the bot, to which the bot appends its token."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> threading.Thread:
+        """Serves requests on a background thread."""
+        thread = threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True)
+        thread.start()
+        return thread
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds taken by each request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="extra seconds taken by each request, at most")
+    parser.add_argument("--flood-probability", type=float, default=0.0, help="chance of each request hitting 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds a chat is blocked after hitting 429")
+    options = parser.parse_args()
+
+    telegram = FakeTelegram(options.latency, options.jitter, options.flood_probability, options.retry_after)
+    server = FakeTelegramServer(telegram, options.host, options.port)
+    print(f"Serving the fake Bot API at {server.base_url}<token>/<method>, call statistics at /stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(telegram.get_stats(), indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""Offline load test that replays synthetic updates through the bot's dispatcher.
+
+Run from the repository root, eg. `python -m benchmarks.load_test --updates 5000 --rate 200`.
+No connection to Telegram or the spreadsheet is made: the bot sends its requests to a recording fake, or with
+`--http` to the fake Bot API server, and the models are backed by an in-memory storage.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from queue import Queue
+from typing import Any, Callable, Dict, List as Lst, Optional, Tuple
+
+# The bot reads its settings from the environment on import
+os.environ.setdefault("WEB_URL", "https://localhost/")
+os.environ.setdefault("TOKEN", "123456:LoadTestToken")
+os.environ.setdefault("ACCESS_KEY", "load-test")
+os.environ.setdefault("ADMIN_KEYS", "1")
+
+import bot  # noqa: E402
+import database as db  # noqa: E402
+import models  # noqa: E402
+import util  # noqa: E402
+from benchmarks.fake_telegram import FakeTelegram, FakeTelegramServer  # noqa: E402
+from outbound import OutboundScheduler, ScheduledBot  # noqa: E402
+from router import parse_action  # noqa: E402
+from telegram import Bot, InlineKeyboardMarkup, ParseMode, Update  # noqa: E402
+from telegram.error import RetryAfter  # noqa: E402
+from telegram.ext import Defaults, Dispatcher, ExtBot, JobQueue  # noqa: E402
+from telegram.utils.request import Request  # noqa: E402
+
+BOT_ID = 100000
+FIRST_USER_ID = 1000000
+OPTIONS_PER_POLL = 5
+OPTIONS_PER_LIST = 4
+CHOICES_PER_LIST = 20
+INLINE_QUERY_WORDS = ("", "Lunch", "Meeting", "Weekly", "Team")
+UNPACED_RATE = 10 ** 9  # Requests per second, as good as no flood control
+
+# Relative frequency of each kind of update
+DEFAULT_MIX = {"vote": 50, "comment": 10, "allocate": 20, "inline": 15, "template": 5}
+
+
+class RecordingRequest(object):
+    """Stands in for the bot's HTTP request object. Records every API call and answers it like Telegram would."""
+
+    def __init__(self, latency=0.0, con_pool_size=8) -> None:
+        self.latency = latency
+        self.con_pool_size = con_pool_size
+        self.call_counts = Counter()
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def post(self, url: str, data: Dict[str, Any], timeout: float = None) -> Any:
+        endpoint = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.call_counts[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.build_result(endpoint, data or dict())
+
+    def build_result(self, endpoint: str, data: Dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Load Test Bot", "username": "load_test_bot"}
+        if "chat_id" in data and (endpoint.startswith("send") or endpoint.startswith("edit")):
+            chat_id = int(data["chat_id"]) if str(data["chat_id"]).lstrip("-").isdigit() else data["chat_id"]
+            return {
+                "message_id": data.get("message_id", None) or next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+            }
+        return True
+
+    def receive_message(self, chat_id: int, text: str) -> int:
+        """Takes a message id for a message sent by a user to the bot."""
+        return next(self._message_ids)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.call_counts.clear()
+        return
+
+    def stop(self) -> None:
+        return
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.call_counts.most_common())}
+
+
+class LatencyRecorder(object):
+    """Times each update from the moment it is queued until the last of its handlers returns."""
+
+    def __init__(self) -> None:
+        self.queued_times: Dict[int, Tuple[str, float]] = dict()
+        self.done_times: Dict[int, float] = dict()
+        self._pending_handlers: Dict[int, int] = defaultdict(int)
+        self._condition = threading.Condition()
+
+    def wrap(self, callback: Callable) -> Callable:
+        def recorded_callback(update: object, context: object) -> Any:
+            update_id = getattr(update, "update_id", None)
+            with self._condition:
+                self._pending_handlers[update_id] += 1
+            try:
+                return callback(update, context)
+            finally:
+                with self._condition:
+                    self._pending_handlers[update_id] -= 1
+                    if not self._pending_handlers[update_id]:
+                        self.done_times[update_id] = time.perf_counter()
+                        self._condition.notify_all()
+        return recorded_callback
+
+    def queue(self, update_queue: Queue, update: Update, kind: str) -> None:
+        self.queued_times[update.update_id] = (kind, time.perf_counter())
+        update_queue.put(update)
+        return
+
+    def wait(self, count: int, timeout: float) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self.done_times) >= count, timeout=timeout)
+
+    def get_latencies(self) -> Dict[str, Lst[float]]:
+        latencies = defaultdict(list)
+        for update_id, done_time in list(self.done_times.items()):
+            kind, queued_time = self.queued_times[update_id]
+            latencies[kind].append(done_time - queued_time)
+        return latencies
+
+
+def build_dispatcher(request: Request, base_url: Optional[str], workers: int, run_async: bool, flood_control: bool,
+                     recorder: LatencyRecorder) -> Dispatcher:
+    """Builds a dispatcher with the bot's own handlers, sending every request through the given request object.
+
+    The bot is a scheduled bot like the live one, so that edits and deletions forget the message digests. Without
+    flood control, its scheduler lets every request through without waiting.
+    """
+    defaults = Defaults(run_async=run_async)
+    scheduler = OutboundScheduler() if flood_control else \
+        OutboundScheduler(UNPACED_RATE, UNPACED_RATE, UNPACED_RATE, UNPACED_RATE, background_reserve=0)
+    fake_bot = ScheduledBot(
+        bot.TOKEN, scheduler, bot.message_digests, base_url=base_url, request=request, defaults=defaults
+    )
+
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(fake_bot, Queue(), workers=workers, job_queue=job_queue, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    bot.register_handlers(dispatcher)
+
+    # Only time the bot's own handlers, which run after the readiness and inline query tracking groups
+    for group, handlers in dispatcher.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = recorder.wrap(handler.callback)
+    return dispatcher
+
+
+class Workload(object):
+    """Seeds users, polls, lists and templates, and generates updates that act on them.
+
+    Messages that the updates refer to are sent to the API before the updates are generated, so that the bot edits
+    and deletes messages that exist: the bot's messages are sent with the seed bot, and the users' messages are
+    received by the API directly.
+    """
+
+    def __init__(self, user_count: int, polls_per_user: int, lists_per_user: int, seed: int, seed_bot: Bot,
+                 api: Any) -> None:
+        self.random = random.Random(seed)
+        self.update_ids = itertools.count(1)
+        self.seed_bot = seed_bot
+        self.api = api
+        self.users: Lst[models.User] = []
+        self.polls: Lst[models.Poll] = []
+        self.lists: Lst[models.List] = []
+        self.template_names: Dict[int, str] = dict()
+        # Messages sent by the bot to each user, keyed by the user id and what they show
+        self.bot_messages: Dict[Tuple[int, str], dict] = dict()
+
+        for i in range(user_count):
+            uid = FIRST_USER_ID + i
+            user = models.User.register(uid, f"User{i}", "Load", f"user{i}")
+            self.users.append(user)
+            for j in range(polls_per_user):
+                poll, _ = user.create_poll(
+                    f"{self.random.choice(INLINE_QUERY_WORDS[1:])} poll {i}-{j}", "Load test poll",
+                    [f"Option {k}" for k in range(OPTIONS_PER_POLL)]
+                )
+                poll.set_single_response(False)
+                poll.add_message_details(f"inline-{poll.get_poll_id()}")
+                self.polls.append(poll)
+            for j in range(lists_per_user):
+                _list, _ = user.create_list(
+                    f"{self.random.choice(INLINE_QUERY_WORDS[1:])} list {i}-{j}", "Load test list",
+                    [f"Option {k}" for k in range(OPTIONS_PER_LIST)], [f"Choice {k}" for k in range(CHOICES_PER_LIST)]
+                )
+                self.lists.append(_list)
+            template_name = f"temp{i}"
+            user.create_temp_poll(
+                template_name, "Load test template", "Weekly poll", "", ["Yes", "No", "Maybe"], False
+            )
+            self.template_names[uid] = template_name
+
+        # Every user votes for the first option of every poll
+        for poll in self.polls:
+            for user in self.users:
+                poll.toggle(0, user.get_uid(), self.build_profile(user))
+        return
+
+    @staticmethod
+    def build_profile(user: models.User) -> dict:
+        return {"first_name": user.get_name(), "last_name": "", "username": user.get_username()}
+
+    def build_user(self, user: models.User) -> dict:
+        return {"id": user.get_uid(), "is_bot": False, "first_name": user.get_name(), "username": user.get_username()}
+
+    def build_message(self, user: models.User, text: str, entities: Lst[dict] = None) -> dict:
+        """Builds a message sent by the user to the bot."""
+        message = {
+            "message_id": self.api.receive_message(user.get_uid(), text), "date": int(time.time()), "text": text,
+            "chat": {"id": user.get_uid(), "type": "private"}, "from": self.build_user(user),
+        }
+        if entities:
+            message["entities"] = entities
+        return message
+
+    def get_bot_message(self, user: models.User, name: str, text: str,
+                        reply_markup: Optional[InlineKeyboardMarkup] = None) -> dict:
+        """Gets the message sent by the bot to the user under the name, sending it the first time."""
+        key = user.get_uid(), name
+        if key not in self.bot_messages:
+            while True:
+                try:
+                    message = self.seed_bot.send_message(
+                        user.get_uid(), text, parse_mode=ParseMode.HTML, reply_markup=reply_markup
+                    )
+                    break
+                except RetryAfter as error:
+                    time.sleep(error.retry_after)
+            self.bot_messages[key] = message.to_dict()
+        return self.bot_messages[key]
+
+    def build_update(self, fake_bot: ExtBot, **content) -> Update:
+        return Update.de_json({"update_id": next(self.update_ids), **content}, fake_bot)
+
+    def build_callback_query(self, fake_bot: ExtBot, user: models.User, callback_data: str, **content) -> Update:
+        callback_query = {
+            "id": str(self.random.getrandbits(63)), "from": self.build_user(user), "chat_instance": "load-test",
+            "data": callback_data, **content
+        }
+        return self.build_update(fake_bot, callback_query=callback_query)
+
+    def generate(self, kind: str, dispatcher: Dispatcher) -> Update:
+        user = self.random.choice(self.users)
+        return getattr(self, f"generate_{kind}")(dispatcher, user)
+
+    def generate_vote(self, dispatcher: Dispatcher, user: models.User) -> Update:
+        poll = self.random.choice(self.polls)
+        # The first option is left voted for, so that comments on it are accepted
+        buttons = [
+            row[0] for row in poll.build_option_buttons().inline_keyboard[1:]
+            if row[0].callback_data and is_option_action(row[0].callback_data, "")
+        ]
+        button = self.random.choice(buttons)
+        return self.build_callback_query(
+            dispatcher.bot, user, button.callback_data, inline_message_id=f"inline-{poll.get_poll_id()}"
+        )
+
+    def generate_comment(self, dispatcher: Dispatcher, user: models.User) -> Update:
+        poll = self.random.choice(self.polls)
+        prompt = self.get_bot_message(user, "comment", "Enter your comment.")
+        dispatcher.user_data[user.get_uid()].update(
+            {"action": models.COMMENT, "pid": poll.get_poll_id(), "opt": 0, "ed": prompt["message_id"]}
+        )
+        return self.build_update(dispatcher.bot, message=self.build_message(user, f"Comment {self.random.random()}"))
+
+    def generate_allocate(self, dispatcher: Dispatcher, user: models.User) -> Update:
+        _list = self.random.choice(self.lists)
+        opt_id = self.random.randrange(OPTIONS_PER_LIST)
+        buttons = [
+            button for row in _list.build_choice_buttons(opt_id).inline_keyboard for button in row
+            if button.callback_data and is_option_action(button.callback_data, models.CHOICE)
+        ]
+        message = self.get_bot_message(
+            user, _list.get_list_id(), _list.render_text(), _list.build_choice_buttons(opt_id)
+        )
+        return self.build_callback_query(
+            dispatcher.bot, user, self.random.choice(buttons).callback_data, message=message
+        )
+
+    def generate_inline(self, dispatcher: Dispatcher, user: models.User) -> Update:
+        inline_query = {
+            "id": str(self.random.getrandbits(63)), "from": self.build_user(user), "offset": "",
+            "query": self.random.choice(INLINE_QUERY_WORDS), "chat_type": "supergroup",
+        }
+        return self.build_update(dispatcher.bot, inline_query=inline_query)
+
+    def generate_template(self, dispatcher: Dispatcher, user: models.User) -> Update:
+        text = f"/{bot.TEMPLATE_COMMAND} p {self.template_names[user.get_uid()]}"
+        entities = [{"type": "bot_command", "offset": 0, "length": len(bot.TEMPLATE_COMMAND) + 1}]
+        return self.build_update(dispatcher.bot, message=self.build_message(user, text, entities))
+
+
+def is_option_action(callback_data: str, name: str) -> bool:
+    """Checks if the callback data is for an unpaged action with the given name."""
+    decoded_data = util.decode_callback_data(callback_data)
+    if not decoded_data:
+        return False
+    action = parse_action(decoded_data[1])
+    return action.name == name and not action.is_paged
+
+
+def compute_percentile(values: Lst[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def summarise(latencies: Lst[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(compute_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(compute_percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """Parses an update mix such as "vote=50,inline=50"."""
+    mix = dict()
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown update kind: {kind}")
+        mix[kind.strip()] = int(weight)
+    return mix
+
+
+def run(update_count: int, rate: float, mix: Dict[str, int], workers: int, run_async: bool, flood_control: bool,
+        api_latency: float, user_count: int, polls_per_user: int, lists_per_user: int, seed: int,
+        timeout: float, use_http=False, flood_probability=0.0) -> dict:
+    db.use_backend(db.MemoryBackend())
+    server = None
+    if use_http:
+        # Requests go over HTTP to the fake Bot API server, through the same request object as the live bot
+        server = FakeTelegramServer(FakeTelegram(api_latency, flood_probability=flood_probability, seed=seed))
+        server.start()
+        request, base_url, api = Request(con_pool_size=bot.CON_POOL_SIZE), server.base_url, server.telegram
+    else:
+        request = api = RecordingRequest(api_latency)
+        base_url = None
+    recorder = LatencyRecorder()
+    dispatcher = build_dispatcher(request, base_url, workers, run_async, flood_control, recorder)
+    bot.readiness_gate.open(dispatcher.update_queue)
+
+    # Seed messages are sent straight to the API, without the pacing of the bot's flood control
+    seed_bot = ExtBot(bot.TOKEN, base_url=base_url, request=request)
+    workload = Workload(user_count, polls_per_user, lists_per_user, seed, seed_bot, api)
+    kinds, weights = zip(*mix.items())
+    updates = [
+        (kind, workload.generate(kind, dispatcher))
+        for kind in workload.random.choices(kinds, weights=weights, k=update_count)
+    ]
+    api.reset_stats()
+
+    dispatcher_thread = threading.Thread(target=dispatcher.start, name="dispatcher", daemon=True)
+    dispatcher_thread.start()
+    dispatcher.job_queue.start()
+
+    start_time = time.perf_counter()
+    for i, (kind, update) in enumerate(updates):
+        if rate:
+            delay = start_time + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        recorder.queue(dispatcher.update_queue, update, kind)
+    is_complete = recorder.wait(update_count, timeout)
+    end_time = max(recorder.done_times.values(), default=start_time)
+
+    dispatcher.job_queue.stop()
+    dispatcher.stop()
+    if server:
+        server.shutdown()
+        server.server_close()
+
+    latencies = recorder.get_latencies()
+    all_latencies = [latency for kind_latencies in latencies.values() for latency in kind_latencies]
+    elapsed_time = end_time - start_time
+    return {
+        "complete": is_complete,
+        "updates": len(all_latencies),
+        "elapsed_s": round(elapsed_time, 3),
+        "updates_per_s": round(len(all_latencies) / elapsed_time, 1) if elapsed_time else 0.0,
+        "latency": summarise(all_latencies),
+        "latency_by_kind": {kind: summarise(kind_latencies) for kind, kind_latencies in sorted(latencies.items())},
+        "api": api.get_stats(),
+    }
+
+
+def main(args: Optional[Lst[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates to replay")
+    parser.add_argument("--rate", type=float, default=0, help="updates queued per second, 0 for as fast as possible")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="eg. vote=50,comment=10,inline=40")
+    parser.add_argument("--workers", type=int, default=bot.WORKERS, help="dispatcher worker threads")
+    parser.add_argument("--async", dest="run_async", action="store_true", help="run all handlers on the workers")
+    parser.add_argument(
+        "--no-flood-control", dest="flood_control", action="store_false", help="send requests without pacing them"
+    )
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds taken by each API request")
+    parser.add_argument("--http", action="store_true", help="send requests over HTTP to the fake Bot API server")
+    parser.add_argument("--flood-probability", type=float, default=0.0, help="chance of each HTTP request hitting 429")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--polls-per-user", type=int, default=4)
+    parser.add_argument("--lists-per-user", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the updates to be handled")
+    options = parser.parse_args(args)
+
+    report = run(
+        options.updates, options.rate, options.mix, options.workers, options.run_async, options.flood_control,
+        options.api_latency, options.users, options.polls_per_user, options.lists_per_user, options.seed,
+        options.timeout, options.http, options.flood_probability
+    )
+    print(json.dumps(report, indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
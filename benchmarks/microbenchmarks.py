@@ -0,0 +1,380 @@
+"""Microbenchmarks of the model hot paths.
+
+Run from the repository root with `python -m benchmarks.microbenchmarks`. Each benchmark reports operations per
+second and the peak memory allocated by one operation, and is compared against the stored baseline. The run fails
+if any benchmark is slower, or allocates more, than its baseline by more than the threshold. Save new baselines with
+`--save-baseline` after a change that is meant to change the numbers.
+
+The speed of a shared machine drifts by tens of percent from minute to minute, which swamps the changes worth
+catching. So each round of a benchmark is timed right after a round of a fixed reference workload, and speeds are
+compared as the median ratio of the two, which cancels out the drift.
+
+The baselines record the environment they were measured in. Speeds are only compared on the same machine and Python
+version, and allocations only on the same Python version, as neither carries over to other environments.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List as Lst, NamedTuple, Optional, Tuple
+
+import models
+import util
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_THRESHOLD = 0.3  # Fraction of the baseline that a benchmark may lose or allocate more before it regresses
+MIN_PEAK_BYTES_CHANGE = 1024  # Smaller changes in allocations are noise from the allocator, not regressions
+CPU_INFO_PATH = "/proc/cpuinfo"
+MIN_ROUND_TIME = 0.1  # In seconds
+ROUNDS = 9
+CONFIRM_RUNS = 2  # Reruns of a benchmark that regressed, before the regression is reported
+
+POLL_RESPONDENT_COUNTS = (10, 100, 1000, 10000)
+LIST_CHOICE_COUNTS = (10, 100, 1000, 5000)
+FORMAT_CODE_COUNTS = (1, 10, 50)
+TEXT_LENGTHS = (100, 10000)
+ITEM_COUNTS = (10, 100, 1000)
+OPTIONS_PER_POLL = 5
+OPTIONS_PER_LIST = 5
+FIRST_USER_ID = 1000000
+REFERENCE_ITEM_COUNT = 200
+
+
+class Benchmark(NamedTuple):
+    """Benchmark of an operation, which is built by the setup function on synthetic fixtures."""
+    name: str
+    setup: Callable[[], Callable[[], Any]]
+
+
+class Result(NamedTuple):
+    name: str
+    ops_per_s: float
+    relative_speed: float  # Operations per reference operation
+    peak_bytes: int
+
+
+# region FIXTURES
+
+def build_poll(respondent_count: int) -> models.Poll:
+    """Builds a multi-response poll with the respondents spread across its options, a quarter of them commenting."""
+    options = [
+        models.Option.load(f"Option {i}", False, [
+            (FIRST_USER_ID + j, (f"User{j}", f"Last{j}", f"Comment {j}" if j % 4 == 0 else ""))
+            for j in range(i, respondent_count, OPTIONS_PER_POLL)
+        ]) for i in range(OPTIONS_PER_POLL)
+    ]
+    return models.Poll(
+        "bnch", "Benchmark poll", FIRST_USER_ID, "Benchmark poll description", options, False, OrderedDict(),
+        models.EXPIRY, datetime.now(tz=models.tz)
+    )
+
+
+def build_list(choice_count: int) -> models.List:
+    """Builds a multi-response list with half of its choices allocated to its options."""
+    choices = [f"Choice {i}" for i in range(choice_count)]
+    options = [models.ListOption.create_new(f"Option {i}") for i in range(OPTIONS_PER_LIST)]
+    for choice_id in range(0, choice_count, 2):
+        options[choice_id % OPTIONS_PER_LIST].add_allocation(choice_id, choices[choice_id])
+    return models.List(
+        "bnch", "Benchmark list", FIRST_USER_ID, "Benchmark list description", options, choices, False,
+        OrderedDict(), models.EXPIRY, datetime.now(tz=models.tz)
+    )
+
+
+def build_format_text_code(code_count: int) -> models.FormatTextCode:
+    format_string = " ".join(
+        f"%st#label{i}$(default {i})$" if i % 3 else f"%dg#label{i}$({i})$" for i in range(code_count)
+    )
+    return models.FormatTextCode.create_new(format_string)
+
+
+def invalidate(entity: Any) -> None:
+    """Moves the entity to a new version, so that its cached markups are built again."""
+    entity.version = next(models.version_counter)
+    return
+
+
+# endregion
+
+# region BENCHMARKS
+
+def setup_poll_toggle(respondent_count: int) -> Callable[[], Any]:
+    poll = build_poll(respondent_count)
+    profile = {"first_name": "Voter", "last_name": "", "username": "voter"}
+    # Each call adds the voter to the option, or removes them from it
+    return lambda: poll.toggle(0, FIRST_USER_ID - 1, profile)
+
+
+def setup_poll_render_text(respondent_count: int) -> Callable[[], Any]:
+    return build_poll(respondent_count).render_text
+
+
+def setup_option_generate_namelist(respondent_count: int) -> Callable[[], Any]:
+    return build_poll(respondent_count).get_options()[0].generate_namelist
+
+
+def setup_list_toggle(choice_count: int) -> Callable[[], Any]:
+    _list = build_list(choice_count)
+    return lambda: _list.toggle(0, 1)
+
+
+def setup_list_build_choice_buttons(choice_count: int) -> Callable[[], Any]:
+    _list = build_list(choice_count)
+
+    def build_choice_buttons() -> Any:
+        invalidate(_list)
+        return _list.build_choice_buttons(0)
+    return build_choice_buttons
+
+
+def setup_render_format_text(code_count: int) -> Callable[[], Any]:
+    format_text_code = build_format_text_code(code_count)
+    format_inputs = "\n".join(f"value {i}" if i % 3 else str(i) for i in range(code_count))
+    return lambda: format_text_code.render_format_text(format_inputs)
+
+
+def setup_strip_html_symbols(text_length: int) -> Callable[[], Any]:
+    text = ("<b>Tom & Jerry</b> " * (text_length // 19 + 1))[:text_length]
+    return lambda: util.strip_html_symbols(text)
+
+
+def setup_get_unique_and_duplicate_items(item_count: int) -> Callable[[], Any]:
+    # Half of the items are new, with some repeated, and half are already existing
+    items = [f"Item {i % (item_count // 2 + 1)}" for i in range(item_count // 2)] + \
+            [f"Existing {i}" for i in range(item_count // 2)]
+    existing_items = [f"Existing {i}" for i in range(item_count)]
+    return lambda: util.get_unique_and_duplicate_items(items, existing_items)
+
+
+def build_benchmarks() -> Lst[Benchmark]:
+    benchmarks = []
+    for count in POLL_RESPONDENT_COUNTS:
+        benchmarks.append(Benchmark(f"poll_toggle[{count}]", lambda count=count: setup_poll_toggle(count)))
+        benchmarks.append(Benchmark(f"poll_render_text[{count}]", lambda count=count: setup_poll_render_text(count)))
+        benchmarks.append(
+            Benchmark(f"option_generate_namelist[{count}]", lambda count=count: setup_option_generate_namelist(count))
+        )
+    for count in LIST_CHOICE_COUNTS:
+        benchmarks.append(Benchmark(f"list_toggle[{count}]", lambda count=count: setup_list_toggle(count)))
+        benchmarks.append(
+            Benchmark(f"list_build_choice_buttons[{count}]", lambda count=count: setup_list_build_choice_buttons(count))
+        )
+    for count in FORMAT_CODE_COUNTS:
+        benchmarks.append(
+            Benchmark(f"render_format_text[{count}]", lambda count=count: setup_render_format_text(count))
+        )
+    for length in TEXT_LENGTHS:
+        benchmarks.append(
+            Benchmark(f"strip_html_symbols[{length}]", lambda length=length: setup_strip_html_symbols(length))
+        )
+    for count in ITEM_COUNTS:
+        benchmarks.append(Benchmark(
+            f"get_unique_and_duplicate_items[{count}]", lambda count=count: setup_get_unique_and_duplicate_items(count)
+        ))
+    return benchmarks
+
+
+# endregion
+
+# region RUNNER
+
+def time_operation(operation: Callable[[], Any], number: int) -> float:
+    """Times the operation run the number of times, with garbage collection off as in timeit."""
+    is_gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start_time = time.perf_counter()
+        for _ in range(number):
+            operation()
+        return time.perf_counter() - start_time
+    finally:
+        if is_gc_enabled:
+            gc.enable()
+
+
+def measure_peak_bytes(operation: Callable[[], Any]) -> int:
+    """Measures the peak memory allocated while running the operation once."""
+    tracemalloc.start()
+    try:
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        operation()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak_bytes - start_bytes)
+
+
+def reference_operation() -> Lst[str]:
+    """Fixed workload of plain Python that the benchmarks are timed against."""
+    return sorted(f"Item {i % 97}" for i in range(REFERENCE_ITEM_COUNT))
+
+
+def get_round_number(operation: Callable[[], Any], min_round_time: float) -> int:
+    """Doubles the number of operations per round until a round takes long enough."""
+    number = 1
+    while time_operation(operation, number) < min_round_time:
+        number *= 2
+    return number
+
+
+def run_benchmark(benchmark: Benchmark, min_round_time: float, rounds: int) -> Result:
+    """Runs the operation in rounds of at least the minimum time, each after a round of the reference workload,
+    and takes the medians of the rounds."""
+    operation = benchmark.setup()
+    number = get_round_number(operation, min_round_time)
+    reference_number = get_round_number(reference_operation, min_round_time)
+
+    speeds, relative_speeds = [], []
+    for _ in range(rounds):
+        reference_speed = reference_number / time_operation(reference_operation, reference_number)
+        speed = number / time_operation(operation, number)
+        speeds.append(speed)
+        relative_speeds.append(speed / reference_speed)
+    return Result(
+        benchmark.name, statistics.median(speeds), statistics.median(relative_speeds), measure_peak_bytes(operation)
+    )
+
+
+def get_cpu_model() -> str:
+    if os.path.exists(CPU_INFO_PATH):
+        with open(CPU_INFO_PATH) as cpu_info_file:
+            for line in cpu_info_file:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    return platform.processor()
+
+
+def get_environment() -> Dict[str, str]:
+    """Describes the machine and Python version that the benchmarks run on."""
+    return {
+        "python": f"{platform.python_implementation()} {platform.python_version()}",
+        "machine": f"{get_cpu_model()} ({platform.machine()}, {os.cpu_count()} CPUs)",
+        "system": platform.system(),
+    }
+
+
+class Baselines(NamedTuple):
+    environment: Dict[str, str]
+    results: Dict[str, Dict[str, float]]
+
+
+def load_baselines(path: str) -> Baselines:
+    if not os.path.exists(path):
+        return Baselines(dict(), dict())
+    with open(path) as baselines_file:
+        data = json.load(baselines_file)
+    return Baselines(data.get("environment", dict()), data.get("benchmarks", dict()))
+
+
+def save_baselines(path: str, results: Lst[Result]) -> None:
+    """Stores the results as the baselines, dropping the baselines measured in another environment."""
+    baselines = load_baselines(path)
+    environment = get_environment()
+    saved_results = baselines.results if baselines.environment == environment else dict()
+    saved_results.update({
+        result.name: {
+            "ops_per_s": round(result.ops_per_s, 1), "relative_speed": round(result.relative_speed, 6),
+            "peak_bytes": result.peak_bytes,
+        } for result in results
+    })
+    with open(path, "w") as baselines_file:
+        json.dump({"environment": environment, "benchmarks": dict(sorted(saved_results.items()))}, baselines_file,
+                  indent=2)
+        baselines_file.write("\n")
+    return
+
+
+def compare(result: Result, baseline: Optional[Dict[str, float]], threshold: float, is_speed_compared: bool,
+            is_memory_compared: bool) -> Tuple[str, bool]:
+    """Compares the result against its baseline. Returns the comparison, and whether the result regressed."""
+    if not baseline:
+        return "new", False
+
+    comparisons, is_regression = [], False
+    # Baselines saved before speeds were measured against the reference workload have no relative speed
+    if is_speed_compared and "relative_speed" in baseline:
+        speed_change = result.relative_speed / baseline["relative_speed"] - 1
+        is_slower = speed_change < -threshold
+        comparisons.append(f"speed {speed_change:+.1%}{' SLOWER' if is_slower else ''}")
+        is_regression = is_regression or is_slower
+    if is_memory_compared:
+        peak_bytes_change = result.peak_bytes - baseline["peak_bytes"]
+        is_larger = peak_bytes_change > max(threshold * baseline["peak_bytes"], MIN_PEAK_BYTES_CHANGE)
+        comparisons.append(f"peak {peak_bytes_change:+,} B{' LARGER' if is_larger else ''}")
+        is_regression = is_regression or is_larger
+    if not comparisons:
+        return "not compared", False
+    return f"{', '.join(comparisons)} {'REGRESSION' if is_regression else 'ok'}", is_regression
+
+
+def main(args: Optional[Lst[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("filters", nargs="*", help="only run benchmarks whose names contain any of these")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown or extra allocation, eg. 0.2"
+    )
+    parser.add_argument("--rounds", type=int, default=ROUNDS)
+    parser.add_argument("--min-round-time", type=float, default=MIN_ROUND_TIME, help="in seconds")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="path of the baselines file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baselines")
+    options = parser.parse_args(args)
+
+    baselines = load_baselines(options.baselines)
+    environment = get_environment()
+    is_speed_compared = baselines.environment == environment
+    is_memory_compared = baselines.environment.get("python", None) == environment["python"]
+    if baselines.results and not is_speed_compared:
+        differences = ", ".join(
+            f"{name} {baselines.environment.get(name, 'unknown')!r} here {value!r}"
+            for name, value in environment.items() if baselines.environment.get(name, None) != value
+        )
+        print(f"WARNING: baselines were measured in another environment ({differences}), so speeds are not compared"
+              + ("" if is_memory_compared else " and neither are allocations"))
+    benchmarks = [
+        benchmark for benchmark in build_benchmarks()
+        if not options.filters or any(text in benchmark.name for text in options.filters)
+    ]
+
+    results, regressions = [], []
+    print(f"{'benchmark':<40} {'ops/s':>14} {'relative':>10} {'peak bytes':>12}  vs baseline")
+    for benchmark in benchmarks:
+        baseline = baselines.results.get(benchmark.name, None)
+        result = run_benchmark(benchmark, options.min_round_time, options.rounds)
+        comparison, is_regression = compare(result, baseline, options.threshold, is_speed_compared, is_memory_compared)
+        # A slowdown only counts if the reruns are slow as well
+        for _ in range(CONFIRM_RUNS if is_regression and not options.save_baseline else 0):
+            rerun_result = run_benchmark(benchmark, options.min_round_time, options.rounds)
+            if rerun_result.relative_speed > result.relative_speed:
+                result = result._replace(ops_per_s=rerun_result.ops_per_s, relative_speed=rerun_result.relative_speed)
+            comparison, is_regression = compare(
+                result, baseline, options.threshold, is_speed_compared, is_memory_compared
+            )
+            if not is_regression:
+                break
+        print(f"{result.name:<40} {result.ops_per_s:>14,.1f} {result.relative_speed:>10.4f} {result.peak_bytes:>12,}  {comparison}")
+        results.append(result)
+        if is_regression:
+            regressions.append(result.name)
+
+    if options.save_baseline:
+        save_baselines(options.baselines, results)
+        print(f"Baselines saved to {options.baselines}")
+    elif regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {options.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    return
+
+
+# endregion
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark of saving and loading the bot's data to and from the Google Sheets database.
+
+Run from the repository root, eg. `python -m benchmarks.persistence --polls 1000 10000 100000`.
+The data is saved to the fake spreadsheet in `benchmarks.fake_sheets`, which can add latency and inject failures.
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Callable, List as Lst, Optional, Tuple
+
+import database as db
+import models
+from benchmarks.fake_sheets import REQUESTS_PER_MINUTE, FakeSheetsBackend, FakeSpreadsheet, SheetsApiError
+
+DEFAULT_POLL_COUNTS = (1000, 10000, 100000)
+POLLS_PER_USER = 10
+OPTIONS_PER_POLL = 5
+RESPONDENTS_PER_OPTION = 10
+FIRST_USER_ID = 1000000
+STORAGES = (
+    models.user_storage, models.group_storage, models.poll_storage, models.list_storage,
+    models.temp_poll_storage, models.temp_list_storage
+)
+
+
+def clear_storages() -> None:
+    for storage in STORAGES:
+        storage.clear()
+    return
+
+
+def seed_polls(poll_count: int) -> int:
+    """Adds the polls and their creators to the storages, returning the number of users added.
+    Polls are loaded from JSON, as creating them one by one gets slower as the storage grows.
+    """
+    user_count = max(1, poll_count // POLLS_PER_USER)
+    options_data = [
+        {
+            db.OPTION_TITLE: f"Option {i}",
+            db.OPTION_COMMENT_REQUIRED: False,
+            db.OPTION_RESPONDENTS: [(FIRST_USER_ID + j, (f"User{j}", "", "")) for j in range(RESPONDENTS_PER_OPTION)],
+        } for i in range(OPTIONS_PER_POLL)
+    ]
+    created_date = datetime.now(tz=models.tz).isoformat()
+    poll_ids = [f"bench{i}" for i in range(poll_count)]
+    for i, poll_id in enumerate(poll_ids):
+        models.Poll.load(
+            poll_id, f"Poll {i}", FIRST_USER_ID + i % user_count, "Benchmark poll", options_data, False, [],
+            models.EXPIRY, created_date
+        )
+    for i in range(user_count):
+        models.User.load(
+            FIRST_USER_ID + i, f"User{i}", "", f"user{i}", False, [], [], poll_ids[i::user_count], [], [], []
+        )
+    return user_count
+
+
+def time_call(function: Callable[[], str]) -> Tuple[float, str]:
+    start_time = time.perf_counter()
+    try:
+        result = function()
+    except SheetsApiError as error:
+        result = str(error)
+    return time.perf_counter() - start_time, result
+
+
+def run(poll_count: int, latency: float, cell_latency: float, requests_per_minute: Optional[int],
+        failure_probability: float, seed: int) -> dict:
+    clear_storages()
+    user_count = seed_polls(poll_count)
+
+    spreadsheet = FakeSpreadsheet(latency, cell_latency, requests_per_minute, failure_probability, seed)
+    db.use_backend(FakeSheetsBackend(spreadsheet))
+    save_time, save_result = time_call(models.BotManager.save_data)
+
+    clear_storages()
+    load_time, load_result = time_call(lambda: models.BotManager.load_data()[1])
+    return {
+        "polls": poll_count,
+        "users": user_count,
+        "save_s": round(save_time, 3),
+        "save_result": save_result,
+        "load_s": round(load_time, 3),
+        "load_result": load_result,
+        "loaded_polls": len(models.poll_storage),
+        "largest_cell_characters": max(
+            (len(value) for worksheet in spreadsheet.worksheets.values() for row in worksheet.rows for value in row),
+            default=0
+        ),
+        "sheets": spreadsheet.get_stats(),
+    }
+
+
+def main(args: Optional[Lst[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--polls", type=int, nargs="+", default=DEFAULT_POLL_COUNTS, help="numbers of polls to save")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds taken by each request")
+    parser.add_argument("--cell-latency", type=float, default=0.0, help="seconds taken by each cell sent or received")
+    parser.add_argument("--requests-per-minute", type=int, default=REQUESTS_PER_MINUTE,
+                        help="quota of reads and of writes, 0 for no quota")
+    parser.add_argument("--failure-probability", type=float, default=0.0, help="chance of each request failing")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(args)
+
+    for poll_count in options.polls:
+        report = run(
+            poll_count, options.latency, options.cell_latency, options.requests_per_minute,
+            options.failure_probability, options.seed
+        )
+        print(json.dumps(report, indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,43 @@
 """Main Interface"""
+import io
 import os
 import logging
 import re
-from typing import Tuple, List as Lst, Dict
+import threading
+import time
+from contextlib import nullcontext
+from functools import partial, wraps
+from typing import Callable, ContextManager, Tuple, List as Lst, Dict, Set, Optional, Union
+import memory
+import metrics
 import models
+import tracing
 from models import (
     User, Group, Poll, Option, List, ListOption, Template, PollTemplate, ListTemplate, FormatTextCode, BotManager
 )
 import util
+from router import CallbackRouter, CallbackAction
+from startup import ReadinessGate
+from dedup import RecentKeys, TapSuppressor
+from profiler import SamplingProfiler
+from inline import (
+    InlineAnswer, InlineAnswerCache, InlineAnswerPolicy, InlineQueryKey, InlineQueryTracker, ResponseVersions,
+    get_response_versions
+)
+from outbound import (
+    RefreshScheduler, FanOutExecutor, MessageDigestCache, OutboundScheduler, ScheduledBot, PRIORITY_NAMES,
+    is_not_modified_error, is_permanent_error
+)
 from telegram import (
-    Update, ParseMode, User as TeleUser, Message, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup,
+    Bot, Update, ParseMode, User as TeleUser, Message, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup,
     ReplyKeyboardRemove, InlineQueryResultArticle, InputTextMessageContent, ForceReply, CallbackQuery, InlineQuery
 )
 from telegram.ext import (
     CallbackContext, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
-    ChosenInlineResultHandler, RegexHandler, Filters, Updater, JobQueue
+    ChosenInlineResultHandler, RegexHandler, TypeHandler, Filters, Updater, JobQueue, Defaults, DispatcherHandlerStop,
+    Dispatcher
 )
+from telegram.utils.request import Request
 import telegram.error
 
 # region SETTINGS
@@ -26,7 +48,124 @@ TOKEN = os.environ["TOKEN"]
 ACCESS_KEY = os.environ["ACCESS_KEY"]
 ADMIN_KEYS = os.environ["ADMIN_KEYS"].split("_")
 PORT = int(os.environ.get("PORT", 8443))
-updater = Updater(TOKEN, use_context=True)
+BOT_API_URL = os.environ.get("BOT_API_URL", "https://api.telegram.org/bot")  # Token is appended to the URL
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")  # Served alongside the webhook on the same port
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))  # Fraction of updates traced
+SLOW_TRACE_THRESHOLD = float(os.environ.get("SLOW_TRACE_THRESHOLD", 1.0))  # In seconds, traced updates logged if slower
+DEFAULT_PROFILE_DURATION = 30  # In seconds
+MAX_PROFILE_DURATION = 300  # In seconds
+MEMORY_REPORT_INTERVAL = int(os.environ.get("MEMORY_REPORT_INTERVAL", 600))  # In seconds, between memory gauge updates
+MAX_STATS_AGE = 60  # In seconds, age of the latest memory report that /stats shows instead of measuring again
+LOAD_DATA_ATTEMPTS = 4  # Attempts to load the data at startup before the bot is opened without it
+LOAD_DATA_RETRY_DELAY = 5  # In seconds, before the second attempt, doubled before each attempt after it
+
+# Concurrency settings
+WORKERS = int(os.environ.get("WORKERS", 4))  # Dispatcher worker threads
+JOB_WORKERS = 10  # Size of the job queue thread pool
+FAN_OUT_WORKERS = int(os.environ.get("FAN_OUT_WORKERS", 4))  # Background message editing and deletion threads
+# Every thread above may hold a connection, plus the dispatcher, updater, job queue and main threads
+CON_POOL_SIZE = int(os.environ.get("CON_POOL_SIZE", WORKERS + JOB_WORKERS + FAN_OUT_WORKERS + 4))
+CONNECT_TIMEOUT = float(os.environ.get("CONNECT_TIMEOUT", 5.0))  # In seconds
+READ_TIMEOUT = float(os.environ.get("READ_TIMEOUT", 5.0))  # In seconds
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 40))  # Webhook connections opened by Telegram
+# Set to true to run all handlers on the dispatcher workers instead of one update at a time, which still handle the
+# updates from each user one at a time
+ASYNC_HANDLERS = os.environ.get("ASYNC_HANDLERS", "false").lower() == "true"
+USER_LOCK_STRIPES = 64  # Locks shared by all users, each held while handling an update from one of its users
+
+# Update delivery settings
+MAX_RECENT_UPDATES = 10000  # Update ids remembered to detect duplicate deliveries
+DUPLICATE_UPDATE_WINDOW = 600  # In seconds, time within which a redelivered update is dropped
+DOUBLE_TAP_WINDOW = 1.0  # In seconds, time after a button is tapped within which the user's repeated taps are ignored
+
+# Outbound settings
+outbound_scheduler = OutboundScheduler()
+fan_out_executor = FanOutExecutor(FAN_OUT_WORKERS)
+refresh_scheduler = RefreshScheduler()
+message_digests = MessageDigestCache()
+bot_request = Request(con_pool_size=CON_POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT)
+updater = Updater(
+    bot=ScheduledBot(
+        TOKEN, outbound_scheduler, message_digests, base_url=BOT_API_URL, request=bot_request,
+        defaults=Defaults(run_async=ASYNC_HANDLERS)
+    ),
+    workers=WORKERS, use_context=True
+)
+
+# Updates are held back until the data is loaded
+readiness_gate = ReadinessGate()
+
+# Updates from the same user are handled one at a time, as their handlers share the user's data
+user_locks = [threading.RLock() for _ in range(USER_LOCK_STRIPES)]
+
+# Updates redelivered by Telegram are only handled once
+recent_update_ids = RecentKeys(MAX_RECENT_UPDATES, DUPLICATE_UPDATE_WINDOW)
+recent_callback_query_ids = RecentKeys(MAX_RECENT_UPDATES, DUPLICATE_UPDATE_WINDOW)
+option_taps = TapSuppressor(DOUBLE_TAP_WINDOW)
+
+# Callback query routes
+callback_router = CallbackRouter()
+
+# Inline query answers
+inline_answers = InlineAnswerCache()
+inline_queries = InlineQueryTracker()
+
+# Tracing and profiling
+tracer = tracing.Tracer(TRACE_SAMPLE_RATE, SLOW_TRACE_THRESHOLD)
+sampling_profiler = SamplingProfiler()
+# The bot is referred to by every message kept in user data or job contexts, so it is never counted with them
+memory_reporter = memory.MemoryReporter(excluded_types=(Bot, Dispatcher, JobQueue))
+
+# Metrics
+metrics_registry = metrics.Registry()
+handler_latency = metrics_registry.register(
+    metrics.Histogram("bot_handler_seconds", "Time taken to handle an update by each handler", ("handler",))
+)
+callback_latency = metrics_registry.register(
+    metrics.Histogram("bot_callback_seconds", "Time taken to handle each callback query action", ("subject", "action"))
+)
+api_request_count = metrics_registry.register(
+    metrics.Counter("bot_api_requests_total", "Telegram API requests by method and outcome", ("method", "outcome"))
+)
+api_request_latency = metrics_registry.register(
+    metrics.Histogram("bot_api_request_seconds", "Time taken by Telegram API requests by method", ("method",))
+)
+storage_size = metrics_registry.register(
+    metrics.Gauge("bot_storage_items", "Number of items in each storage", ("storage",))
+)
+storage_memory = metrics_registry.register(
+    metrics.Gauge("bot_storage_bytes", "Approximate memory held by each storage in the latest report", ("storage",))
+)
+duplicate_update_count = metrics_registry.register(
+    metrics.Counter("bot_duplicate_updates_total", "Redelivered updates that were dropped", ("key",))
+)
+data_save_latency = metrics_registry.register(
+    metrics.Histogram("bot_data_save_seconds", "Time taken to save all data to the database")
+)
+data_load_latency = metrics_registry.register(
+    metrics.Histogram("bot_data_load_seconds", "Time taken to load all data from the database")
+)
+outbound_queue_depth = metrics_registry.register(
+    metrics.Gauge("bot_outbound_queue_depth", "Requests waiting for flood control by priority", ("priority",))
+)
+pruned_message_count = metrics_registry.register(
+    metrics.Counter("bot_pruned_messages_total", "Shared messages no longer tracked as they can no longer be edited")
+)
+fan_out_queue_depth = metrics_registry.register(
+    metrics.Gauge("bot_fan_out_queue_depth", "Message edits and deletions waiting for a fan-out worker")
+)
+pending_refresh_count = metrics_registry.register(
+    metrics.Gauge("bot_pending_refreshes", "Polls and lists waiting for their shared messages to be refreshed")
+)
+connection_pool_in_use = metrics_registry.register(
+    metrics.Gauge("bot_connection_pool_in_use", "Requests to Telegram using the connection pool at the same time")
+)
+connection_pool_peak_in_use = metrics_registry.register(
+    metrics.Gauge("bot_connection_pool_peak_in_use", "Most requests to Telegram that used the connection pool at once")
+)
+connection_pool_saturated_count = metrics_registry.register(metrics.Counter(
+    "bot_connection_pool_saturated_total", "Requests to Telegram that found every pooled connection in use"
+))
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -41,6 +180,8 @@ MIN_GROUP_PASS_LENGTH = 4
 MAX_GROUP_PASS_LENGTH = 20
 ACCESS_REQUIRED = True  # Set to False if access is not required to access bot
 QUERY_RESULTS_LIMIT = 20
+SEARCH_RESULTS_PAGE_SIZE = 10  # Inline search results sent at a time, more are sent as the user scrolls
+SEARCH_DEBOUNCE_DELAY = 0.3  # In seconds, time to wait for the user to stop typing before searching
 
 # endregion
 
@@ -133,6 +274,40 @@ ENROL_COMMAND = "enrol"
 PROMOTE_COMMAND = "promote"
 SAVE_COMMAND = "save"
 LOAD_COMMAND = "load"
+PROFILE_COMMAND = "profile"
+STATS_COMMAND = "stats"
+
+# endregion
+
+# region INLINE ANSWER POLICIES
+
+# All answers depend on the user's permissions or data, so none are shared between users
+STATIC_INLINE_ANSWER = InlineAnswerPolicy(cache_time=60, is_personal=True, is_reused=True)
+LIVE_INLINE_ANSWER = InlineAnswerPolicy(cache_time=5, is_personal=True, is_reused=True)
+# Answers which keep the query details for the conversation in the bot's chat must be rebuilt every time
+PROMPT_INLINE_ANSWER = InlineAnswerPolicy(cache_time=0, is_personal=True, is_reused=False)
+# Answers with invite codes must also be rebuilt every time, as the codes are only valid within the hour
+INVITE_INLINE_ANSWER = InlineAnswerPolicy(cache_time=0, is_personal=True, is_reused=False)
+
+INLINE_ANSWER_POLICIES = {
+    START_COMMAND: STATIC_INLINE_ANSWER,
+    KEYBOARD_COMMAND: STATIC_INLINE_ANSWER,
+    POLL_COMMAND: PROMPT_INLINE_ANSWER,
+    POLLS_COMMAND: LIVE_INLINE_ANSWER,
+    LIST_COMMAND: PROMPT_INLINE_ANSWER,
+    LISTS_COMMAND: LIVE_INLINE_ANSWER,
+    TEMPLATE_COMMAND: PROMPT_INLINE_ANSWER,
+    TEMPLATES_COMMAND: LIVE_INLINE_ANSWER,
+    GROUP_COMMAND: PROMPT_INLINE_ANSWER,
+    GROUPS_COMMAND: LIVE_INLINE_ANSWER,
+    GROUP_POLLS_COMMAND: LIVE_INLINE_ANSWER,
+    GROUP_LISTS_COMMAND: LIVE_INLINE_ANSWER,
+    GROUP_TEMPLATES_COMMAND: LIVE_INLINE_ANSWER,
+    INVITE_COMMAND: INVITE_INLINE_ANSWER,
+    HELP_COMMAND: STATIC_INLINE_ANSWER,
+    ENROL_COMMAND: INVITE_INLINE_ANSWER,
+    PROMOTE_COMMAND: LIVE_INLINE_ANSWER,
+}
 
 # endregion
 
@@ -2217,38 +2392,25 @@ def handle_temp_list_conversation(update: Update, context: CallbackContext) -> N
 def handle_callback_query(update: Update, context: CallbackContext) -> None:
     """Handles a callback query."""
     query = update.callback_query
-
-    match = re.match(r"^(\w+)\s+(\w+)\s+(\w+)$", query.data.strip())
-    if not match:
-        handle_general_callback_query(query, context, query.data.strip())
-        return
-
-    subject, action, identifier = match.group(1), match.group(2), match.group(3)
-
-    if subject == models.USER_SUBJECT:
-        handle_user_callback_query(query, context, action, identifier)
-        return
-    elif subject == models.POLL_SUBJECT:
-        handle_poll_callback_query(query, context, action, identifier)
-        return
-    elif subject == models.LIST_SUBJECT:
-        handle_list_callback_query(query, context, action, identifier)
-        return
-    elif subject == models.GROUP_SUBJECT:
-        handle_group_callback_query(query, context, action, identifier)
-        return
-    elif subject == models.TEMP_POLL_SUBJECT:
-        handle_temp_poll_callback_query(query, context, action, identifier)
-        return
-    elif subject == models.TEMP_LIST_SUBJECT:
-        handle_temp_list_callback_query(query, context, action, identifier)
-        return
-    else:
+    if not callback_router.dispatch(query, context):
         logger.warning("Invalid callback query data.")
         query.answer(text="Invalid callback query data!")
-        return
+    return
 
 
+def reject_callback_query(query: CallbackQuery) -> None:
+    """Rejects a callback query with invalid data, and closes its message if it is in the user's private chat.
+    Shared and inline messages are left as they are, as other users still see them.
+    """
+    logger.warning("Invalid callback query data.")
+    query.answer(text="Invalid callback query data!")
+    if is_private_chat(query.message) and query.message.chat.id == query.from_user.id:
+        query.edit_message_reply_markup(None)
+        query.message.delete()
+    return
+
+
+@callback_router.general
 def handle_general_callback_query(query: CallbackQuery, context: CallbackContext, action: str) -> None:
     """Handles a general callback query."""
     user, is_leader, is_admin = get_user_permissions(query.from_user.id)
@@ -2787,7 +2949,8 @@ def handle_show_command_callback_query(query: CallbackQuery, context: CallbackCo
             [f"/{GROUP_COMMAND}", f"/{GROUPS_COMMAND}", f"/{GROUP_POLLS_COMMAND}"],
             [f"/{GROUP_LISTS_COMMAND}", f"/{GROUP_TEMPLATES_COMMAND}", f"/{INVITE_COMMAND}"],
             [f"/{ACCESS_COMMAND}", f"/{ENROL_COMMAND}", f"/{PROMOTE_COMMAND}"],
-            [f"/{SAVE_COMMAND}", f"/{LOAD_COMMAND}", "."]
+            [f"/{SAVE_COMMAND}", f"/{LOAD_COMMAND}", f"/{PROFILE_COMMAND}"],
+            [f"/{STATS_COMMAND}"]
         )
     elif is_leader:
         buttons = util.build_multiple_stacked_keyboard_buttons_markup(
@@ -2812,6 +2975,7 @@ def handle_show_command_callback_query(query: CallbackQuery, context: CallbackCo
     return
 
 
+@callback_router.fallback(models.USER_SUBJECT)
 def handle_user_callback_query(query: CallbackQuery, context: CallbackContext, action: str, uid_string: str) -> None:
     """Handles a user callback query."""
     user = User.get_user_by_id(util.decode(uid_string))
@@ -2840,15 +3004,76 @@ def handle_user_callback_query(query: CallbackQuery, context: CallbackContext, a
         return
 
 
-def handle_poll_callback_query(query: CallbackQuery, context: CallbackContext, action: str, poll_id: str) -> None:
-    """Handles a poll callback query."""
+def get_callback_poll(query: CallbackQuery, poll_id: str) -> Optional[Poll]:
+    """Gets the poll of a callback query, and closes the message if the poll has been deleted."""
     poll = Poll.get_poll_by_id(poll_id)
-
-    # Poll is deleted or has error
     if not poll:
         query.answer(text=DELETED_POLL)
         query.edit_message_reply_markup(None)
         query.message.delete()
+    return poll
+
+
+@callback_router.route(models.POLL_SUBJECT, "")
+def handle_poll_option_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                      poll_id: str) -> None:
+    """Handles a poll option button."""
+    poll = get_callback_poll(query, poll_id)
+    if not poll:
+        return
+
+    opt_id = action.get_int(0)
+    if opt_id is None or len(action.args) != 1:
+        reject_callback_query(query)
+        return
+
+    uid, user_profile = extract_user_data(query.from_user)
+    status, is_applied = option_taps.apply(
+        (uid, models.POLL_SUBJECT, poll_id, opt_id), lambda: poll.toggle(opt_id, uid, user_profile)
+    )
+    if query.inline_message_id:
+        poll.add_message_details(query.inline_message_id)
+    query.answer(text=status or None)
+    # A repeated tap leaves the vote as the first tap set it, so the messages are already up to date
+    if not is_applied:
+        return
+    edit_query_message(query, poll.render_text(), poll.build_option_buttons())
+    refresh_polls(poll, context, fresh_mid=query.inline_message_id or "")
+    return
+
+
+@callback_router.route(models.POLL_SUBJECT, models.REFRESH_OPT)
+def handle_poll_refresh_option_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                              poll_id: str) -> None:
+    """Handles a poll refresh option button."""
+    poll = get_callback_poll(query, poll_id)
+    if not poll:
+        return
+    query.answer(text="Results updated!")
+    edit_query_message(query, poll.render_text(), poll.build_option_buttons())
+    return
+
+
+@callback_router.route(models.POLL_SUBJECT, models.REFRESH)
+def handle_poll_refresh_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                       poll_id: str) -> None:
+    """Handles a poll admin refresh button."""
+    poll = get_callback_poll(query, poll_id)
+    if not poll:
+        return
+    if not is_private_chat(query.message):
+        reject_callback_query(query)
+        return
+    query.answer(text="Results updated!")
+    edit_query_message(query, poll.render_text(), poll.build_admin_buttons())
+    return
+
+
+@callback_router.fallback(models.POLL_SUBJECT)
+def handle_poll_callback_query(query: CallbackQuery, context: CallbackContext, action: str, poll_id: str) -> None:
+    """Handles a poll callback query."""
+    poll = get_callback_poll(query, poll_id)
+    if not poll:
         return
 
     uid, user_profile = extract_user_data(query.from_user)
@@ -2857,27 +3082,8 @@ def handle_poll_callback_query(query: CallbackQuery, context: CallbackContext, a
     is_pm = is_private_chat(message)
     is_creator = poll.get_creator_id() == uid
 
-    # Handle poll option button
-    if action.isdigit():
-        status = poll.toggle(int(action), uid, user_profile)
-        query.edit_message_text(poll.render_text(), parse_mode=ParseMode.HTML, reply_markup=poll.build_option_buttons())
-        query.answer(text=status)
-        refresh_polls(poll, context)
-        return
-    # Handle refresh option button
-    elif action == models.REFRESH_OPT:
-        query.answer(text="Results updated!")
-        query.edit_message_text(poll.render_text(), parse_mode=ParseMode.HTML, reply_markup=poll.build_option_buttons())
-        return
-    # Handle refresh button
-    elif action == models.REFRESH and is_pm:
-        query.answer(text="Results updated!")
-        query.edit_message_text(
-            poll.render_text(), parse_mode=ParseMode.HTML, reply_markup=poll.build_admin_buttons()
-        )
-        return
     # Handle customise button
-    elif action == models.SETTINGS and is_pm:
+    if action == models.SETTINGS and is_pm:
         query.edit_message_reply_markup(poll.build_settings_buttons(is_creator=is_creator))
         query.answer(text=None)
         return
@@ -2945,14 +3151,10 @@ def handle_poll_callback_query(query: CallbackQuery, context: CallbackContext, a
     # Handle delete confirmation button
     elif action == f"{models.DELETE_YES}_{models.POLL}" and is_pm and is_creator:
         user.delete_poll(poll_id)
-        for mid in poll.get_message_details():
-            try:
-                context.bot.edit_message_text(
-                    f"<b>{poll.get_title()}</b>\n<i>This poll has been <b>closed</b>.</i>",
-                    inline_message_id=mid, parse_mode=ParseMode.HTML, reply_markup=None
-                )
-            except telegram.error.TelegramError:
-                continue
+        close_inline_messages(
+            context.bot, poll.get_message_details(),
+            f"<b>{poll.get_title()}</b>\n<i>This poll has been <b>closed</b>.</i>"
+        )
         query.answer(text="Poll deleted!")
         query.edit_message_reply_markup(None)
         query.message.delete()
@@ -2987,131 +3189,177 @@ def handle_poll_callback_query(query: CallbackQuery, context: CallbackContext, a
         return
 
 
-def handle_list_callback_query(query: CallbackQuery, context: CallbackContext, action: str, list_id: str) -> None:
-    """Handles a poll callback query."""
+def get_callback_list(query: CallbackQuery, list_id: str) -> Optional[List]:
+    """Gets the list of a callback query, and closes the message if the list has been deleted."""
     _list = List.get_list_by_id(list_id)
-
-    # List is deleted or has error
     if not _list:
         query.answer(text=DELETED_LIST)
         query.edit_message_reply_markup(None)
         query.message.delete()
+    return _list
+
+
+@callback_router.route(models.LIST_SUBJECT, models.OPTIONS)
+def handle_list_options_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                       list_id: str) -> None:
+    """Handles a list options button."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
         return
+    query.answer(text=None)
+    query.edit_message_text(_list.render_text(), parse_mode=ParseMode.HTML, reply_markup=_list.build_option_buttons())
+    return
 
-    uid = query.from_user.id
-    user, _, _ = get_user_permissions(uid)
-    message = query.message
-    is_pm = is_private_chat(message)
-    is_creator = _list.get_creator_id() == uid
 
-    # Handle list options button
-    if action == models.OPTIONS:
-        query.answer(text=None)
-        query.edit_message_text(
-            _list.render_text(), parse_mode=ParseMode.HTML, reply_markup=_list.build_option_buttons()
-        )
+@callback_router.route(models.LIST_SUBJECT, models.OPTION)
+def handle_list_option_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                      list_id: str) -> None:
+    """Handles a list option button."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
+        return
+    if not is_private_chat(query.message):
+        reject_callback_query(query)
         return
-    # Handle list option button
-    elif action.startswith(f"{models.OPTION}_") and is_pm:
-        match = re.match(f"^{models.OPTION}_(\\d+)$", action)
-        if not match:
-            logger.warning("Invalid callback query data.")
-            query.answer(text="Invalid callback query data!")
-            return
 
-        opt_id = int(match.group(1))
+    opt_id = action.get_int(0)
+    if opt_id is None or len(action.args) != 1:
+        logger.warning("Invalid callback query data.")
+        query.answer(text="Invalid callback query data!")
+        return
+
+    if not _list.is_valid_option(opt_id):
+        logger.warning(f"Invalid option selected: {opt_id} in list {_list.get_list_id()}.")
+        query.answer(text="Invalid option selected!")
+        return
+
+    option = _list.get_option(opt_id)
+    query.edit_message_reply_markup(_list.build_choice_buttons(opt_id))
+    query.answer(text=f"Select the names you want to pick for {option.get_title()}.")
+    return
 
-        if not _list.is_valid_option(opt_id):
-            logger.warning(f"Invalid option selected: {opt_id} in list {_list.get_list_id()}.")
-            query.answer(text="Invalid option selected!")
-            return
 
-        option = _list.get_option(opt_id)
-        query.edit_message_reply_markup(_list.build_choice_buttons(opt_id))
-        query.answer(text=f"Select the names you want to pick for {option.get_title()}.")
+@callback_router.route(models.LIST_SUBJECT, models.CHOICE)
+def handle_list_choice_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                      list_id: str) -> None:
+    """Handles a list choice button."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
+        return
+    if not is_private_chat(query.message):
+        reject_callback_query(query)
         return
-    # Handle list choice button
-    elif action.startswith(f"{models.CHOICE}_") and is_pm:
-        match = re.match(f"^{models.CHOICE}_(\\d+)_(\\d+)$", action)
-        if not match:
-            logger.warning("Invalid callback query data.")
-            query.answer(text="Invalid callback query data!")
-            return
 
-        opt_id, choice_id = int(match.group(1)), int(match.group(2))
+    opt_id, choice_id = action.get_int(0), action.get_int(1)
+    if opt_id is None or choice_id is None or len(action.args) != 2:
+        logger.warning("Invalid callback query data.")
+        query.answer(text="Invalid callback query data!")
+        return
 
-        if not _list.is_valid_option(opt_id):
-            logger.warning(f"Invalid option selected: {opt_id} in list {_list.get_list_id()}.")
-            query.answer(text="Invalid option selected!")
-            return
+    if not _list.is_valid_option(opt_id):
+        logger.warning(f"Invalid option selected: {opt_id} in list {_list.get_list_id()}.")
+        query.answer(text="Invalid option selected!")
+        return
 
-        if not _list.is_valid_choice(choice_id):
-            logger.warning(f"Invalid choice selected: {choice_id} in list {_list.get_list_id()}.")
-            query.answer(text="Invalid choice selected!")
-            return
+    if not _list.is_valid_choice(choice_id):
+        logger.warning(f"Invalid choice selected: {choice_id} in list {_list.get_list_id()}.")
+        query.answer(text="Invalid choice selected!")
+        return
 
-        status = _list.toggle(opt_id, choice_id)
-        query.edit_message_text(
-            _list.render_text(), parse_mode=ParseMode.HTML,
-            reply_markup=_list.build_choice_buttons(opt_id, index=choice_id)
-        )
-        query.answer(text=status)
-        refresh_lists(_list, context)
+    status, is_applied = option_taps.apply(
+        (query.from_user.id, models.LIST_SUBJECT, list_id, opt_id, choice_id), lambda: _list.toggle(opt_id, choice_id)
+    )
+    query.answer(text=status or None)
+    if not is_applied:
         return
-    # Handle page navigation buttons
-    elif action.startswith(models.PAGE):
-        match = re.match(f"^{models.PAGE}(\\d+)_(.+)$", action)
-        if not match:
-            logger.warning("Invalid callback query data.")
-            query.answer(text="Invalid callback query data!")
-            return
+    edit_query_message(query, _list.render_text(), _list.build_choice_buttons(opt_id, index=choice_id))
+    refresh_lists(_list, context)
+    return
 
-        page_number, sub_action = int(match.group(1)), match.group(2)
 
-        choice_match = re.match(f"^{models.CHOICE}_(\\d+)$", sub_action)
-        if choice_match:
-            opt_id = int(choice_match.group(1))
+@callback_router.route(models.LIST_SUBJECT, models.CHOICE, paged=True)
+def handle_list_choice_page_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                           list_id: str) -> None:
+    """Handles a page navigation button of list choices."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
+        return
 
-            if not _list.is_valid_option(opt_id):
-                logger.warning(f"Invalid option selected: {opt_id} in list {_list.get_list_id()}.")
-                query.answer(text="Invalid option selected!")
-                return
+    opt_id = action.get_int(0)
+    if opt_id is None or len(action.args) != 1:
+        reject_callback_query(query)
+        return
 
-            query.edit_message_text(
-                _list.render_text(), parse_mode=ParseMode.HTML,
-                reply_markup=_list.build_choice_buttons(opt_id, page_number=page_number)
-            )
-            query.answer(text=None)
-            return
+    if not _list.is_valid_option(opt_id):
+        logger.warning(f"Invalid option selected: {opt_id} in list {_list.get_list_id()}.")
+        query.answer(text="Invalid option selected!")
+        return
 
-        logger.warning("Invalid callback query data.")
-        query.answer(text="Invalid callback query data!")
-        query.edit_message_reply_markup(None)
-        query.message.delete()
+    query.edit_message_text(
+        _list.render_text(), parse_mode=ParseMode.HTML,
+        reply_markup=_list.build_choice_buttons(opt_id, page_number=action.page_number)
+    )
+    query.answer(text=None)
+    return
+
+
+@callback_router.route(models.LIST_SUBJECT, models.USER_REFRESH)
+def handle_list_user_refresh_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                            list_id: str) -> None:
+    """Handles a list refresh button of a shared list."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
         return
-    # Handle user refresh option button
-    elif action == models.USER_REFRESH:
-        query.answer(text="Results updated!")
-        query.edit_message_text(
-            _list.render_text(), parse_mode=ParseMode.HTML, reply_markup=_list.build_update_buttons()
-        )
+    query.answer(text="Results updated!")
+    edit_query_message(query, _list.render_text(), _list.build_update_buttons())
+    return
+
+
+@callback_router.route(models.LIST_SUBJECT, models.REFRESH_OPT)
+def handle_list_refresh_option_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                              list_id: str) -> None:
+    """Handles a list refresh option button."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
         return
-    # Handle refresh option button
-    elif action == models.REFRESH_OPT and is_pm:
-        query.answer(text="Results updated!")
-        query.edit_message_text(
-            _list.render_text(), parse_mode=ParseMode.HTML, reply_markup=_list.build_option_buttons()
-        )
+    if not is_private_chat(query.message):
+        reject_callback_query(query)
         return
-    # Handle admin refresh button
-    elif action == models.REFRESH and is_pm:
-        query.answer(text="Results updated!")
-        query.edit_message_text(
-            _list.render_text(), parse_mode=ParseMode.HTML, reply_markup=_list.build_admin_buttons()
-        )
+    query.answer(text="Results updated!")
+    edit_query_message(query, _list.render_text(), _list.build_option_buttons())
+    return
+
+
+@callback_router.route(models.LIST_SUBJECT, models.REFRESH)
+def handle_list_refresh_callback_query(query: CallbackQuery, context: CallbackContext, action: CallbackAction,
+                                       list_id: str) -> None:
+    """Handles a list admin refresh button."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
+        return
+    if not is_private_chat(query.message):
+        reject_callback_query(query)
         return
+    query.answer(text="Results updated!")
+    edit_query_message(query, _list.render_text(), _list.build_admin_buttons())
+    return
+
+
+@callback_router.fallback(models.LIST_SUBJECT)
+def handle_list_callback_query(query: CallbackQuery, context: CallbackContext, action: str, list_id: str) -> None:
+    """Handles a list callback query."""
+    _list = get_callback_list(query, list_id)
+    if not _list:
+        return
+
+    uid = query.from_user.id
+    user, _, _ = get_user_permissions(uid)
+    message = query.message
+    is_pm = is_private_chat(message)
+    is_creator = _list.get_creator_id() == uid
+
     # Handle customise button
-    elif action == models.SETTINGS and is_pm:
+    if action == models.SETTINGS and is_pm:
         query.edit_message_reply_markup(_list.build_settings_buttons(is_creator=is_creator))
         query.answer(text=None)
         return
@@ -3129,14 +3377,10 @@ def handle_list_callback_query(query: CallbackQuery, context: CallbackContext, a
     # Handle delete confirmation button
     elif action == f"{models.DELETE_YES}_{models.LIST}" and is_pm and is_creator:
         user.delete_list(list_id)
-        for mid in _list.get_message_details():
-            try:
-                context.bot.edit_message_text(
-                    f"<b>{_list.get_title()}</b>\n<i>This list has been <b>closed</b>.</i>",
-                    inline_message_id=mid, parse_mode=ParseMode.HTML, reply_markup=None
-                )
-            except telegram.error.TelegramError:
-                continue
+        close_inline_messages(
+            context.bot, _list.get_message_details(),
+            f"<b>{_list.get_title()}</b>\n<i>This list has been <b>closed</b>.</i>"
+        )
         query.answer(text="List deleted!")
         query.edit_message_reply_markup(None)
         query.message.delete()
@@ -3171,6 +3415,7 @@ def handle_list_callback_query(query: CallbackQuery, context: CallbackContext, a
         return
 
 
+@callback_router.fallback(models.GROUP_SUBJECT)
 def handle_group_callback_query(query: CallbackQuery, context: CallbackContext, action: str, gid: str) -> None:
     """Handles a group callback query."""
     if not is_private_chat(query.message):
@@ -3528,6 +3773,7 @@ def handle_group_callback_query(query: CallbackQuery, context: CallbackContext,
         return
 
 
+@callback_router.fallback(models.TEMP_POLL_SUBJECT)
 def handle_temp_poll_callback_query(query: CallbackQuery, context: CallbackContext, action: str, temp_id: str) -> None:
     """Handles a poll template callback query."""
     template: PollTemplate = PollTemplate.get_template_by_id(temp_id)
@@ -3909,6 +4155,7 @@ def handle_temp_poll_callback_query(query: CallbackQuery, context: CallbackConte
         return
 
 
+@callback_router.fallback(models.TEMP_LIST_SUBJECT)
 def handle_temp_list_callback_query(query: CallbackQuery, context: CallbackContext, action: str, temp_id: str) -> None:
     """Handles a poll template callback query."""
     template: ListTemplate = ListTemplate.get_template_by_id(temp_id)
@@ -4297,14 +4544,29 @@ def handle_temp_list_callback_query(query: CallbackQuery, context: CallbackConte
 # region INLINE QUERY HANDLERS
 
 
+def track_inline_query(update: Update, context: CallbackContext) -> None:
+    """Records the newest inline query of the user before any inline query is handled."""
+    inline_queries.track(update.inline_query)
+    return
+
+
 def handle_inline_query(update: Update, context: CallbackContext) -> None:
     """Handles an inline query."""
     query = update.inline_query
+    if inline_queries.is_stale(query):
+        return
     text = query.query.strip()
     uid = update.effective_user.id
     user, is_leader, is_admin = get_user_permissions(uid)
     is_sender = query.chat_type == "sender"
 
+    # Reuse the answer to the same query if nothing has changed since
+    cache_key = InlineQueryKey.of(query, models.get_data_version())
+    cached_answer = inline_answers.get(cache_key)
+    if cached_answer:
+        cached_answer.send(query)
+        return
+
     results = []
 
     # Handle vote and comment queries
@@ -4450,61 +4712,91 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
     if match:
         command, details = match.group(1), match.group(2)
         details = details.strip() if details else ""
+        policy = INLINE_ANSWER_POLICIES.get(command, STATIC_INLINE_ANSWER)
         # Handle start query
         if command == START_COMMAND and is_sender:
-            query.answer(results, switch_pm_text="Click to view the bot's welcome message", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view the bot's welcome message", switch_pm_parameter=command
+            )
             return
         # Handle keyboard query
         elif command == KEYBOARD_COMMAND and is_sender:
-            query.answer(results, switch_pm_text="Show or hide the command keyboard", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Show or hide the command keyboard", switch_pm_parameter=command
+            )
             return
         # Handle poll query
         elif command == POLL_COMMAND and user and is_sender:
             if details:
                 context.user_data.update({"title": details})
-                query.answer(
-                    results, switch_pm_text="Click to build a new poll with the title", switch_pm_parameter=command
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to build a new poll with the title", switch_pm_parameter=command
                 )
             else:
-                query.answer(results, switch_pm_text="Click to build a new poll", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to build a new poll", switch_pm_parameter=command
+                )
             return
         # Handle polls query
         elif command == POLLS_COMMAND and user and is_sender:
-            for poll in user.get_polls(details)[:QUERY_RESULTS_LIMIT]:
+            polls = user.get_polls(details)[:QUERY_RESULTS_LIMIT]
+            response_versions = get_response_versions(polls)
+            for poll in polls:
                 query_result = InlineQueryResultArticle(
                     id=f"poll_{poll.get_poll_id()}", title=poll.get_title(),
                     description=poll.generate_options_summary(),
                     input_message_content=InputTextMessageContent(f"/poll_{poll.get_poll_id()}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your polls", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your polls", switch_pm_parameter=command,
+                response_versions=response_versions
+            )
             return
         # Handle list query
         elif command == LIST_COMMAND and user and is_sender:
             if details:
                 context.user_data.update({"title": details})
-                query.answer(
-                    results, switch_pm_text="Click to build a new list with the title", switch_pm_parameter=command
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to build a new list with the title", switch_pm_parameter=command
                 )
             else:
-                query.answer(results, switch_pm_text="Click to build a new list", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to build a new list", switch_pm_parameter=command
+                )
             return
         # Handle lists query
         elif command == LISTS_COMMAND and user and is_sender:
-            for _list in user.get_lists(details)[:QUERY_RESULTS_LIMIT]:
+            lists = user.get_lists(details)[:QUERY_RESULTS_LIMIT]
+            response_versions = get_response_versions(lists)
+            for _list in lists:
                 query_result = InlineQueryResultArticle(
                     id=f"list_{_list.get_list_id()}", title=_list.get_title(),
                     description=_list.generate_options_summary(),
                     input_message_content=InputTextMessageContent(f"/list_{_list.get_list_id()}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your lists", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your lists", switch_pm_parameter=command,
+                response_versions=response_versions
+            )
             return
         # Handle template query
         elif command == TEMPLATE_COMMAND and user and is_sender:
             create_match = re.match(r"^(p|poll|l|list)\s+(\w+)\s*(\n(?:\n|.)*)?$", details)
             if not create_match:
-                query.answer(results, switch_pm_text="Click to create a new template", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to create a new template", switch_pm_parameter=command
+                )
                 return
 
             template_type, name, format_inputs = create_match.group(1), create_match.group(2), create_match.group(3)
@@ -4514,16 +4806,25 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
             elif template_type in ("l", "list"):
                 template = user.get_temp_list_by_name(name)
             else:
-                query.answer(results, switch_pm_text="Click to create a new template", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to create a new template", switch_pm_parameter=command
+                )
                 return
 
             if not template:
-                query.answer(results, switch_pm_text="Click to create a new template", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to create a new template", switch_pm_parameter=command
+                )
                 return
 
             title, description, is_valid = template.render_title_and_description(format_inputs)
             if not is_valid:
-                query.answer(results, switch_pm_text="Click to create a new template", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to create a new template", switch_pm_parameter=command
+                )
                 return
 
             query_result = InlineQueryResultArticle(
@@ -4542,17 +4843,24 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                     input_message_content=InputTextMessageContent(f"/temp_{template.temp_id}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your templates", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your templates", switch_pm_parameter=command
+            )
             return
         # Handle group query
         elif command == GROUP_COMMAND and is_leader and is_sender:
             if details:
                 context.user_data.update({"name": details})
-                query.answer(
-                    results, switch_pm_text="Click to create a new group with a name", switch_pm_parameter=command
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to create a new group with a name", switch_pm_parameter=command
                 )
             else:
-                query.answer(results, switch_pm_text="Click to create a new group", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to create a new group", switch_pm_parameter=command
+                )
             return
         # Handle groups query
         elif command == GROUPS_COMMAND and user and is_sender:
@@ -4563,29 +4871,44 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                     input_message_content=InputTextMessageContent(f"/group_{group.get_gid()}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your joined groups", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your joined groups", switch_pm_parameter=command
+            )
             return
         # Handle group polls query
         elif command == GROUP_POLLS_COMMAND and user and is_sender:
-            for poll in user.get_group_polls(details)[:QUERY_RESULTS_LIMIT]:
+            polls = user.get_group_polls(details)[:QUERY_RESULTS_LIMIT]
+            response_versions = get_response_versions(polls)
+            for poll in polls:
                 query_result = InlineQueryResultArticle(
                     id=f"gpoll_{poll.get_poll_id()}", title=poll.get_title(),
                     description=poll.generate_options_summary(),
                     input_message_content=InputTextMessageContent(f"/poll_{poll.get_poll_id()}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your group polls", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your group polls", switch_pm_parameter=command,
+                response_versions=response_versions
+            )
             return
         # Handle group lists query
         elif command == GROUP_LISTS_COMMAND and user and is_sender:
-            for _list in user.get_group_lists(details)[:QUERY_RESULTS_LIMIT]:
+            lists = user.get_group_lists(details)[:QUERY_RESULTS_LIMIT]
+            response_versions = get_response_versions(lists)
+            for _list in lists:
                 query_result = InlineQueryResultArticle(
                     id=f"glist_{_list.get_list_id()}", title=_list.get_title(),
                     description=_list.generate_options_summary(),
                     input_message_content=InputTextMessageContent(f"/list_{_list.get_list_id()}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your group lists", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your group lists", switch_pm_parameter=command,
+                response_versions=response_versions
+            )
             return
         # Handle group templates query
         elif command == GROUP_TEMPLATES_COMMAND and user and is_sender:
@@ -4596,12 +4919,18 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                     input_message_content=InputTextMessageContent(f"/temp_{template.temp_id}")
                 )
                 results.append(query_result)
-            query.answer(results, switch_pm_text="Click to view all your group templates", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view all your group templates", switch_pm_parameter=command
+            )
             return
         # Handle invite query
         elif command == INVITE_COMMAND and user:
             if is_sender:
-                query.answer(results, switch_pm_text="Click to send a group invite", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to send a group invite", switch_pm_parameter=command
+                )
                 return
             for group in user.get_owned_groups(details)[:QUERY_RESULTS_LIMIT]:
                 invitation, join_button = group.build_invite_text_and_button(update.effective_user.first_name)
@@ -4611,12 +4940,15 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                     reply_markup=join_button
                 )
                 results.append(query_result)
-            query.answer(results)
+            answer_inline_query(query, cache_key, policy, results)
             return
         # Handle enrol query
         elif command == ENROL_COMMAND and is_admin:
             if is_sender:
-                query.answer(results, switch_pm_text="Click to send a bot access invite", switch_pm_parameter=command)
+                answer_inline_query(
+                    query, cache_key, policy, results,
+                    switch_pm_text="Click to send a bot access invite", switch_pm_parameter=command
+                )
                 return
             if details.isdigit():
                 invitation, access_button = BotManager.build_invite_text_and_button(ACCESS_KEY, int(details))
@@ -4626,7 +4958,7 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                     reply_markup=access_button
                 )
                 results.append(query_result)
-            query.answer(results)
+            answer_inline_query(query, cache_key, policy, results)
             return
         # Handle promote query
         elif command == PROMOTE_COMMAND and is_admin and is_sender:
@@ -4637,22 +4969,34 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                         input_message_content=InputTextMessageContent(f"/promote {util.encode(user.get_uid())}"),
                     )
                     results.append(query_result)
-            query.answer(
-                results[:20], switch_pm_text="Click to promote a user to a bot leader", switch_pm_parameter=command
+            answer_inline_query(
+                query, cache_key, policy, results[:20],
+                switch_pm_text="Click to promote a user to a bot leader", switch_pm_parameter=command
             )
             return
         # Handle help query
         elif command == HELP_COMMAND and is_sender:
-            query.answer(results, switch_pm_text="Click to view the help message", switch_pm_parameter=command)
+            answer_inline_query(
+                query, cache_key, policy, results,
+                switch_pm_text="Click to view the help message", switch_pm_parameter=command
+            )
             return
         # Handle other query
         else:
-            query.answer(results)
+            answer_inline_query(query, cache_key, policy, results)
             return
 
     # Handle search everything
+    next_offset, response_versions = None, ()
     if user:
-        items = user.get_everything(text)[:QUERY_RESULTS_LIMIT]
+        # Only search once the user stops typing, unless the user is scrolling through the results
+        if not query.offset and not inline_queries.debounce(query, SEARCH_DEBOUNCE_DELAY):
+            return
+        offset = int(query.offset) if query.offset.isdigit() else 0
+        items, has_more = user.get_latest_everything(text, SEARCH_RESULTS_PAGE_SIZE, offset)
+        if has_more:
+            next_offset = str(offset + SEARCH_RESULTS_PAGE_SIZE)
+        response_versions = get_response_versions(items)
         for item in items:
             if type(item) == Poll:
                 query_result = InlineQueryResultArticle(
@@ -4672,7 +5016,24 @@ def handle_inline_query(update: Update, context: CallbackContext) -> None:
                 continue
             results.append(query_result)
 
-    query.answer(results)
+    answer_inline_query(
+        query, cache_key, LIVE_INLINE_ANSWER, results, next_offset=next_offset, response_versions=response_versions
+    )
+    return
+
+
+def answer_inline_query(query: InlineQuery, cache_key: InlineQueryKey, policy: InlineAnswerPolicy,
+                        results: Lst[InlineQueryResultArticle], switch_pm_text=None, switch_pm_parameter=None,
+                        next_offset=None, response_versions: ResponseVersions = ()) -> None:
+    """Answers an inline query according to the answer policy, and keeps the answer for repeated queries
+    until the data or the responses to the polls and lists in it change.
+    """
+    answer = InlineAnswer(
+        tuple(results), switch_pm_text, switch_pm_parameter, next_offset, policy.cache_time, policy.is_personal
+    )
+    if policy.is_reused:
+        inline_answers.put(cache_key, answer, response_versions)
+    answer.send(query)
     return
 
 
@@ -4734,6 +5095,45 @@ def handle_chosen_list_result(update: Update, context: CallbackContext) -> None:
 # region OTHER HANDLERS
 
 
+def hold_update_until_ready(update: Update, context: CallbackContext) -> None:
+    """Stops handling updates that arrive before the data is loaded, they are handled again once it is loaded."""
+    if readiness_gate.hold(update):
+        raise DispatcherHandlerStop()
+    return
+
+
+def get_user_lock(update: object) -> ContextManager:
+    user = update.effective_user if isinstance(update, Update) else None
+    return user_locks[user.id % USER_LOCK_STRIPES] if user else nullcontext()
+
+
+def serialised_by_user(callback: Callable) -> Callable:
+    """Runs the handler callback while holding the lock of the user who sent the update.
+
+    With asynchronous handlers, updates from the same user are otherwise handled at the same time on different
+    workers, and race on the user's data, such as the step of a multi-step action or the message to delete.
+    """
+    @wraps(callback)
+    def serialised_callback(update: object, context: CallbackContext) -> None:
+        with get_user_lock(update):
+            return callback(update, context)
+    return serialised_callback
+
+
+def drop_duplicate_update(update: Update, context: CallbackContext) -> None:
+    """Stops handling updates that were already handled, such as updates redelivered when the bot is slow."""
+    if not recent_update_ids.add(update.update_id):
+        duplicate_update_count.increment(("update_id",))
+        logger.info(f"Dropped duplicate update {update.update_id}")
+        raise DispatcherHandlerStop()
+    # The same callback query must never toggle a vote twice, even if it comes in another update
+    if update.callback_query and not recent_callback_query_ids.add(update.callback_query.id):
+        duplicate_update_count.increment(("callback_query_id",))
+        logger.info(f"Dropped duplicate callback query {update.callback_query.id} in update {update.update_id}")
+        raise DispatcherHandlerStop()
+    return
+
+
 def handle_error(update: Update, context: CallbackContext) -> None:
     """Logs errors caused by Updates."""
     logger.warning(f"Update {update} caused error {context.error}")
@@ -4747,7 +5147,8 @@ def handle_save(update: Update, context: CallbackContext) -> None:
     if not is_admin:
         handle_help(update, context)
         return
-    status = BotManager.save_data()
+    with data_save_latency.time():
+        status = BotManager.save_data()
     update.message.reply_html(status, reply_markup=util.build_single_button_markup("Close", models.CLOSE))
     return
 
@@ -4760,10 +5161,61 @@ def handle_load(update: Update, context: CallbackContext) -> None:
     if not is_admin:
         handle_help(update, context)
         return
-    status = BotManager.load_data()
+    with data_load_latency.time():
+        is_loaded, status = BotManager.load_data()
+    if is_loaded:
+        readiness_gate.mark_data_loaded()
     update.message.reply_html(status, reply_markup=util.build_single_button_markup("Close", models.CLOSE))
     return
 
+
+def handle_profile(update: Update, context: CallbackContext) -> None:
+    """Profiles all threads for a number of seconds and sends the stacks to the admin (Temporary)."""
+    delete_chat_message(update.message)
+
+    uid = update.effective_user.id
+    _, _, is_admin = get_user_permissions(uid)
+    if not is_admin:
+        handle_help(update, context)
+        return
+    if sampling_profiler.is_running:
+        update.message.reply_html(
+            "A profile is already being taken.", reply_markup=util.build_single_button_markup("Close", models.CLOSE)
+        )
+        return
+
+    duration = int(context.args[0]) if context.args and context.args[0].isdigit() else DEFAULT_PROFILE_DURATION
+    duration = min(max(duration, 1), MAX_PROFILE_DURATION)
+    update.message.reply_html(
+        f"Profiling all threads for <b>{duration}</b> seconds...",
+        reply_markup=util.build_single_button_markup("Close", models.CLOSE)
+    )
+    # Profile on a separate thread so that no dispatcher worker is held up
+    threading.Thread(target=send_profile, args=(context.bot, uid, duration), name="Profiler", daemon=True).start()
+    return
+
+
+def handle_stats(update: Update, context: CallbackContext) -> None:
+    """Shows the memory held by each storage, and the largest polls and lists (Temporary)."""
+    delete_chat_message(update.message)
+
+    _, _, is_admin = get_user_permissions(update.effective_user.id)
+    if not is_admin:
+        handle_help(update, context)
+        return
+    report = memory_reporter.latest_report
+    if report and time.time() - report.created_time <= MAX_STATS_AGE:
+        update.message.reply_html(
+            render_memory_report(report), reply_markup=util.build_single_button_markup("Close", models.CLOSE)
+        )
+        return
+    update.message.reply_html(
+        "Measuring the memory footprint...", reply_markup=util.build_single_button_markup("Close", models.CLOSE)
+    )
+    # Measuring walks through all the data, so it is done on the job queue so that no update is held up
+    context.job_queue.run_once(send_memory_report_job, 0, context=update.effective_user.id, name="Stats job")
+    return
+
 # endregion
 
 # region HELPERS
@@ -4816,7 +5268,7 @@ def edit_conversation_message(update: Update, context: CallbackContext, text: st
             text, chat_id=update.effective_chat.id, message_id=mid, parse_mode=ParseMode.HTML, reply_markup=reply_markup
         )
     except telegram.error.TelegramError as err:
-        if "Message is not modified" in err:
+        if is_not_modified_error(err):
             return
         response = "Error editing chat message!"
         logger.warning(f"{response} - {err}")
@@ -4827,19 +5279,31 @@ def edit_conversation_message(update: Update, context: CallbackContext, text: st
 
 
 def delete_old_chat_message(update: Update, context: CallbackContext) -> None:
-    """Deletes any old chat message."""
-    old_mid = context.user_data.get("del", "")
+    """Deletes any old chat message in the background."""
+    old_mid = context.user_data.pop("del", "")
     if not old_mid:
         return
+    chat_id = update.effective_chat.id
+    fan_out_executor.submit(chat_id, partial(delete_chat_message_by_id, context.bot, chat_id, old_mid))
+    return
+
+
+def delete_chat_message_by_id(bot: Bot, chat_id: int, message_id: int) -> None:
+    """Deletes a chat message given its id."""
     try:
-        context.bot.delete_message(update.effective_chat.id, old_mid)
+        bot.delete_message(chat_id, message_id)
     except telegram.error.TelegramError:
         logger.warning("Error deleting chat message!")
-    context.user_data.pop("del")
     return
 
 
 def delete_chat_message(message: Message) -> None:
+    """Deletes a chat message in the background, so that the handler can go on with its response."""
+    fan_out_executor.submit(message.chat_id, partial(delete_message_now, message))
+    return
+
+
+def delete_message_now(message: Message) -> None:
     """Deletes a chat message."""
     try:
         message.delete()
@@ -4868,25 +5332,27 @@ def deliver_poll(update: Update, poll: Poll) -> None:
     return
 
 
-def refresh_polls(poll: Poll, context: CallbackContext, only_buttons=False) -> None:
-    """Refreshes all polls to update changes."""
-    if only_buttons:
-        for mid in poll.get_message_details():
-            try:
-                context.bot.edit_message_reply_markup(inline_message_id=mid, reply_markup=poll.build_option_buttons())
-            except telegram.error.TelegramError as err:
-                logger.warning(err)
-                continue
-    else:
-        for mid in poll.get_message_details():
-            try:
-                context.bot.edit_message_text(
-                    poll.render_text(), inline_message_id=mid, parse_mode=ParseMode.HTML,
-                    reply_markup=poll.build_option_buttons()
-                )
-            except telegram.error.TelegramError as err:
-                logger.warning(err)
-                continue
+def refresh_polls(poll: Poll, context: CallbackContext, only_buttons=False, fresh_mid="") -> None:
+    """Schedules a refresh of all polls to update changes."""
+    poll_id = poll.get_poll_id()
+    refresh_scheduler.schedule(
+        context.job_queue, f"{models.POLL_SUBJECT} {poll_id}",
+        lambda buttons_only, skipped_mids: update_poll_messages(poll_id, context.bot, buttons_only, skipped_mids),
+        only_buttons=only_buttons, fresh_mid=fresh_mid
+    )
+    return
+
+
+def update_poll_messages(poll_id: str, bot: Bot, only_buttons: bool, skipped_mids: Set[str]) -> None:
+    """Edits all poll messages with the latest poll contents."""
+    poll = Poll.get_poll_by_id(poll_id)
+    if not poll:
+        return
+
+    text, buttons = "" if only_buttons else poll.render_text(), poll.build_option_buttons()
+    for mid in poll.get_message_details():
+        if mid not in skipped_mids:
+            fan_out_executor.submit(mid, partial(edit_shared_message, bot, poll, mid, text, buttons))
     return
 
 
@@ -4896,28 +5362,90 @@ def deliver_list(update: Update, _list: List) -> None:
     return
 
 
-def refresh_lists(_list: List, context: CallbackContext, only_buttons=False) -> None:
-    """Refreshes all lists to update changes."""
-    if only_buttons:
-        for mid in _list.get_message_details():
-            try:
-                context.bot.edit_message_reply_markup(inline_message_id=mid, reply_markup=_list.build_update_buttons())
-            except telegram.error.TelegramError as err:
-                logger.warning(err)
-                continue
-    else:
-        for mid in _list.get_message_details():
-            try:
-                context.bot.edit_message_text(
-                    _list.render_text(), inline_message_id=mid, parse_mode=ParseMode.HTML,
-                    reply_markup=_list.build_update_buttons()
-                )
-            except telegram.error.TelegramError as err:
-                logger.warning(err)
-                continue
+def refresh_lists(_list: List, context: CallbackContext, only_buttons=False, fresh_mid="") -> None:
+    """Schedules a refresh of all lists to update changes."""
+    list_id = _list.get_list_id()
+    refresh_scheduler.schedule(
+        context.job_queue, f"{models.LIST_SUBJECT} {list_id}",
+        lambda buttons_only, skipped_mids: update_list_messages(list_id, context.bot, buttons_only, skipped_mids),
+        only_buttons=only_buttons, fresh_mid=fresh_mid
+    )
+    return
+
+
+def update_list_messages(list_id: str, bot: Bot, only_buttons: bool, skipped_mids: Set[str]) -> None:
+    """Edits all list messages with the latest list contents."""
+    _list = List.get_list_by_id(list_id)
+    if not _list:
+        return
+
+    text, buttons = "" if only_buttons else _list.render_text(), _list.build_update_buttons()
+    for mid in _list.get_message_details():
+        if mid not in skipped_mids:
+            fan_out_executor.submit(mid, partial(edit_shared_message, bot, _list, mid, text, buttons))
+    return
+
+
+def close_inline_messages(bot: Bot, mids: Lst[str], text: str) -> None:
+    """Replaces the content of all given inline messages with a closing text."""
+    for mid in mids:
+        fan_out_executor.submit(mid, partial(edit_message, bot, text, None, inline_message_id=mid))
+    return
+
+
+def edit_shared_message(bot: Bot, item: Union[Poll, List], mid: str, text: str,
+                        reply_markup: InlineKeyboardMarkup) -> None:
+    """Edits a shared inline message, and stops tracking the message if it can no longer be edited."""
+    if edit_message(bot, text, reply_markup, inline_message_id=mid):
+        return
+    message_digests.forget(mid)
+    if item.remove_message_details(mid):
+        pruned_message_count.increment()
+        logger.info(f"Stopped tracking dead message {mid} ({pruned_message_count.get():.0f} in total)")
+    return
+
+
+def edit_query_message(query: CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+    """Edits the message of a callback query if its content has changed."""
+    if query.inline_message_id:
+        edit_message(query.bot, text, reply_markup, inline_message_id=query.inline_message_id)
+        return
+    message = query.message
+    edit_message(
+        query.bot, text, reply_markup, chat_id=message.chat_id, message_id=message.message_id,
+        current_markup=message.reply_markup
+    )
     return
 
 
+def edit_message(bot: Bot, text: str, reply_markup: Optional[InlineKeyboardMarkup], inline_message_id=None,
+                 chat_id=None, message_id=None, current_markup: Optional[InlineKeyboardMarkup] = None) -> bool:
+    """Edits a message if its content has changed since it was last sent, or only its buttons if no text is given.
+
+    Returns False if the message can no longer be edited.
+    """
+    key = message_digests.build_key(inline_message_id, chat_id, message_id)
+    is_text_changed, is_markup_changed = message_digests.get_changes(key, text, reply_markup, current_markup)
+    try:
+        if is_text_changed:
+            bot.edit_message_text(
+                text, chat_id=chat_id, message_id=message_id, inline_message_id=inline_message_id,
+                parse_mode=ParseMode.HTML, reply_markup=reply_markup
+            )
+        elif is_markup_changed:
+            bot.edit_message_reply_markup(
+                chat_id=chat_id, message_id=message_id, inline_message_id=inline_message_id, reply_markup=reply_markup
+            )
+        else:
+            return True
+    except telegram.error.TelegramError as err:
+        if not is_not_modified_error(err):
+            logger.warning(err)
+            return not is_permanent_error(err)
+    message_digests.record(key, text, reply_markup)
+    return True
+
+
 def deliver_group(update: Update, group: Group) -> None:
     """Delivers the group details."""
     update.message.reply_html(group.render_group_details_text(), reply_markup=group.build_main_buttons())
@@ -4951,6 +5479,68 @@ def generate_preset_format_guide() -> str:
     return "<b>Preset Placeholder Format Guide</b>"
 
 
+def send_profile(bot: Bot, uid: int, duration: int) -> None:
+    """Samples all threads for the duration, and sends the collapsed stacks to the user as a file."""
+    stacks = sampling_profiler.profile(duration)
+    if stacks is None:
+        bot.send_message(uid, "A profile is already being taken.")
+        return
+    if not stacks:
+        bot.send_message(uid, "No samples were taken.")
+        return
+    filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    bot.send_document(
+        uid, io.BytesIO(stacks.encode("utf-8")), filename=filename,
+        caption=f"Collapsed stacks of all threads over {duration} seconds, ready for flame graph tools."
+    )
+    return
+
+
+def measure_memory(dispatcher: Dispatcher) -> memory.MemoryReport:
+    """Measures the memory held by each storage, user data and pending jobs, and finds the largest polls and lists."""
+    storages = {
+        name: partial(lambda storage: list(models.copy_storage(storage).values()), storage)
+        for name, storage in get_storages().items()
+    }
+    storages["user_data"] = lambda: list(dict(dispatcher.user_data).values())
+    storages["jobs"] = lambda: [job.context for job in dispatcher.job_queue.jobs()]
+    entity_measures = {
+        "poll": (
+            lambda: models.copy_storage(models.poll_storage).values(),
+            lambda poll: memory.measure_entity(poll, poll.get_poll_id(), poll.get_respondent_count())
+        ),
+        "list": (
+            lambda: models.copy_storage(models.list_storage).values(),
+            lambda _list: memory.measure_entity(_list, _list.get_list_id(), _list.get_allocation_count())
+        ),
+    }
+    return memory_reporter.measure(storages, entity_measures)
+
+
+def render_memory_report(report: memory.MemoryReport) -> str:
+    storage_lines = [
+        f"{storage.name}: {storage.count} items, {memory.format_size(storage.size)}" for storage in report.storages
+    ]
+    response = "\n".join(
+        [f"<b>Memory Footprint</b> ({memory.format_size(report.total_size)} in {report.duration:.2f}s, "
+         f"{time.time() - report.created_time:.0f}s ago)"] +
+        storage_lines
+    )
+    for name, largest_entities in report.largest_entities.items():
+        for heading, footprints in (
+            (f"{name.title()}s With Most Responses", largest_entities.most_responses),
+            (f"Largest Saved {name.title()}s", largest_entities.largest_serialised),
+        ):
+            entity_lines = [
+                f"/{name}_{footprint.entity_id} {util.strip_html_symbols(footprint.title)} - "
+                f"{footprint.response_count} responses, {memory.format_size(footprint.serialised_size)} saved"
+                for footprint in footprints
+            ]
+            response += f"\n\n<b>{heading}</b>\n" + ("\n".join(entity_lines) or "None")
+    return response
+
+
+@util.freeze_markup
 def build_progress_buttons(next_action=models.DONE, back_action=models.RESET, next_text="Done", back_text="Cancel") \
         -> InlineKeyboardMarkup:
     return util.build_multiple_stacked_buttons_markup(
@@ -4964,15 +5554,58 @@ def build_progress_buttons(next_action=models.DONE, back_action=models.RESET, ne
 
 def save_data_job(context: CallbackContext) -> None:
     """Saves data to database."""
-    status = BotManager.save_data()
+    # Saving before the data is fully loaded would overwrite the database with partial data
+    if not readiness_gate.is_data_loaded:
+        logger.warning("Skipped saving data as the data is not loaded")
+        return
+    with data_save_latency.time():
+        status = BotManager.save_data()
     logger.info(status)
     return
 
 
 def load_data_job(context: CallbackContext) -> None:
-    """Loads data from database."""
-    status = BotManager.load_data()
-    logger.info(status)
+    """Loads data from database, then handles the updates that arrived in the meantime.
+    Failed attempts are retried with backoff, and the bot is opened without its data after the last attempt.
+    """
+    attempt = context.job.context or 1
+    try:
+        with data_load_latency.time():
+            is_loaded, status = BotManager.load_data(readiness_gate.report_progress)
+    except Exception as error:
+        is_loaded, status = False, f"Error loading data: {error}"
+    if is_loaded:
+        logger.info(status)
+        readiness_gate.open(context.dispatcher.update_queue)
+        return
+
+    if attempt < LOAD_DATA_ATTEMPTS:
+        delay = LOAD_DATA_RETRY_DELAY * 2 ** (attempt - 1)
+        logger.error(f"Failed loading data on attempt {attempt}/{LOAD_DATA_ATTEMPTS}, retrying in {delay}s: {status}")
+        context.job_queue.run_once(load_data_job, delay, context=attempt + 1, name="Load data job")
+        return
+    logger.critical(f"Failed loading data on the last attempt {attempt}/{LOAD_DATA_ATTEMPTS}: {status}")
+    readiness_gate.open(context.dispatcher.update_queue, is_data_loaded=False)
+    return
+
+
+def memory_report_job(context: CallbackContext) -> None:
+    """Measures the memory footprint for the memory gauges."""
+    report = measure_memory(context.dispatcher)
+    logger.info(
+        f"Memory footprint of {memory.format_size(report.total_size)} measured in {report.duration:.2f}s: "
+        + ", ".join(f"{storage.name} {memory.format_size(storage.size)}" for storage in report.storages)
+    )
+    return
+
+
+def send_memory_report_job(context: CallbackContext) -> None:
+    """Measures the memory footprint and sends the report to the admin who asked for it."""
+    report = measure_memory(context.dispatcher)
+    context.bot.send_message(
+        context.job.context, render_memory_report(report), parse_mode=ParseMode.HTML,
+        reply_markup=util.build_single_button_markup("Close", models.CLOSE)
+    )
     return
 
 
@@ -4984,13 +5617,95 @@ def ping_server_job(context: CallbackContext) -> None:
 
 # endregion
 
-def main() -> None:
-    """Starts the bot."""
-    # Dispatcher to register handlers
-    dispatcher = updater.dispatcher
+def record_api_request(method: str, outcome: str, duration: float) -> None:
+    api_request_count.increment((method, outcome))
+    api_request_latency.observe((method,), duration)
+    return
+
+
+def register_tracing(dispatcher: Dispatcher) -> None:
+    """Traces a sample of the updates handled by every registered handler, deciding for each update whether it is
+    traced before any of them runs.
+    """
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            handler.callback = tracer.traced_handler(handler.callback)
+    # Below the readiness handlers, which are the lowest group of the bot's own handlers
+    dispatcher.add_handler(TypeHandler(Update, tracer.sample_update, run_async=False), group=-4)
+    return
+
+
+def register_metrics(dispatcher: Dispatcher) -> None:
+    """Times every registered handler and callback query action, counts every request sent to Telegram, and reads
+    the sizes of the storages, outbound queues and connection pool when scraped.
+    """
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            handler.callback = handler_latency.timed((handler.callback.__name__,))(handler.callback)
+    callback_router.add_listener(
+        lambda subject, action, duration: callback_latency.observe((subject, action), duration)
+    )
+    dispatcher.bot.add_request_listener(record_api_request)
+
+    for name, storage in get_storages().items():
+        storage_size.read_from(partial(len, storage), (name,))
+    storage_size.read_from(lambda: len(dispatcher.user_data), ("user_data",))
+    storage_size.read_from(lambda: len(dispatcher.job_queue.jobs()), ("jobs",))
+    for name in list(get_storages()) + ["user_data", "jobs"]:
+        storage_memory.read_from(partial(memory_reporter.get_size, name), (name,))
+
+    scheduler = dispatcher.bot.scheduler
+    for priority in PRIORITY_NAMES.values():
+        outbound_queue_depth.read_from(lambda priority=priority: scheduler.get_queue_depths()[priority], (priority,))
+    fan_out_queue_depth.read_from(lambda: fan_out_executor.queue_depth)
+    pending_refresh_count.read_from(lambda: refresh_scheduler.pending_count)
+    pool_monitor = dispatcher.bot.pool_monitor
+    connection_pool_in_use.read_from(lambda: pool_monitor.in_use)
+    connection_pool_peak_in_use.read_from(lambda: pool_monitor.peak_in_use)
+    pool_monitor.add_saturation_listener(connection_pool_saturated_count.increment)
+    return
+
+
+def get_storages() -> Dict[str, dict]:
+    return {
+        "user": models.user_storage, "group": models.group_storage, "poll": models.poll_storage,
+        "list": models.list_storage, "temp_poll": models.temp_poll_storage, "temp_list": models.temp_list_storage,
+    }
+
 
+def serve_metrics() -> None:
+    """Serves the metrics on the webhook server, which must already be started."""
+    updater.httpd.http_server.request_callback.add_handlers(
+        r".*", [(METRICS_PATH, metrics.MetricsHandler, {"registry": metrics_registry})]
+    )
+    return
+
+
+def check_connection_pool() -> None:
+    """Checks that every thread that sends requests can get a pooled connection at the same time."""
+    required_size = WORKERS + JOB_WORKERS + fan_out_executor.worker_count
+    if CON_POOL_SIZE < required_size:
+        logger.warning(
+            f"Connection pool size {CON_POOL_SIZE} is smaller than the {required_size} threads that send requests, "
+            f"requests will open throwaway connections when the pool is saturated"
+        )
+    logger.info(
+        f"Using {WORKERS} dispatcher workers, {JOB_WORKERS} job workers, {fan_out_executor.worker_count} fan-out "
+        f"workers and {CON_POOL_SIZE} pooled connections"
+    )
+    return
+
+
+def register_handlers(dispatcher: Dispatcher) -> None:
+    """Registers all update handlers of the bot."""
     private_filter = Filters.chat_type.private
 
+    # Readiness handlers
+    dispatcher.add_handler(TypeHandler(Update, hold_update_until_ready, run_async=False), group=-3)
+
+    # Deduplication handlers, after held back updates are replayed
+    dispatcher.add_handler(TypeHandler(Update, drop_duplicate_update, run_async=False), group=-2)
+
     # Command handlers
     dispatcher.add_handler(CommandHandler(START_COMMAND, handle_start, filters=private_filter))
     dispatcher.add_handler(CommandHandler(KEYBOARD_COMMAND, handle_keyboard, filters=private_filter))
@@ -5012,6 +5727,8 @@ def main() -> None:
     dispatcher.add_handler(CommandHandler(PROMOTE_COMMAND, handle_promote, filters=private_filter))
     dispatcher.add_handler(CommandHandler(SAVE_COMMAND, handle_save, filters=private_filter))
     dispatcher.add_handler(CommandHandler(LOAD_COMMAND, handle_load, filters=private_filter))
+    dispatcher.add_handler(CommandHandler(PROFILE_COMMAND, handle_profile, filters=private_filter))
+    dispatcher.add_handler(CommandHandler(STATS_COMMAND, handle_stats, filters=private_filter))
 
     # Message handlers
     dispatcher.add_handler(
@@ -5032,7 +5749,8 @@ def main() -> None:
     dispatcher.add_handler(CallbackQueryHandler(handle_callback_query))
 
     # Inline query handlers
-    dispatcher.add_handler(InlineQueryHandler(handle_inline_query))
+    dispatcher.add_handler(InlineQueryHandler(track_inline_query, run_async=False), group=-1)
+    dispatcher.add_handler(InlineQueryHandler(handle_inline_query, run_async=True))
 
     # Chosen inline result handlers
     dispatcher.add_handler(ChosenInlineResultHandler(handle_chosen_poll_result, pattern=r"^poll \w+$"))
@@ -5041,13 +5759,40 @@ def main() -> None:
     # Error handlers
     dispatcher.add_error_handler(handle_error)
 
+    # Handlers of the bot, unlike those of the negative groups, use the user's data
+    for group, handlers in dispatcher.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = serialised_by_user(handler.callback)
+    return
+
+
+def main() -> None:
+    """Starts the bot."""
+    check_connection_pool()
+
+    # Dispatcher to register handlers
+    dispatcher = updater.dispatcher
+    register_handlers(dispatcher)
+
+    # Tracing and metrics
+    register_tracing(dispatcher)
+    register_metrics(dispatcher)
+
     # Start database operations
     updater.job_queue.run_once(load_data_job, 0, name="Load data job")
     updater.job_queue.run_repeating(save_data_job, 3600, first=60, name="Save data job")
     updater.job_queue.run_repeating(ping_server_job, 900, first=900, name="Ping server job")
+    updater.job_queue.run_repeating(
+        memory_report_job, MEMORY_REPORT_INTERVAL, first=MEMORY_REPORT_INTERVAL, name="Memory report job"
+    )
 
     # Start the bot
-    updater.start_webhook(listen="0.0.0.0", port=PORT, url_path=TOKEN, webhook_url=WEB_URL + TOKEN)
+    updater.start_webhook(
+        listen="0.0.0.0", port=PORT, url_path=TOKEN, webhook_url=WEB_URL + TOKEN, max_connections=MAX_CONNECTIONS
+    )
+    serve_metrics()
     updater.idle()
 
 
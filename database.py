@@ -1,34 +1,19 @@
 import os
 import json
-import gspread
-from gspread import Worksheet
-from oauth2client.service_account import ServiceAccountCredentials
+import threading
+from typing import Dict, List, Protocol
 
 # region DATABASE SETTINGS
 
 # Scope of application
 scopes = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/spreadsheets',
           "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
-json_creds = os.getenv("GOOGLE_SHEETS_CREDS_JSON")
-
-creds_dict = json.loads(json_creds)
-creds_dict["private_key"] = creds_dict["private_key"].replace("\\\\n", "\n")
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scopes)
-client = gspread.authorize(creds)
+SPREADSHEET_KEY = "1Qd__kBpgbE6CqxbX30q4QulHAl0hiiRoEeTJxhmyQXI"
 
 # endregion
 
 # region SHEET SETTINGS
 
-# Spreadsheets
-database_spreadsheet = client.open_by_key("1Qd__kBpgbE6CqxbX30q4QulHAl0hiiRoEeTJxhmyQXI")
-users_sheet = database_spreadsheet.worksheet("User Data")
-groups_sheet = database_spreadsheet.worksheet("Group Data")
-polls_sheet = database_spreadsheet.worksheet("Poll Data")
-lists_sheet = database_spreadsheet.worksheet("List Data")
-temp_polls_sheet = database_spreadsheet.worksheet("Poll Template Data")
-temp_lists_sheet = database_spreadsheet.worksheet("List Template Data")
-
 # User database fields
 USER_SHEET = "user"
 USER_ID = "uid"
@@ -143,6 +128,115 @@ FORMAT_TEXT = "format_text"
 FORMAT_CODES = "format_codes"
 FORMAT_TEXT_CODE_FIELDS = [FORMAT_TEXT, FORMAT_CODES]
 
+# Worksheet titles and fields of each sheet
+SHEET_TITLES = {
+    USER_SHEET: "User Data",
+    GROUP_SHEET: "Group Data",
+    POLL_SHEET: "Poll Data",
+    LIST_SHEET: "List Data",
+    TEMP_POLL_SHEET: "Poll Template Data",
+    TEMP_LIST_SHEET: "List Template Data",
+}
+SHEET_FIELDS = {
+    USER_SHEET: USER_FIELDS,
+    GROUP_SHEET: GROUP_FIELDS,
+    POLL_SHEET: POLL_FIELDS,
+    LIST_SHEET: LIST_FIELDS,
+    TEMP_POLL_SHEET: TEMP_POLL_FIELDS,
+    TEMP_LIST_SHEET: TEMP_LIST_FIELDS,
+}
+
+# endregion
+
+# region BACKENDS
+
+
+class Worksheet(Protocol):
+    """Part of a gspread worksheet used to save and load data."""
+
+    def clear(self) -> dict: ...
+
+    def insert_rows(self, values: List[List[str]], row: int = 1, value_input_option: str = "RAW") -> dict: ...
+
+    def resize(self, rows: int = None, cols: int = None) -> dict: ...
+
+    def get_all_records(self, numericise_ignore: List[str] = None) -> List[Dict[str, str]]: ...
+
+
+class Backend(Protocol):
+    def get_worksheet(self, sheet_name: str) -> Worksheet: ...
+
+
+class SpreadsheetBackend(object):
+    """Stores data in the Google Sheets database, connecting to it only when data is first saved or loaded."""
+
+    def __init__(self, spreadsheet_key: str = SPREADSHEET_KEY) -> None:
+        self._spreadsheet_key = spreadsheet_key
+        self._worksheets: Dict[str, Worksheet] = dict()
+        self._lock = threading.Lock()
+
+    def get_worksheet(self, sheet_name: str) -> Worksheet:
+        with self._lock:
+            if not self._worksheets:
+                self._worksheets = self._connect()
+            return self._worksheets[sheet_name]
+
+    def _connect(self) -> Dict[str, Worksheet]:
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        creds_dict = json.loads(os.getenv("GOOGLE_SHEETS_CREDS_JSON"))
+        creds_dict["private_key"] = creds_dict["private_key"].replace("\\\\n", "\n")
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scopes)
+        database_spreadsheet = gspread.authorize(creds).open_by_key(self._spreadsheet_key)
+        return {sheet_name: database_spreadsheet.worksheet(title) for sheet_name, title in SHEET_TITLES.items()}
+
+
+class MemoryWorksheet(object):
+    """Worksheet kept in memory, for running the bot without the Google Sheets database."""
+
+    def __init__(self) -> None:
+        self.rows: List[List[str]] = []
+
+    def clear(self) -> dict:
+        self.rows = []
+        return dict()
+
+    def insert_rows(self, values: List[List[str]], row: int = 1, value_input_option: str = "RAW") -> dict:
+        self.rows[row - 1:row - 1] = [list(row_values) for row_values in values]
+        return dict()
+
+    def resize(self, rows: int = None, cols: int = None) -> dict:
+        if rows is not None:
+            self.rows = self.rows[:rows]
+        return dict()
+
+    def get_all_records(self, numericise_ignore: List[str] = None) -> List[Dict[str, str]]:
+        if not self.rows:
+            return []
+        headers, *all_values = self.rows
+        return [dict(zip(headers, row_values)) for row_values in all_values]
+
+
+class MemoryBackend(object):
+    """Keeps every sheet in memory."""
+
+    def __init__(self) -> None:
+        self.worksheets = {sheet_name: MemoryWorksheet() for sheet_name in SHEET_TITLES}
+
+    def get_worksheet(self, sheet_name: str) -> Worksheet:
+        return self.worksheets[sheet_name]
+
+
+backend: Backend = SpreadsheetBackend()
+
+
+def use_backend(new_backend: Backend) -> None:
+    """Changes where data is saved to and loaded from."""
+    global backend
+    backend = new_backend
+    return
+
 
 # endregion
 
@@ -150,20 +244,9 @@ FORMAT_TEXT_CODE_FIELDS = [FORMAT_TEXT, FORMAT_CODES]
 # Currently implementing lazy saving and loading
 def save(data: dict, sheet_name: str) -> None:
     """Saves data to be stored into the database"""
-    if sheet_name == USER_SHEET:
-        return save_to_sheet(data, users_sheet, USER_FIELDS)
-    elif sheet_name == GROUP_SHEET:
-        return save_to_sheet(data, groups_sheet, GROUP_FIELDS)
-    elif sheet_name == POLL_SHEET:
-        return save_to_sheet(data, polls_sheet, POLL_FIELDS)
-    elif sheet_name == LIST_SHEET:
-        return save_to_sheet(data, lists_sheet, LIST_FIELDS)
-    elif sheet_name == TEMP_POLL_SHEET:
-        return save_to_sheet(data, temp_polls_sheet, TEMP_POLL_FIELDS)
-    elif sheet_name == TEMP_LIST_SHEET:
-        return save_to_sheet(data, temp_lists_sheet, TEMP_LIST_FIELDS)
-    else:
+    if sheet_name not in SHEET_FIELDS:
         return
+    return save_to_sheet(data, backend.get_worksheet(sheet_name), SHEET_FIELDS[sheet_name])
 
 
 def save_to_sheet(data: dict, sheet: Worksheet, headers: list) -> None:
@@ -181,20 +264,9 @@ def save_to_sheet(data: dict, sheet: Worksheet, headers: list) -> None:
 
 def load(sheet_name: str) -> list:
     """Loads stored data from the database as a list of dictionary."""
-    if sheet_name == USER_SHEET:
-        return load_from_sheet(users_sheet, USER_FIELDS)
-    elif sheet_name == GROUP_SHEET:
-        return load_from_sheet(groups_sheet, GROUP_FIELDS)
-    elif sheet_name == POLL_SHEET:
-        return load_from_sheet(polls_sheet, POLL_FIELDS)
-    elif sheet_name == LIST_SHEET:
-        return load_from_sheet(lists_sheet, LIST_FIELDS)
-    elif sheet_name == TEMP_POLL_SHEET:
-        return load_from_sheet(temp_polls_sheet, TEMP_POLL_FIELDS)
-    elif sheet_name == TEMP_LIST_SHEET:
-        return load_from_sheet(temp_lists_sheet, TEMP_LIST_FIELDS)
-    else:
+    if sheet_name not in SHEET_FIELDS:
         return list()
+    return load_from_sheet(backend.get_worksheet(sheet_name), SHEET_FIELDS[sheet_name])
 
 
 def load_from_sheet(sheet: Worksheet, headers: list) -> list:
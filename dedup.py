@@ -0,0 +1,74 @@
+"""Duplicate update detection"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Tuple
+
+MAX_RECENT_KEYS = 10000
+RECENT_KEY_WINDOW = 600  # In seconds
+
+
+class RecentKeys(object):
+    """Remembers the keys seen within the window, up to a maximum number of keys, dropping the oldest keys first.
+
+    Telegram redelivers an update when the bot is too slow to acknowledge it, so an update seen again within the
+    window has already been handled, or is still being handled.
+    """
+
+    def __init__(self, max_keys=MAX_RECENT_KEYS, window: float = RECENT_KEY_WINDOW) -> None:
+        self._max_keys = max_keys
+        self._window = window
+        self._seen_times: OrderedDict[Hashable, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable) -> bool:
+        """Remembers the key. Returns False if the key was already seen within the window."""
+        now = time.monotonic()
+        with self._lock:
+            # Keys are kept in the order they were first seen, so the expired keys are at the front
+            while self._seen_times and next(iter(self._seen_times.values())) <= now - self._window:
+                self._seen_times.popitem(last=False)
+            if key in self._seen_times:
+                return False
+            self._seen_times[key] = now
+            while len(self._seen_times) > self._max_keys:
+                self._seen_times.popitem(last=False)
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._seen_times)
+
+
+class TapSuppressor(object):
+    """Applies only the first tap of a button by a user within the window, and ignores the taps that follow it.
+
+    A double tap sends two callback queries, which would toggle a vote on and straight back off, editing the message
+    and refreshing every copy of it each time. Rapid taps instead collapse into the one change the user meant.
+    """
+
+    def __init__(self, window: float, max_keys=MAX_RECENT_KEYS) -> None:
+        self._window = window
+        self._max_keys = max_keys
+        # Time of the first tap and the status it was answered with, empty while it is still being applied
+        self._taps: OrderedDict[Hashable, List] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def apply(self, key: Hashable, action: Callable[[], str]) -> Tuple[str, bool]:
+        """Applies the action if the key was not tapped within the window.
+        Returns the status of the action, and whether the action was applied by this tap.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._taps and next(iter(self._taps.values()))[0] <= now - self._window:
+                self._taps.popitem(last=False)
+            if key in self._taps:
+                return self._taps[key][1], False
+            tap = self._taps[key] = [now, ""]
+            while len(self._taps) > self._max_keys:
+                self._taps.popitem(last=False)
+
+        status = action()
+        with self._lock:
+            tap[1] = status
+        return status, True
@@ -0,0 +1,155 @@
+"""Inline query answer caching"""
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, NamedTuple, Optional, Tuple
+
+from telegram import InlineQuery, InlineQueryResult
+
+MAX_CACHED_USERS = 1000
+MAX_CACHED_ANSWERS_PER_USER = 20
+MAX_TRACKED_USERS = 10000
+
+
+class InlineAnswerPolicy(NamedTuple):
+    """How long Telegram may cache an answer, whether the answer only applies to the user who asked for it,
+    and whether the bot may reuse the answer for repeated queries.
+    """
+    cache_time: int
+    is_personal: bool
+    is_reused: bool
+
+
+class InlineAnswer(NamedTuple):
+    results: Tuple[InlineQueryResult, ...]
+    switch_pm_text: Optional[str]
+    switch_pm_parameter: Optional[str]
+    next_offset: Optional[str]
+    cache_time: int
+    is_personal: bool
+
+    def send(self, query: InlineQuery) -> None:
+        query.answer(
+            list(self.results), cache_time=self.cache_time, is_personal=self.is_personal,
+            switch_pm_text=self.switch_pm_text, switch_pm_parameter=self.switch_pm_parameter,
+            next_offset=self.next_offset
+        )
+        return
+
+
+class InlineQueryKey(NamedTuple):
+    """Identifies a page of answers to an inline query sent by a user from a chat, while the data is unchanged."""
+    uid: int
+    chat_type: str
+    text: str
+    offset: str
+    data_version: int
+
+    @classmethod
+    def of(cls, query: InlineQuery, data_version: int) -> "InlineQueryKey":
+        return cls(
+            query.from_user.id, query.chat_type or "", normalise_query(query.query), query.offset, data_version
+        )
+
+    @property
+    def page(self) -> Tuple[str, str, str]:
+        return self.chat_type, self.text, self.offset
+
+
+def normalise_query(text: str) -> str:
+    return text.strip()
+
+
+ResponseVersions = Tuple[Tuple[Any, int], ...]
+
+
+def get_response_versions(sources: Iterable[Any]) -> ResponseVersions:
+    """Takes the current response versions of the polls and lists, before an answer showing them is built."""
+    return tuple((source, source.response_version) for source in sources)
+
+
+class CachedAnswer(NamedTuple):
+    answer: InlineAnswer
+    data_version: int
+    response_versions: ResponseVersions
+
+    def is_valid(self, data_version: int) -> bool:
+        return self.data_version == data_version and all(
+            source.response_version == response_version for source, response_version in self.response_versions
+        )
+
+
+class InlineAnswerCache(object):
+    """Least recently used cache of inline query answers for each user.
+
+    Answers built from an older data version are never returned, and are replaced as newer answers come in. Answers
+    that show the responses to polls or lists are also not returned once any of those responses change, so that a
+    vote only stales the answers that show it.
+    """
+
+    def __init__(self, max_users=MAX_CACHED_USERS, max_answers_per_user=MAX_CACHED_ANSWERS_PER_USER) -> None:
+        self._max_users = max_users
+        self._max_answers_per_user = max_answers_per_user
+        self._user_answers: OrderedDict[int, OrderedDict[Tuple[str, ...], CachedAnswer]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: InlineQueryKey) -> Optional[InlineAnswer]:
+        with self._lock:
+            answers = self._user_answers.get(key.uid, None)
+            if not answers:
+                return None
+            cached_answer = answers.get(key.page, None)
+            if not cached_answer or not cached_answer.is_valid(key.data_version):
+                return None
+            self._user_answers.move_to_end(key.uid)
+            answers.move_to_end(key.page)
+            return cached_answer.answer
+
+    def put(self, key: InlineQueryKey, answer: InlineAnswer, response_versions: ResponseVersions = ()) -> None:
+        """Keeps the answer, with the response versions of the polls and lists it shows taken before it was built."""
+        with self._lock:
+            answers = self._user_answers.setdefault(key.uid, OrderedDict())
+            self._user_answers.move_to_end(key.uid)
+            answers[key.page] = CachedAnswer(answer, key.data_version, response_versions)
+            answers.move_to_end(key.page)
+            while len(answers) > self._max_answers_per_user:
+                answers.popitem(last=False)
+            while len(self._user_answers) > self._max_users:
+                self._user_answers.popitem(last=False)
+        return
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(answers) for answers in self._user_answers.values())
+
+
+class InlineQueryTracker(object):
+    """Tracks the newest inline query of each user, so that older queries still being handled can be dropped.
+
+    Telegram only shows the answer to the newest query, and sends a new query on every keystroke.
+    """
+
+    def __init__(self, max_users=MAX_TRACKED_USERS) -> None:
+        self._max_users = max_users
+        self._latest_query_ids: OrderedDict[int, str] = OrderedDict()
+        self._condition = threading.Condition()
+
+    def track(self, query: InlineQuery) -> None:
+        with self._condition:
+            self._latest_query_ids[query.from_user.id] = query.id
+            self._latest_query_ids.move_to_end(query.from_user.id)
+            while len(self._latest_query_ids) > self._max_users:
+                self._latest_query_ids.popitem(last=False)
+            self._condition.notify_all()
+        return
+
+    def is_stale(self, query: InlineQuery) -> bool:
+        with self._condition:
+            return self._is_stale(query)
+
+    def _is_stale(self, query: InlineQuery) -> bool:
+        return self._latest_query_ids.get(query.from_user.id, query.id) != query.id
+
+    def debounce(self, query: InlineQuery, delay: float) -> bool:
+        """Waits until the user stops typing for the delay. Returns False if a newer query came in before that."""
+        with self._condition:
+            return not self._condition.wait_for(lambda: self._is_stale(query), timeout=delay)
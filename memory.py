@@ -0,0 +1,169 @@
+"""Memory footprint estimation"""
+import heapq
+import json
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, Callable, Collection, ContextManager, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+DEFAULT_TOP_COUNT = 5
+
+# Objects shared by the whole program, which are never counted as part of what refers to them
+ALWAYS_EXCLUDED_TYPES = (type, ModuleType, FunctionType, MethodType, BuiltinFunctionType)
+MAX_COPY_ATTEMPTS = 10
+
+
+def copy_contents(container: Collection) -> Tuple:
+    """Copies the contents of a container that handlers may change while it is copied, trying again if they do."""
+    for _ in range(MAX_COPY_ATTEMPTS - 1):
+        try:
+            return tuple(container)
+        except RuntimeError:
+            continue
+    return tuple(container)
+
+
+def deep_size(obj: Any, seen: Set[int] = None, excluded_types: Tuple[type, ...] = ()) -> int:
+    """Approximates the memory held by the object and everything it refers to, counting each object only once.
+
+    Objects in the seen set are skipped, and objects newly counted are added to it, so that objects shared by several
+    measured objects are only counted for the first of them. Containers are copied before their contents are walked,
+    as handlers may change them during the walk.
+    """
+    seen = seen if seen is not None else set()
+    excluded_types = ALWAYS_EXCLUDED_TYPES + excluded_types
+    size, stack = 0, [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, excluded_types):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            for key, value in copy_contents(obj.items()):
+                stack.extend((key, value))
+        elif isinstance(obj, (list, set)):
+            stack.extend(copy_contents(obj))
+        elif isinstance(obj, (tuple, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+    return size
+
+
+class StorageFootprint(NamedTuple):
+    name: str
+    count: int
+    size: int
+
+
+class EntityFootprint(NamedTuple):
+    """Footprint of a poll or list, with the number of people who responded to it."""
+    entity_id: str
+    title: str
+    response_count: int
+    serialised_size: int
+
+
+class LargestEntities(NamedTuple):
+    most_responses: Tuple[EntityFootprint, ...]
+    largest_serialised: Tuple[EntityFootprint, ...]
+
+
+class MemoryReport(NamedTuple):
+    storages: Tuple[StorageFootprint, ...]
+    largest_entities: Dict[str, LargestEntities]
+    created_time: float
+    duration: float
+
+    @property
+    def total_size(self) -> int:
+        return sum(storage.size for storage in self.storages)
+
+    def get_storage(self, name: str) -> Optional[StorageFootprint]:
+        return next((storage for storage in self.storages if storage.name == name), None)
+
+
+def hold_lock(obj: Any) -> ContextManager:
+    """Holds the lock of the poll, list or group, so that it does not change while it is measured."""
+    get_lock = getattr(obj, "get_lock", None)
+    return get_lock() if callable(get_lock) else nullcontext()
+
+
+def measure_item(item: Any, seen: Set[int], excluded_types: Tuple[type, ...]) -> int:
+    with hold_lock(item):
+        return deep_size(item, seen, excluded_types)
+
+
+def measure_entity(entity: Any, entity_id: str, response_count: int) -> EntityFootprint:
+    return EntityFootprint(entity_id, entity.get_title(), response_count, len(json.dumps(entity.to_json())))
+
+
+def find_largest_entities(entities: Iterable[Any], measure: Callable[[Any], EntityFootprint], top_count: int) \
+        -> LargestEntities:
+    """Finds the entities with the most responses, and the entities with the largest serialised size."""
+    footprints = []
+    for entity in entities:
+        with hold_lock(entity):
+            footprints.append(measure(entity))
+    return LargestEntities(
+        tuple(heapq.nlargest(top_count, footprints, key=lambda footprint: footprint.response_count)),
+        tuple(heapq.nlargest(top_count, footprints, key=lambda footprint: footprint.serialised_size))
+    )
+
+
+class MemoryReporter(object):
+    """Measures the footprint of each storage, and keeps the latest report for metrics to read."""
+
+    def __init__(self, excluded_types: Tuple[type, ...] = (), top_count=DEFAULT_TOP_COUNT) -> None:
+        self._excluded_types = excluded_types
+        self._top_count = top_count
+        self._latest_report: Optional[MemoryReport] = None
+        self._lock = threading.Lock()
+
+    @property
+    def latest_report(self) -> Optional[MemoryReport]:
+        return self._latest_report
+
+    def measure(self, storages: Dict[str, Callable[[], Collection]],
+                entity_measures: Dict[str, Tuple[Callable[[], Iterable[Any]], Callable[[Any], EntityFootprint]]]) \
+            -> MemoryReport:
+        """Measures each storage from a snapshot of its items, and finds the largest entities of each kind.
+        Only one report is measured at a time.
+        """
+        with self._lock:
+            start_time = time.perf_counter()
+            # Objects shared between storages are counted in the first storage that refers to them
+            seen = set()
+            storage_footprints = []
+            for name, get_items in storages.items():
+                items = get_items()
+                size = sum(measure_item(item, seen, self._excluded_types) for item in items)
+                storage_footprints.append(StorageFootprint(name, len(items), size))
+            largest_entities = {
+                name: find_largest_entities(get_entities(), measure, self._top_count)
+                for name, (get_entities, measure) in entity_measures.items()
+            }
+            self._latest_report = MemoryReport(
+                tuple(storage_footprints), largest_entities, time.time(), time.perf_counter() - start_time
+            )
+            return self._latest_report
+
+    def get_size(self, name: str) -> float:
+        report = self._latest_report
+        storage = report.get_storage(name) if report else None
+        return storage.size if storage else 0
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
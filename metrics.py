@@ -0,0 +1,172 @@
+"""Metrics in the Prometheus text format"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List as Lst, Tuple
+
+import tornado.web
+
+# Upper bounds of histogram buckets in seconds, from fast cache hits to slow spreadsheet operations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def format_labels(label_names: Tuple[str, ...], labels: Labels, extra="") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Metric(object):
+    kind = ""
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def render(self) -> Lst[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"] + self.render_samples()
+
+    def render_samples(self) -> Lst[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Count of events that only goes up, eg. number of requests sent."""
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self._values: Dict[Labels, float] = dict()
+
+    def increment(self, labels: Labels = (), amount=1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+        return
+
+    def get(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def render_samples(self) -> Lst[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}" for labels, value in values
+        ]
+
+
+class Gauge(Metric):
+    """Value read at the time of scraping, eg. number of polls in storage."""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self._readers: Dict[Labels, Callable[[], float]] = dict()
+
+    def read_from(self, read: Callable[[], float], labels: Labels = ()) -> None:
+        with self._lock:
+            self._readers[labels] = read
+        return
+
+    def render_samples(self) -> Lst[str]:
+        with self._lock:
+            readers = sorted(self._readers.items(), key=lambda item: item[0])
+        return [
+            f"{self.name}{format_labels(self.label_names, labels)} {format_value(read())}" for labels, read in readers
+        ]
+
+
+class Histogram(Metric):
+    """Distribution of observed durations in cumulative buckets, eg. time taken by each handler."""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) \
+            -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[Labels, Lst[int]] = dict()
+        self._sums: Dict[Labels, float] = dict()
+
+    def observe(self, labels: Labels, value: float) -> None:
+        # The last count is for observations larger than every bucket
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(labels, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[labels] = self._sums.get(labels, 0.0) + value
+        return
+
+    @contextmanager
+    def time(self, labels: Labels = ()) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(labels, time.perf_counter() - start_time)
+
+    def timed(self, labels: Labels) -> Callable[[Callable], Callable]:
+        """Observes the time taken by every call to the decorated function."""
+        def decorate(function: Callable) -> Callable:
+            @wraps(function)
+            def timed_function(*args, **kwargs):
+                with self.time(labels):
+                    return function(*args, **kwargs)
+            return timed_function
+        return decorate
+
+    def get_count(self, labels: Labels = ()) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def render_samples(self) -> Lst[str]:
+        with self._lock:
+            all_counts = sorted((labels, list(counts)) for labels, counts in self._counts.items())
+            sums = dict(self._sums)
+
+        samples = []
+        for labels, counts in all_counts:
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative_count += count
+                bucket_labels = format_labels(self.label_names, labels, f'le="{format_value(upper_bound)}"')
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulative_count}")
+            samples.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(sums[labels])}")
+            samples.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative_count}")
+        return samples
+
+
+class Registry(object):
+    def __init__(self) -> None:
+        self._metrics: Lst[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves all registered metrics to a Prometheus scraper."""
+
+    def initialize(self, registry: Registry) -> None:
+        self.registry = registry
+
+    def get(self) -> None:
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(self.registry.render())
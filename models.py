@@ -6,11 +6,17 @@ import json
 from datetime import datetime, timedelta
 import pytz
 from collections import OrderedDict
+from functools import wraps
+import heapq
+from itertools import chain, count
 import re
-from typing import Tuple, Dict, Set, List as Lst, Union
+import threading
+import zlib
+from typing import Callable, Tuple, Dict, Set, List as Lst, Union
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
 import database as db
+import tracing
 import util
 from ui import PaginationButtonGroup, PaginationTextGroup
 
@@ -31,6 +37,9 @@ EMOJI_TEMPLATE = "\U0001f4c3"
 EMOJI_CROWN = "\U0001f451"
 EMOJI_HAPPY = "\U0001f60a"
 SESSION_EXPIRY = 1  # In hours
+MAX_MESSAGE_DETAILS = 50  # Shared messages tracked per poll or list
+LOCK_STRIPES = 64  # Locks shared by all polls, lists and groups
+MARKUP_CACHE_SIZE = 2000  # Markups of polls, lists and groups kept for reuse
 EXPIRY = 720
 BOT_NAME = "imcomingtotyabot"
 tz = pytz.timezone("Asia/Singapore")
@@ -100,6 +109,73 @@ list_storage = dict()
 temp_poll_storage = dict()
 temp_list_storage = dict()
 
+# Guards insertions into and deletions from the storages only, entities are guarded by their own striped locks
+storage_lock = threading.RLock()
+entity_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+
+
+def get_entity_lock(subject: str, entity_id: str) -> threading.RLock:
+    return entity_locks[zlib.crc32(f"{subject} {entity_id}".encode()) % LOCK_STRIPES]
+
+
+def synchronised(method):
+    """Runs the method while holding the lock of the poll, list or group it is called on."""
+    @wraps(method)
+    def synchronised_method(self, *args, **kwargs):
+        with self.get_lock():
+            return method(self, *args, **kwargs)
+    return synchronised_method
+
+
+# Versions are unique across all polls, lists and groups, and change whenever their buttons may change
+version_counter = count()
+markup_cache = util.MarkupCache(MARKUP_CACHE_SIZE)
+
+
+def cached_markup(method):
+    """Reuses the markup built by the method until the poll, list or group it is called on changes version."""
+    @wraps(method)
+    def cached_markup_method(self, *args, **kwargs):
+        key = (self.version, method.__name__, args, tuple(kwargs.items()))
+        return markup_cache.get_or_build(key, lambda: method(self, *args, **kwargs))
+    return cached_markup_method
+
+
+# The data version changes whenever any stored user, group, poll, list or template changes, except for responses
+data_version = next(version_counter)
+
+
+def get_data_version() -> int:
+    return data_version
+
+
+def changes_data(method):
+    """Moves the data version forward after the method changes stored data."""
+    @wraps(method)
+    def changes_data_method(*args, **kwargs):
+        global data_version
+        result = method(*args, **kwargs)
+        data_version = next(version_counter)
+        return result
+    return changes_data_method
+
+
+def changes_responses(method):
+    """Moves the response version of the poll or list forward after the method changes its responses.
+    Responses change far more often than anything else, so they leave the data version as it is.
+    """
+    @wraps(method)
+    def changes_responses_method(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.response_version = next(version_counter)
+        return result
+    return changes_responses_method
+
+
+def copy_storage(storage: dict) -> dict:
+    with storage_lock:
+        return dict(storage)
+
 
 class User(object):
     def __init__(self, uid: int, first_name: str, last_name: str, username: str, is_leader: bool,
@@ -123,17 +199,20 @@ class User(object):
 
     @staticmethod
     def get_users_by_name(name="") -> Lst[User]:
-        sorted_users = sorted(user_storage.values(), key=lambda user: user.get_name().lower())
+        sorted_users = sorted(copy_storage(user_storage).values(), key=lambda user: user.get_name().lower())
         filtered_users = [user for user in sorted_users if name in user.get_name()]
         return filtered_users
 
     @classmethod
+    @changes_data
     def register(cls, uid: int, first_name: str, last_name="", username="") -> User:
         user = cls(uid, first_name, last_name, username, False, set(), set(), set(), set(), set(), set())
-        user_storage[uid] = user
+        with storage_lock:
+            user_storage[uid] = user
         return user
 
     @classmethod
+    @changes_data
     def load(cls, uid: int, first_name: str, last_name: str, username: str, is_leader: bool,
              owned_group_ids: Lst[str], joined_group_ids: Lst[str], poll_ids: Lst[str], list_ids: Lst[str],
              temp_poll_ids: Lst[str], temp_list_ids: Lst[str]) -> None:
@@ -141,7 +220,8 @@ class User(object):
             uid, first_name, last_name, username, is_leader, set(owned_group_ids), set(joined_group_ids),
             set(poll_ids), set(list_ids), set(temp_poll_ids), set(temp_list_ids)
         )
-        user_storage[uid] = user
+        with storage_lock:
+            user_storage[uid] = user
         return
 
     def get_uid(self) -> int:
@@ -158,6 +238,7 @@ class User(object):
     def is_leader(self) -> bool:
         return self.leader
 
+    @changes_data
     def promote_to_leader(self) -> None:
         self.leader = True
 
@@ -171,6 +252,7 @@ class User(object):
     def has_group_with_name(self, name: str) -> bool:
         return any(group.get_name() == name for group in self.get_owned_groups())
 
+    @changes_data
     def create_group(self, name: str, password="") -> Tuple[Group | None, str]:
         if self.has_group_with_name(name):
             return None, "You already have a group with the same name."
@@ -180,6 +262,7 @@ class User(object):
         self.owned_group_ids.add(group.get_gid())
         return group, f"Group {util.make_html_bold(name)} created!"
 
+    @changes_data
     def delete_group(self, gid: str) -> str:
         if gid not in self.owned_group_ids:
             return "You do not own that group."
@@ -195,6 +278,7 @@ class User(object):
         joined_groups = Group.get_groups_by_ids(self.joined_group_ids, filters)
         return sorted(joined_groups, key=lambda group: group.get_name().lower())
 
+    @changes_data
     def join_group(self, gid: str) -> str:
         if len(self.joined_group_ids) >= MAX_JOINED_GROUPS_PER_USER:
             return f"The maximum number of groups you can join ({MAX_JOINED_GROUPS_PER_USER}) has been reached."
@@ -202,6 +286,7 @@ class User(object):
         group = Group.get_group_by_id(gid)
         return f"Group {util.make_html_bold(group.get_name())} joined!"
 
+    @changes_data
     def leave_group(self, gid: str) -> None:
         if gid in self.joined_group_ids:
             self.joined_group_ids.remove(gid)
@@ -230,11 +315,13 @@ class User(object):
         group_polls = Poll.get_polls_by_ids(self.get_group_poll_ids(), filters)
         return sorted(group_polls, key=lambda poll: poll.get_created_date(), reverse=True)
 
+    @changes_data
     def create_poll(self, title: str, description: str, options: list) -> Tuple[Poll, str]:
         poll = Poll.create_new(title, self.uid, description, options)
         self.poll_ids.add(poll.get_poll_id())
         return poll, f"Poll {util.make_html_bold(title)} created!"
 
+    @changes_data
     def delete_poll(self, poll_id: str) -> str:
         if poll_id not in self.poll_ids:
             return "No such poll exists."
@@ -270,11 +357,13 @@ class User(object):
         group_lists = List.get_lists_by_ids(self.get_group_list_ids(), filters)
         return sorted(group_lists, key=lambda _list: _list.get_created_date(), reverse=True)
 
+    @changes_data
     def create_list(self, title: str, description: str, options: list, choices: list) -> Tuple[List, str]:
         _list = List.create_new(title, self.uid, description, options, choices)
         self.list_ids.add(_list.get_list_id())
         return _list, f"List {util.make_html_bold(title)} created!"
 
+    @changes_data
     def delete_list(self, list_id: str) -> str:
         if list_id not in self.list_ids:
             return "No such list exists."
@@ -303,6 +392,7 @@ class User(object):
     def get_temp_poll_by_name(self, name: str) -> PollTemplate:
         return next((temp_poll for temp_poll in self.get_temp_polls() if temp_poll.name.lower() == name.lower()), None)
 
+    @changes_data
     def create_temp_poll(self, name: str, description: str, format_title_string: str, description_format_string: str,
                          options: list, is_single_response: bool) -> Tuple[PollTemplate, str]:
         temp_poll = PollTemplate.create_new(
@@ -311,6 +401,7 @@ class User(object):
         self._temp_poll_ids.add(temp_poll.temp_id)
         return temp_poll, f"Poll template {util.make_html_bold(name)} created!"
 
+    @changes_data
     def delete_temp_poll(self, temp_id: str) -> None:
         self._temp_poll_ids.remove(temp_id)
         temp_poll = PollTemplate.get_template_by_id(temp_id)
@@ -320,6 +411,7 @@ class User(object):
     def has_temp_poll_with_name(self, name: str) -> bool:
         return any(temp_poll.name.lower() == name.lower() for temp_poll in self.get_temp_polls())
 
+    @changes_data
     def create_poll_from_template(self, temp_id: str, title: str, description: str) -> Poll | None:
         if temp_id not in self._temp_poll_ids:
             return None
@@ -338,6 +430,7 @@ class User(object):
     def get_temp_list_by_name(self, name: str) -> ListTemplate:
         return next((temp_list for temp_list in self.get_temp_lists() if temp_list.name.lower() == name.lower()), None)
 
+    @changes_data
     def create_temp_list(self, name: str, description: str, title_format_string: str, description_format_string: str,
                          options: Lst[str], choices: Lst[str], is_single_response: bool) -> Tuple[ListTemplate, str]:
         temp_list = ListTemplate.create_new(
@@ -347,6 +440,7 @@ class User(object):
         self._temp_list_ids.add(temp_list.temp_id)
         return temp_list, f"List template {util.make_html_bold(name)} created!"
 
+    @changes_data
     def delete_temp_list(self, temp_id: str) -> None:
         self._temp_list_ids.remove(temp_id)
         temp_list = ListTemplate.get_template_by_id(temp_id)
@@ -356,6 +450,7 @@ class User(object):
     def has_temp_list_with_name(self, name: str) -> bool:
         return any(temp_list.name.lower() == name.lower() for temp_list in self.get_temp_lists())
 
+    @changes_data
     def create_list_from_template(self, temp_id: str, title: str, description: str) -> List | None:
         if temp_id not in self._temp_list_ids:
             return None
@@ -393,6 +488,17 @@ class User(object):
         all_lists = List.get_lists_by_ids(self.get_all_list_ids(), filters)
         return sorted(all_polls + all_lists, key=lambda item: item.get_created_date(), reverse=True)
 
+    def get_latest_everything(self, filters="", limit=10, offset=0) -> Tuple[Lst[Poll | List], bool]:
+        """Gets the most recently created polls and lists after skipping the offset, without sorting everything.
+        Also returns whether there are more polls and lists after them.
+        """
+        filters = filters.lower()
+        all_polls = (Poll.get_poll_by_id(poll_id) for poll_id in self.get_all_poll_ids())
+        all_lists = (List.get_list_by_id(list_id) for list_id in self.get_all_list_ids())
+        items = (item for item in chain(all_polls, all_lists) if item and filters in item.get_title().lower())
+        latest_items = heapq.nlargest(offset + limit + 1, items, key=lambda item: item.get_created_date())
+        return latest_items[offset:offset + limit], len(latest_items) > offset + limit
+
     def render_poll_list_with_buttons(self, page_number: int = 0) -> Tuple[str, InlineKeyboardMarkup]:
         header = "<b>Your Polls</b>"
 
@@ -614,6 +720,7 @@ class Group(object):
         self.list_ids = list_ids
         self._template_ids = template_ids
         self.created_date = created_date
+        self.version = next(version_counter)
 
     @staticmethod
     def get_group_by_id(gid: str) -> Group:
@@ -625,37 +732,49 @@ class Group(object):
         return [group for group in group_lists if filters.lower() in group.get_name().lower()]
 
     @classmethod
+    @changes_data
     def create_new(cls, name: str, uid: int, password="") -> Group:
-        gid = util.generate_random_id(GROUP_ID_LENGTH, set(group_storage.keys()))
-        group = cls(gid, name, uid, password, {uid}, set(), set(), set(), datetime.now(tz=tz))
-        group_storage[gid] = group
+        with storage_lock:
+            gid = util.generate_random_id(GROUP_ID_LENGTH, set(group_storage.keys()))
+            group = cls(gid, name, uid, password, {uid}, set(), set(), set(), datetime.now(tz=tz))
+            group_storage[gid] = group
         return group
 
     @classmethod
+    @changes_data
     def load(cls, gid: str, name: str, owner: int, password: str, member_ids: Lst[int],
              poll_ids: Lst[str], list_ids: Lst[str], template_ids: Lst[str], created_date: str) -> None:
         group = cls(gid, name, owner, password, set(member_ids),
                     set(poll_ids), set(list_ids), set(template_ids), datetime.fromisoformat(created_date))
-        group_storage[gid] = group
+        with storage_lock:
+            group_storage[gid] = group
         return
 
+    @changes_data
     def delete(self) -> None:
         for uid in list(self.get_member_ids()):
             self.remove_member(uid)
-        group_storage.pop(self.gid, None)
+        with storage_lock:
+            group_storage.pop(self.gid, None)
 
     def get_gid(self) -> str:
         return self.gid
 
+    def get_lock(self) -> threading.RLock:
+        return get_entity_lock(GROUP_SUBJECT, self.gid)
+
     def get_name(self) -> str:
         return self.name
 
+    @changes_data
     def edit_name(self, new_name: str) -> None:
         self.name = new_name
+        self.version = next(version_counter)
 
     def get_password_hash(self) -> str:
         return f"{self.gid}_{util.simple_hash(self.password, self.gid)}" if self.password else self.gid
 
+    @changes_data
     def edit_password(self, new_password: str) -> None:
         self.password = new_password
 
@@ -669,6 +788,8 @@ class Group(object):
         members = [User.get_user_by_id(uid) for uid in self.member_ids]
         return sorted(members, key=lambda member: member.get_name().lower())
 
+    @synchronised
+    @changes_data
     def add_member(self, uid: int) -> str:
         if uid in self.member_ids:
             return "You are already in the group!"
@@ -678,6 +799,8 @@ class Group(object):
         User.get_user_by_id(uid).join_group(self.gid)
         return f"You have joined {util.make_html_bold(self.name)}!"
 
+    @synchronised
+    @changes_data
     def remove_member(self, uid: int) -> str:
         if uid not in self.member_ids:
             return "The user is not in the group."
@@ -696,12 +819,16 @@ class Group(object):
         group_polls = Poll.get_polls_by_ids(self.poll_ids, filters)
         return sorted(group_polls, key=lambda poll: poll.get_created_date(), reverse=True)
 
+    @synchronised
+    @changes_data
     def add_poll(self, poll_id: str) -> str:
         if poll_id in self.poll_ids:
             return "The poll already exists in the group."
         self.poll_ids.add(poll_id)
         return f"Poll \"{Poll.get_poll_by_id(poll_id).get_title()}\" added into the group."
 
+    @synchronised
+    @changes_data
     def remove_poll(self, poll_id: str) -> str:
         if poll_id not in self.poll_ids:
             return "The poll is not in the group."
@@ -716,12 +843,16 @@ class Group(object):
         group_lists = List.get_lists_by_ids(self.list_ids, filters)
         return sorted(group_lists, key=lambda _list: _list.get_created_date(), reverse=True)
 
+    @synchronised
+    @changes_data
     def add_list(self, list_id: str) -> str:
         if list_id in self.list_ids:
             return "The list already exists in the group."
         self.list_ids.add(list_id)
         return f"List \"{List.get_list_by_id(list_id).get_title()}\" added into the group."
 
+    @synchronised
+    @changes_data
     def remove_list(self, list_id: str) -> str:
         if list_id not in self.list_ids:
             return "The list is not in the group."
@@ -736,6 +867,7 @@ class Group(object):
         group_templates = Template.get_templates_by_ids(self._template_ids, filters)
         return sorted(group_templates, key=lambda template: template.name.lower())
 
+    @changes_data
     def add_template(self, temp_id: str) -> str:
         template = Template.get_template_by_id(temp_id)
         if temp_id in self._template_ids:
@@ -743,6 +875,7 @@ class Group(object):
         self._template_ids.add(temp_id)
         return f"{template.temp_type.capitalize()} template \"{template.name}\" is added to the group."
 
+    @changes_data
     def remove_template(self, temp_id: str) -> str:
         if temp_id not in self._template_ids:
             return "The template does not exist in the group."
@@ -881,6 +1014,7 @@ class Group(object):
         join_button = util.build_switch_button("Join Group", f"/join {self.get_password_hash()}", to_self=True)
         return invitation, InlineKeyboardMarkup([[join_button]])
 
+    @cached_markup
     def build_main_buttons(self) -> InlineKeyboardMarkup:
         view_button = self.build_button("View", VIEW)
         settings_button = self.build_button("Settings", SETTINGS)
@@ -889,6 +1023,7 @@ class Group(object):
         buttons = [[view_button], [settings_button], [refresh_button, close_button]]
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_view_buttons(self) -> InlineKeyboardMarkup:
         view_members_button = self.build_button("View Members", MEMBER)
         view_polls_button = self.build_button("View Polls", POLL)
@@ -1058,6 +1193,7 @@ class Group(object):
         buttons.append([back_button])
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_settings_buttons(self, is_owner=False) -> InlineKeyboardMarkup:
         if is_owner:
             change_name_button = self.build_button("Change Group Name", f"{RENAME}_{NAME}")
@@ -1085,6 +1221,7 @@ class Group(object):
     def build_button(self, text: str, action: str) -> InlineKeyboardButton:
         return util.build_button(text, GROUP_SUBJECT, action, self.gid)
 
+    @synchronised
     def to_json(self) -> dict:
         return {
             db.GROUP_ID: self.gid,
@@ -1101,7 +1238,7 @@ class Group(object):
 
 class Poll(object):
     def __init__(self, poll_id: str, title: str, uid: int, description: str, options: list, single_response: bool,
-                 message_details: set, expiry: int, created_date: datetime) -> None:
+                 message_details: OrderedDict, expiry: int, created_date: datetime) -> None:
         self.poll_id = poll_id
         self.creator_id = uid
         self.title = title
@@ -1111,6 +1248,8 @@ class Poll(object):
         self.message_details = message_details
         self.expiry = expiry
         self.created_date = created_date
+        self.version = next(version_counter)
+        self.response_version = next(version_counter)
 
     @staticmethod
     def get_poll_by_id(poll_id: str) -> Poll:
@@ -1122,21 +1261,23 @@ class Poll(object):
         return [poll for poll in poll_lists if filters.lower() in poll.get_title().lower()]
 
     @classmethod
+    @changes_data
     def create_new(cls, title: str, uid: int, description: str, option_titles: list) -> Poll:
-        poll_id = util.generate_random_id(POLL_ID_LENGTH, set(poll_storage.keys()))
-        poll = cls(poll_id, title, uid, description, list(), True, set(), EXPIRY, datetime.now(tz=tz))
-
-        for option_title in option_titles:
-            poll.add_option(Option.create_new(option_title))
-
-        poll_storage[poll_id] = poll
+        # The poll is only stored once it is complete, so that it is never saved or searched without its options
+        options = [Option.create_new(option_title) for option_title in option_titles]
+        with storage_lock:
+            poll_id = util.generate_random_id(POLL_ID_LENGTH, set(poll_storage.keys()))
+            poll = cls(poll_id, title, uid, description, options, True, OrderedDict(), EXPIRY, datetime.now(tz=tz))
+            poll_storage[poll_id] = poll
         return poll
 
     @classmethod
+    @changes_data
     def load(cls, poll_id: str, title: str, uid: int, description: str, options: list, single_response: bool,
              message_details: list, expiry: int, created_date: str) -> None:
-        poll = cls(poll_id, title, uid, description, list(), single_response, set(message_details),
-                   expiry, datetime.fromisoformat(created_date))
+        poll = cls(poll_id, title, uid, description, list(), single_response,
+                   OrderedDict.fromkeys(message_details[-MAX_MESSAGE_DETAILS:]), expiry,
+                   datetime.fromisoformat(created_date))
 
         for option_data in options:
             poll.add_option(Option.load(
@@ -1145,11 +1286,14 @@ class Poll(object):
                 option_data.get(db.OPTION_RESPONDENTS, [])
             ))
 
-        poll_storage[poll_id] = poll
+        with storage_lock:
+            poll_storage[poll_id] = poll
         return
 
+    @changes_data
     def delete(self) -> None:
-        poll_storage.pop(self.poll_id, None)
+        with storage_lock:
+            poll_storage.pop(self.poll_id, None)
 
     def get_creator_id(self) -> int:
         return self.creator_id
@@ -1157,29 +1301,47 @@ class Poll(object):
     def get_poll_id(self) -> str:
         return self.poll_id
 
+    def get_lock(self) -> threading.RLock:
+        return get_entity_lock(POLL_SUBJECT, self.poll_id)
+
     def get_title(self) -> str:
         return self.title
 
+    @changes_data
     def set_title(self, title: str) -> None:
         self.title = title
+        self.version = next(version_counter)
 
     def get_description(self) -> str:
         return self.description
 
+    @changes_data
     def set_description(self, description: str) -> None:
         self.description = description
+        self.version = next(version_counter)
 
     def get_options(self) -> Lst[Option]:
         return self.options
 
+    @changes_data
     def add_option(self, option) -> None:
         self.options.append(option)
+        self.version = next(version_counter)
 
-    def get_message_details(self) -> set:
-        return self.message_details
+    @synchronised
+    def get_message_details(self) -> Lst[str]:
+        return list(self.message_details)
 
+    @synchronised
     def add_message_details(self, mid: str) -> None:
-        self.message_details.add(mid)
+        self.message_details[mid] = None
+        self.message_details.move_to_end(mid)
+        while len(self.message_details) > MAX_MESSAGE_DETAILS:
+            self.message_details.popitem(last=False)
+
+    @synchronised
+    def remove_message_details(self, mid: str) -> bool:
+        return self.message_details.pop(mid, False) is None
 
     def has_message_details(self, mid: str) -> bool:
         return mid in self.message_details
@@ -1187,13 +1349,17 @@ class Poll(object):
     def is_single_response(self) -> bool:
         return self.single_response
 
+    @changes_data
     def set_single_response(self, single_response: bool) -> None:
         self.single_response = single_response
+        self.version = next(version_counter)
 
+    @changes_data
     def toggle_response_type(self) -> str:
         # if any(option.has_votes() for option in self.options):
         #     return "Cannot change response type for non-empty poll."
         self.single_response = not self.single_response
+        self.version = next(version_counter)
         status = "single response" if self.single_response else "multi-response"
         return f"Response type is changed to {status}."
 
@@ -1203,12 +1369,16 @@ class Poll(object):
     def get_expiry(self) -> int:
         return self.expiry
 
+    @changes_data
     def set_expiry(self, expiry: int) -> None:
         self.expiry = expiry
 
     def get_poll_hash(self) -> str:
         return f"{self.poll_id}_{util.simple_hash(self.title, self.poll_id, variance=False)}"
 
+    @tracing.traced
+    @synchronised
+    @changes_responses
     def toggle(self, opt_id: int, uid: int, user_profile: dict, comment="") -> str:
         if opt_id >= len(self.options):
             return "Sorry, invalid option."
@@ -1224,6 +1394,8 @@ class Poll(object):
             return self.options[opt_id].is_voted_by_user(uid)
         return False
 
+    @synchronised
+    @changes_responses
     def edit_user_comment(self, opt_id: int, uid: int, comment: str) -> str:
         if opt_id >= len(self.options):
             return "Sorry, invalid option."
@@ -1233,9 +1405,12 @@ class Poll(object):
         option.edit_user_comment(uid, comment)
         return ""
 
+    @synchronised
+    @changes_data
     def toggle_comment_requirement(self, opt_id: int) -> str:
         if opt_id >= len(self.options):
             return "Sorry, invalid option."
+        self.version = next(version_counter)
         return self.options[opt_id].toggle_comment_requirement()
 
     def is_user_comment_required(self, opt_id: int, uid: int) -> bool:
@@ -1267,6 +1442,8 @@ class Poll(object):
     def generate_options_summary(self) -> str:
         return " / ".join(option.get_title() for option in self.options)
 
+    @tracing.traced
+    @synchronised
     def render_text(self) -> str:
         title = util.make_html_bold(self.title)
         description = util.make_html_italic(self.description)
@@ -1275,6 +1452,9 @@ class Poll(object):
         footer = [f"{EMOJI_PEOPLE} {self.generate_respondents_summary()}"]
         return "\n\n".join(header + body + footer)
 
+    @tracing.traced
+    @synchronised
+    @cached_markup
     def build_option_buttons(self) -> InlineKeyboardMarkup:
         buttons = []
         for i, option in enumerate(self.options):
@@ -1292,6 +1472,7 @@ class Poll(object):
         buttons.append([edit_comments_button, refresh_button])
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_admin_buttons(self) -> InlineKeyboardMarkup:
         publish_button = util.build_switch_button("Publish", self.title)
         settings_button = self.build_button("Settings", SETTINGS)
@@ -1300,6 +1481,7 @@ class Poll(object):
         buttons = [[publish_button], [settings_button], [refresh_button, close_button]]
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_settings_buttons(self, is_creator=False) -> InlineKeyboardMarkup:
         response_text = "Multi-Response" if self.single_response else "Single Response"
         toggle_response_button = self.build_button(f"Change to {response_text}", RESPONSE)
@@ -1311,6 +1493,7 @@ class Poll(object):
             buttons.insert(-1, [delete_button])
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_option_comment_required_buttons(self) -> InlineKeyboardMarkup:
         buttons = []
         for i, option in enumerate(self.options):
@@ -1354,6 +1537,7 @@ class Poll(object):
     def build_button(self, text: str, action: str) -> InlineKeyboardButton:
         return util.build_button(text, POLL_SUBJECT, action, self.poll_id)
 
+    @synchronised
     def to_json(self) -> dict:
         return {
             db.POLL_ID: self.poll_id,
@@ -1458,7 +1642,7 @@ class Option(object):
 
 class List(object):
     def __init__(self, list_id: str, title: str, uid: int, description: str, options: Lst[ListOption],
-                 choices: Lst[str], single_response: bool, message_details: set, expiry: int,
+                 choices: Lst[str], single_response: bool, message_details: OrderedDict, expiry: int,
                  created_date: datetime) -> None:
         self.list_id = list_id
         self.title = title
@@ -1470,6 +1654,8 @@ class List(object):
         self.message_details = message_details
         self.expiry = expiry
         self.created_date = created_date
+        self.version = next(version_counter)
+        self.response_version = next(version_counter)
 
     @staticmethod
     def get_list_by_id(list_id: str) -> List:
@@ -1481,21 +1667,25 @@ class List(object):
         return [_list for _list in list_lists if filters.lower() in _list.get_title().lower()]
 
     @classmethod
+    @changes_data
     def create_new(cls, title: str, uid: int, description: str, option_titles: Lst[str], choices: Lst[str]) -> List:
-        list_id = util.generate_random_id(LIST_ID_LENGTH, set(list_storage.keys()))
-        _list = cls(list_id, title, uid, description, list(), choices, True, set(), EXPIRY, datetime.now(tz=tz))
-
-        for option_title in option_titles:
-            _list.add_option(ListOption.create_new(option_title))
-
-        list_storage[list_id] = _list
+        # The list is only stored once it is complete, so that it is never saved or searched without its options
+        options = [ListOption.create_new(option_title) for option_title in option_titles]
+        with storage_lock:
+            list_id = util.generate_random_id(LIST_ID_LENGTH, set(list_storage.keys()))
+            _list = cls(
+                list_id, title, uid, description, options, choices, True, OrderedDict(), EXPIRY, datetime.now(tz=tz)
+            )
+            list_storage[list_id] = _list
         return _list
 
     @classmethod
+    @changes_data
     def load(cls, list_id: str, title: str, uid: int, description: str, options: Lst[str], choices: Lst[str],
              single_response: bool, message_details: Lst[str], expiry: int, created_date: str) -> None:
-        _list = cls(list_id, title, uid, description, list(), choices, single_response, set(message_details),
-                    expiry, datetime.fromisoformat(created_date))
+        _list = cls(list_id, title, uid, description, list(), choices, single_response,
+                    OrderedDict.fromkeys(message_details[-MAX_MESSAGE_DETAILS:]), expiry,
+                    datetime.fromisoformat(created_date))
 
         for option_data in options:
             option = ListOption.load(option_data.get(db.LIST_OPTION_TITLE, ""))
@@ -1504,11 +1694,14 @@ class List(object):
                     option.add_allocation(choice_id, _list.get_choice(choice_id))
             _list.add_option(option)
 
-        list_storage[list_id] = _list
+        with storage_lock:
+            list_storage[list_id] = _list
         return
 
+    @changes_data
     def delete(self) -> None:
-        list_storage.pop(self.list_id, None)
+        with storage_lock:
+            list_storage.pop(self.list_id, None)
 
     def get_creator_id(self) -> int:
         return self.creator_id
@@ -1516,17 +1709,24 @@ class List(object):
     def get_list_id(self) -> str:
         return self.list_id
 
+    def get_lock(self) -> threading.RLock:
+        return get_entity_lock(LIST_SUBJECT, self.list_id)
+
     def get_title(self) -> str:
         return self.title
 
+    @changes_data
     def set_title(self, title: str) -> None:
         self.title = title
+        self.version = next(version_counter)
 
     def get_description(self) -> str:
         return self.description
 
+    @changes_data
     def set_description(self, description: str) -> None:
         self.description = description
+        self.version = next(version_counter)
 
     def get_options(self) -> Lst[ListOption]:
         return self.options
@@ -1534,8 +1734,10 @@ class List(object):
     def get_option(self, opt_id) -> ListOption:
         return self.options[opt_id] if self.is_valid_option(opt_id) else None
 
+    @changes_data
     def add_option(self, option) -> None:
         self.options.append(option)
+        self.version = next(version_counter)
 
     def is_valid_option(self, opt_id: int) -> bool:
         return 0 <= opt_id < len(self.options)
@@ -1549,11 +1751,20 @@ class List(object):
     def is_valid_choice(self, choice_id: int) -> bool:
         return 0 <= choice_id < len(self.choices)
 
-    def get_message_details(self) -> Set[str]:
-        return self.message_details
+    @synchronised
+    def get_message_details(self) -> Lst[str]:
+        return list(self.message_details)
 
+    @synchronised
     def add_message_details(self, mid: str) -> None:
-        self.message_details.add(mid)
+        self.message_details[mid] = None
+        self.message_details.move_to_end(mid)
+        while len(self.message_details) > MAX_MESSAGE_DETAILS:
+            self.message_details.popitem(last=False)
+
+    @synchronised
+    def remove_message_details(self, mid: str) -> bool:
+        return self.message_details.pop(mid, False) is None
 
     def has_message_details(self, mid: str) -> bool:
         return mid in self.message_details
@@ -1561,13 +1772,17 @@ class List(object):
     def is_single_response(self) -> bool:
         return self.single_response
 
+    @changes_data
     def set_single_response(self, single_response: bool) -> None:
         self.single_response = single_response
+        self.version = next(version_counter)
 
+    @changes_data
     def toggle_response_type(self) -> str:
         # if any(option.is_allocated() for option in self.options):
         #     return "Cannot change response type for non-empty list."
         self.single_response = not self.single_response
+        self.version = next(version_counter)
         status = "single response" if self.single_response else "multi-response"
         return f"Response type is changed to {status}."
 
@@ -1577,12 +1792,16 @@ class List(object):
     def get_expiry(self) -> int:
         return self.expiry
 
+    @changes_data
     def set_expiry(self, expiry: int) -> None:
         self.expiry = expiry
 
     def get_list_hash(self) -> str:
         return f"{self.list_id}_{util.simple_hash(self.title, self.list_id, variance=False)}"
 
+    @tracing.traced
+    @synchronised
+    @changes_responses
     def toggle(self, opt_id: int, choice_id: int) -> str:
         if not self.is_valid_option(opt_id) or not self.is_valid_choice(choice_id):
             return "Sorry, invalid option or choice."
@@ -1620,6 +1839,8 @@ class List(object):
     def generate_options_summary(self) -> str:
         return " / ".join(option.get_title() for option in self.options)
 
+    @tracing.traced
+    @synchronised
     def render_text(self) -> str:
         title = util.make_html_bold(self.title)
         description = util.make_html_italic(self.description)
@@ -1628,12 +1849,17 @@ class List(object):
         footer = [f"{EMOJI_PEOPLE} {self.generate_allocations_summary()}"]
         return "\n\n".join(header + body + footer)
 
+    @tracing.traced
+    @cached_markup
     def build_update_buttons(self) -> InlineKeyboardMarkup:
         update_button = util.build_switch_button("Update", f"/update {self.get_list_hash()}", to_self=True)
         refresh_button = self.build_button("Refresh", USER_REFRESH)
         buttons = [[update_button, refresh_button]]
         return InlineKeyboardMarkup(buttons)
 
+    @tracing.traced
+    @synchronised
+    @cached_markup
     def build_option_buttons(self) -> InlineKeyboardMarkup:
         buttons = []
         for i, option in enumerate(self.options):
@@ -1644,6 +1870,7 @@ class List(object):
         buttons.append([refresh_button, done_button])
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_admin_buttons(self) -> InlineKeyboardMarkup:
         publish_button = util.build_switch_button("Publish", self.title)
         settings_button = self.build_button("Settings", SETTINGS)
@@ -1652,6 +1879,7 @@ class List(object):
         buttons = [[publish_button], [settings_button], [refresh_button, close_button]]
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_settings_buttons(self, is_creator=False) -> InlineKeyboardMarkup:
         response_text = "Multi-Response" if self.single_response else "Single Response"
         toggle_response_button = self.build_button(f"Change to {response_text}", RESPONSE)
@@ -1662,6 +1890,7 @@ class List(object):
             buttons.insert(-1, [delete_button])
         return InlineKeyboardMarkup(buttons)
 
+    @cached_markup
     def build_choice_buttons(self, opt_id: int, page_number: int = 0, index: int = 0) -> InlineKeyboardMarkup:
         choice_button_group = PaginationButtonGroup(
             self.choices, (LIST_SUBJECT, f"{CHOICE}_{opt_id}", self.list_id),
@@ -1682,6 +1911,7 @@ class List(object):
     def build_button(self, text: str, action: str) -> InlineKeyboardButton:
         return util.build_button(text, LIST_SUBJECT, action, self.list_id)
 
+    @synchronised
     def to_json(self) -> dict:
         return {
             db.LIST_ID: self.list_id,
@@ -2057,6 +2287,7 @@ class Template(object):
         return self._name
 
     @name.setter
+    @changes_data
     def name(self, new_name: str) -> None:
         self._name = new_name
         return
@@ -2066,6 +2297,7 @@ class Template(object):
         return self._description
 
     @description.setter
+    @changes_data
     def description(self, new_description: str) -> None:
         self._description = new_description
         return
@@ -2075,6 +2307,7 @@ class Template(object):
         return self._title_format
 
     @title_format.setter
+    @changes_data
     def title_format(self, new_title: str) -> None:
         self._title_format = FormatTextCode.create_new(new_title)
         return
@@ -2084,6 +2317,7 @@ class Template(object):
         return self._description_format
 
     @description_format.setter
+    @changes_data
     def description_format(self, new_description: str) -> None:
         self._description_format = FormatTextCode.create_new(new_description)
         return
@@ -2123,17 +2357,20 @@ class PollTemplate(Template):
         return [template for template in template_lists if filters.lower() in template.name.lower()]
 
     @classmethod
+    @changes_data
     def create_new(cls, name: str, description: str, title_format_string: str, description_format_string: str,
                    options: Lst[str], single_response: bool, creator_id: int) -> PollTemplate:
-        temp_id = "P" + util.generate_random_id(POLL_ID_LENGTH, set(temp_poll_storage.keys()))
         title_format = FormatTextCode.create_new(title_format_string)
         description_format = FormatTextCode.create_new(description_format_string)
-        template = \
-            cls(temp_id, name, description, title_format, description_format, options, single_response, creator_id)
-        temp_poll_storage[temp_id] = template
+        with storage_lock:
+            temp_id = "P" + util.generate_random_id(POLL_ID_LENGTH, set(temp_poll_storage.keys()))
+            template = \
+                cls(temp_id, name, description, title_format, description_format, options, single_response, creator_id)
+            temp_poll_storage[temp_id] = template
         return template
 
     @classmethod
+    @changes_data
     def load(cls, temp_id: str, name: str, description: str, title_format_data: Dict[str, Dict[str, Lst[str]]],
              description_format_data: Dict[str, Dict[str, Lst[str]]], options: Lst[str], single_response: bool,
              creator_id: int) -> None:
@@ -2148,11 +2385,14 @@ class PollTemplate(Template):
 
         template = \
             cls(temp_id, name, description, title_format, description_format, options, single_response, creator_id)
-        temp_poll_storage[temp_id] = template
+        with storage_lock:
+            temp_poll_storage[temp_id] = template
         return
 
+    @changes_data
     def delete(self) -> None:
-        temp_poll_storage.pop(self._temp_id, None)
+        with storage_lock:
+            temp_poll_storage.pop(self._temp_id, None)
 
     @property
     def options(self) -> Lst[str]:
@@ -2163,10 +2403,12 @@ class PollTemplate(Template):
         return self._is_single_response
 
     @is_single_response.setter
+    @changes_data
     def is_single_response(self, new_response_type: bool) -> None:
         self._is_single_response = new_response_type
         return
 
+    @changes_data
     def toggle_response_type(self) -> str:
         self.is_single_response = not self.is_single_response
         status = "single response" if self.is_single_response else "multi-response"
@@ -2354,17 +2596,20 @@ class ListTemplate(Template):
         return [template for template in template_lists if filters.lower() in template.name.lower()]
 
     @classmethod
+    @changes_data
     def create_new(cls, name: str, description: str, title_format_string: str, description_format_string: str,
                    options: Lst[str], choices: Lst[str], single_response: bool, creator_id: int) -> ListTemplate:
-        temp_id = "L" + util.generate_random_id(LIST_ID_LENGTH, set(temp_list_storage.keys()))
         title_format = FormatTextCode.create_new(title_format_string)
         description_format = FormatTextCode.create_new(description_format_string)
-        template = cls(temp_id, name, description, title_format, description_format, options, choices,
-                       single_response, creator_id)
-        temp_list_storage[temp_id] = template
+        with storage_lock:
+            temp_id = "L" + util.generate_random_id(LIST_ID_LENGTH, set(temp_list_storage.keys()))
+            template = cls(temp_id, name, description, title_format, description_format, options, choices,
+                           single_response, creator_id)
+            temp_list_storage[temp_id] = template
         return template
 
     @classmethod
+    @changes_data
     def load(cls, temp_id: str, name: str, description: str, title_format_data: Dict[str, Dict[str, Lst[str]]],
              description_format_data: Dict[str, Dict[str, Lst[str]]], options: Lst[str], choices: Lst[str],
              single_response: bool, creator_id: int) -> None:
@@ -2379,11 +2624,14 @@ class ListTemplate(Template):
 
         template = cls(temp_id, name, description, title_format, description_format, options, choices,
                        single_response, creator_id)
-        temp_list_storage[temp_id] = template
+        with storage_lock:
+            temp_list_storage[temp_id] = template
         return
 
+    @changes_data
     def delete(self) -> None:
-        temp_list_storage.pop(self._temp_id, None)
+        with storage_lock:
+            temp_list_storage.pop(self._temp_id, None)
 
     @property
     def options(self) -> Lst[str]:
@@ -2398,10 +2646,12 @@ class ListTemplate(Template):
         return self._is_single_response
 
     @is_single_response.setter
+    @changes_data
     def is_single_response(self, new_response_type: bool) -> None:
         self._is_single_response = new_response_type
         return
 
+    @changes_data
     def toggle_response_type(self) -> str:
         self.is_single_response = not self.is_single_response
         status = "single response" if self.is_single_response else "multi-response"
@@ -2591,18 +2841,22 @@ class BotManager(object):
     @staticmethod
     def save_data() -> str:
         try:
-            db.save(user_storage, db.USER_SHEET)
-            db.save(group_storage, db.GROUP_SHEET)
-            db.save(poll_storage, db.POLL_SHEET)
-            db.save(list_storage, db.LIST_SHEET)
-            db.save(temp_poll_storage, db.TEMP_POLL_SHEET)
-            db.save(temp_list_storage, db.TEMP_LIST_SHEET)
+            db.save(copy_storage(user_storage), db.USER_SHEET)
+            db.save(copy_storage(group_storage), db.GROUP_SHEET)
+            db.save(copy_storage(poll_storage), db.POLL_SHEET)
+            db.save(copy_storage(list_storage), db.LIST_SHEET)
+            db.save(copy_storage(temp_poll_storage), db.TEMP_POLL_SHEET)
+            db.save(copy_storage(temp_list_storage), db.TEMP_LIST_SHEET)
             return "Data saved successfully."
         except (TypeError, json.JSONDecodeError) as error:
             return f"Error saving data: {error}"
 
     @staticmethod
-    def load_data() -> str:
+    def load_data(report_progress: Callable[[str, int, int, int], None] = None) -> Tuple[bool, str]:
+        """Loads all data sheets in order, reporting the sheet name, row count and number of sheets loaded so far.
+        Returns whether all the data was loaded, and the status of the load.
+        """
+        report_progress = report_progress or (lambda sheet, row_count, loaded_count, total_count: None)
         try:
             users_data = db.load(db.USER_SHEET)
             for user_data in users_data:
@@ -2619,6 +2873,7 @@ class BotManager(object):
                     user_data[db.USER_TEMP_POLL_IDS],
                     user_data[db.USER_TEMP_LIST_IDS]
                 )
+            report_progress(db.USER_SHEET, len(users_data), 1, 6)
 
             groups_data = db.load(db.GROUP_SHEET)
             for group_data in groups_data:
@@ -2633,6 +2888,7 @@ class BotManager(object):
                     group_data[db.GROUP_TEMP_IDS],
                     group_data[db.GROUP_CREATED_DATE],
                 )
+            report_progress(db.GROUP_SHEET, len(groups_data), 2, 6)
 
             polls_data = db.load(db.POLL_SHEET)
             for poll_data in polls_data:
@@ -2647,6 +2903,7 @@ class BotManager(object):
                     poll_data[db.POLL_EXPIRY],
                     poll_data[db.POLL_CREATED_DATE],
                 )
+            report_progress(db.POLL_SHEET, len(polls_data), 3, 6)
 
             lists_data = db.load(db.LIST_SHEET)
             for list_data in lists_data:
@@ -2662,6 +2919,7 @@ class BotManager(object):
                     list_data[db.LIST_EXPIRY],
                     list_data[db.LIST_CREATED_DATE],
                 )
+            report_progress(db.LIST_SHEET, len(lists_data), 4, 6)
 
             temp_polls_data = db.load(db.TEMP_POLL_SHEET)
             for temp_poll_data in temp_polls_data:
@@ -2675,6 +2933,7 @@ class BotManager(object):
                     temp_poll_data[db.TEMP_POLL_SINGLE_RESPONSE],
                     temp_poll_data[db.TEMP_POLL_CREATOR_ID]
                 )
+            report_progress(db.TEMP_POLL_SHEET, len(temp_polls_data), 5, 6)
 
             temp_lists_data = db.load(db.TEMP_LIST_SHEET)
             for temp_list_data in temp_lists_data:
@@ -2689,10 +2948,11 @@ class BotManager(object):
                     temp_list_data[db.TEMP_LIST_SINGLE_RESPONSE],
                     temp_list_data[db.TEMP_LIST_CREATOR_ID]
                 )
+            report_progress(db.TEMP_LIST_SHEET, len(temp_lists_data), 6, 6)
 
-            return "Data loaded successfully."
+            return True, "Data loaded successfully."
         except (TypeError, json.JSONDecodeError) as error:
-            return f"Error loading data: {error}"
+            return False, f"Error loading data: {error}"
 
     @staticmethod
     def build_access_request_text_and_buttons() -> tuple:
@@ -2729,7 +2989,7 @@ class BotManager(object):
         response = f"Who do you want to promote to a bot leader?"
 
         buttons = []
-        for user in sorted(user_storage.values(), key=lambda u: u.get_name().lower()):
+        for user in sorted(copy_storage(user_storage).values(), key=lambda u: u.get_name().lower()):
             if not user.is_leader():
                 invite_button = util.build_button(user.get_name(), USER_SUBJECT, PROMOTE, util.encode(user.get_uid()))
                 buttons.append([invite_button])
@@ -0,0 +1,479 @@
+"""Outbound message scheduling"""
+import json
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import partial
+from hashlib import blake2b as blake
+from typing import Any, Callable, Dict, Set, Tuple, List as Lst, Union, Optional
+from telegram import InlineKeyboardMarkup
+from telegram.error import TelegramError, RetryAfter, BadRequest
+from telegram.ext import CallbackContext, JobQueue, ExtBot
+from telegram.utils.helpers import DEFAULT_NONE
+
+import tracing
+
+REFRESH_INTERVAL = 1.5  # In seconds
+FAN_OUT_WORKERS = 4
+FAN_OUT_QUEUE_SIZE = 1000
+MAX_TRACKED_MESSAGES = 10000
+
+# Flood control settings
+GLOBAL_RATE_LIMIT = 30  # Requests per second
+PRIVATE_CHAT_RATE_LIMIT = 1  # Messages per second in each private chat
+GROUP_CHAT_RATE_LIMIT = 20 / 60  # Messages per second in each group chat
+CHAT_BURST_LIMIT = 5
+BACKGROUND_RESERVE = 5  # Global requests per second kept for user-facing requests
+MAX_RETRY_AFTER = 30  # In seconds
+MAX_SEND_ATTEMPTS = 3
+MAX_TRACKED_CHATS = 10000
+
+# Request priorities
+URGENT_PRIORITY = 0
+USER_PRIORITY = 1
+BACKGROUND_PRIORITY = 2
+PRIORITY_NAMES = {URGENT_PRIORITY: "urgent", USER_PRIORITY: "user", BACKGROUND_PRIORITY: "background"}
+URGENT_ENDPOINTS = {"answerCallbackQuery", "answerInlineQuery", "getMe", "getUpdates", "setWebhook", "deleteWebhook"}
+CHAT_LIMITED_ENDPOINT_PREFIXES = ("send", "edit", "copy", "forward")
+MESSAGE_CHANGING_ENDPOINT_PREFIXES = ("edit", "deleteMessage")
+
+# Errors after which a message can never be edited again
+PERMANENT_ERROR_MESSAGES = (
+    "message to edit not found", "message_id_invalid", "message can't be edited", "message not found",
+    "chat not found", "have no rights to send a message", "not enough rights"
+)
+
+logger = logging.getLogger(__name__)
+thread_state = threading.local()
+
+
+class RefreshScheduler(object):
+    """Coalesces refreshes of shared messages so that each message is edited at most once per interval.
+
+    Each entity (poll or list) is marked dirty instead of being refreshed immediately. The first mark schedules
+    a flush after the interval; further marks within the interval are merged into the pending flush, which then
+    renders the latest state only once.
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL) -> None:
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[Callable[[bool, Set[str]], None], bool, Set[str]]] = dict()
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def schedule(self, job_queue: JobQueue, key: str, refresh: Callable[[bool, Set[str]], None],
+                 only_buttons=False, fresh_mid="") -> None:
+        """Marks the entity identified by the key as dirty.
+
+        The refresh callback receives whether only the buttons changed, and the message ids that were already
+        updated directly and can be skipped. Only the message updated by the latest change is still fresh.
+        """
+        fresh_mids = {fresh_mid} if fresh_mid else set()
+        with self._lock:
+            if key in self._pending:
+                _, pending_only_buttons, _ = self._pending[key]
+                self._pending[key] = refresh, pending_only_buttons and only_buttons, fresh_mids
+                return
+            self._pending[key] = refresh, only_buttons, fresh_mids
+        job_queue.run_once(self._flush, self._interval, context=key, name=f"Refresh {key}")
+
+    def _flush(self, context: CallbackContext) -> None:
+        key = context.job.context
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if not pending:
+            return
+        refresh, only_buttons, fresh_mids = pending
+        refresh(only_buttons, fresh_mids)
+        return
+
+
+class FanOutExecutor(object):
+    """Runs outbound tasks on a bounded pool of worker threads.
+
+    Tasks with the same key are always run by the same worker, so tasks for the same message or chat are run
+    in the order they were submitted. Submitting blocks when the worker queue is full.
+    """
+
+    def __init__(self, workers: int = FAN_OUT_WORKERS, queue_size: int = FAN_OUT_QUEUE_SIZE) -> None:
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads: Lst[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @property
+    def worker_count(self) -> int:
+        return len(self._queues)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(tasks.qsize() for tasks in self._queues)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i, tasks in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(tasks,), name=f"FanOutWorker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return
+
+    def submit(self, key: Union[str, int], task: Callable[[], None]) -> None:
+        if not self._threads:
+            self.start()
+        self._queues[zlib.crc32(str(key).encode()) % len(self._queues)].put(task)
+        return
+
+    @staticmethod
+    def _work(tasks: queue.Queue) -> None:
+        set_thread_priority(BACKGROUND_PRIORITY)
+        while True:
+            task = tasks.get()
+            try:
+                task()
+            except Exception as err:
+                logger.warning(f"Error running outbound task - {err}")
+            finally:
+                tasks.task_done()
+
+
+class MessageDigestCache(object):
+    """Remembers digests of the last text and markup successfully sent to each message.
+
+    Messages are identified by their inline message id, or by their chat id and message id. The least recently
+    used messages are forgotten once the maximum number of tracked messages is reached.
+    """
+
+    def __init__(self, max_size: int = MAX_TRACKED_MESSAGES) -> None:
+        self._max_size = max_size
+        self._digests: OrderedDict[str, Tuple[str, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    @staticmethod
+    def build_key(inline_message_id: Optional[str] = None, chat_id: Optional[int] = None,
+                  message_id: Optional[int] = None) -> str:
+        return inline_message_id if inline_message_id else f"{chat_id}_{message_id}"
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return blake(text.encode("utf-8"), digest_size=8).hexdigest() if text else ""
+
+    @staticmethod
+    def hash_markup(reply_markup: Optional[InlineKeyboardMarkup]) -> str:
+        if not reply_markup:
+            return ""
+        return blake(json.dumps(reply_markup.to_dict(), sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+    def get_changes(self, key: str, text: str, reply_markup: Optional[InlineKeyboardMarkup],
+                    current_markup: Optional[InlineKeyboardMarkup] = None) -> Tuple[bool, bool]:
+        """Checks whether the text and the markup differ from the content last sent to the message.
+
+        An empty text is treated as unchanged. If the current markup of the message is known, a mismatch with the
+        last sent markup means the message was edited elsewhere, so its last sent content is no longer trusted.
+        """
+        markup_digest = self.hash_markup(reply_markup)
+        with self._lock:
+            last_digests = self._digests.get(key, None)
+            if last_digests:
+                self._digests.move_to_end(key)
+        if not last_digests:
+            return bool(text), True
+
+        last_text_digest, last_markup_digest = last_digests
+        if current_markup is not None and self.hash_markup(current_markup) != last_markup_digest:
+            return bool(text), True
+        is_text_changed = bool(text) and self.hash_text(text) != last_text_digest
+        return is_text_changed, markup_digest != last_markup_digest
+
+    def record(self, key: str, text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> None:
+        """Records the content successfully sent to the message. An empty text keeps the last sent text."""
+        markup_digest = self.hash_markup(reply_markup)
+        with self._lock:
+            last_text_digest, _ = self._digests.pop(key, ("", ""))
+            self._digests[key] = self.hash_text(text) if text else last_text_digest, markup_digest
+            while len(self._digests) > self._max_size:
+                self._digests.popitem(last=False)
+        return
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._digests.pop(key, None)
+        return
+
+
+class ConnectionPoolMonitor(object):
+    """Tracks how many outbound requests are using the connection pool at the same time."""
+
+    def __init__(self, pool_size: int) -> None:
+        self.pool_size = pool_size
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._saturated_count = 0
+        self._lock = threading.Lock()
+        self.saturation_listeners: Lst[Callable[[], None]] = []
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def peak_in_use(self) -> int:
+        return self._peak_in_use
+
+    @property
+    def saturated_count(self) -> int:
+        """Number of requests that found every pooled connection in use and had to open a throwaway connection."""
+        return self._saturated_count
+
+    def add_saturation_listener(self, listener: Callable[[], None]) -> None:
+        """Adds a listener that is told of every request that finds the pool saturated."""
+        self.saturation_listeners.append(listener)
+        return
+
+    def run(self, request: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            is_saturated = self._in_use > self.pool_size
+            if is_saturated:
+                self._saturated_count += 1
+        if is_saturated:
+            logger.warning(f"Connection pool saturated: {self._in_use} requests in flight for {self.pool_size} "
+                           f"pooled connections")
+            for listener in self.saturation_listeners:
+                listener()
+        try:
+            return request()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+
+
+def is_not_modified_error(error: TelegramError) -> bool:
+    return "message is not modified" in str(error).lower()
+
+
+def is_permanent_error(error: TelegramError) -> bool:
+    """Checks if the error means that the message can never be edited again. Other errors may be transient."""
+    if not isinstance(error, BadRequest) or is_not_modified_error(error):
+        return False
+    error_message = str(error).lower()
+    return any(permanent_message in error_message for permanent_message in PERMANENT_ERROR_MESSAGES)
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, capacity: float) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def is_idle(self) -> bool:
+        return self._tokens >= self._capacity and self._blocked_until <= time.monotonic()
+
+    def get_block_time(self, now: float) -> float:
+        return max(self._blocked_until - now, 0.0)
+
+    def get_wait_time(self, now: float, reserve: float = 0.0) -> float:
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        block_time = self.get_block_time(now)
+        if block_time:
+            return block_time
+        required_tokens = 1 + reserve
+        return 0.0 if self._tokens >= required_tokens else (required_tokens - self._tokens) / self._rate
+
+    def take(self) -> None:
+        self._tokens -= 1
+        return
+
+    def block(self, until: float) -> None:
+        self._blocked_until = max(self._blocked_until, until)
+        self._tokens = 0
+        return
+
+
+class OutboundScheduler(object):
+    """Paces outgoing Telegram API requests to stay within the global and per-chat flood limits.
+
+    Urgent requests such as callback query answers only wait for flood control blocks. User-facing requests take
+    precedence over background requests, which also leave part of the global rate free for user-facing requests.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE_LIMIT, private_chat_rate: float = PRIVATE_CHAT_RATE_LIMIT,
+                 group_chat_rate: float = GROUP_CHAT_RATE_LIMIT, chat_burst: int = CHAT_BURST_LIMIT,
+                 background_reserve: float = BACKGROUND_RESERVE) -> None:
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._private_chat_rate = private_chat_rate
+        self._group_chat_rate = group_chat_rate
+        self._chat_burst = chat_burst
+        self._background_reserve = background_reserve
+        self._chat_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._condition = threading.Condition()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._waiting.values())
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        return {PRIORITY_NAMES[priority]: count for priority, count in self._waiting.items()}
+
+    @staticmethod
+    def get_priority(endpoint: str) -> int:
+        if endpoint in URGENT_ENDPOINTS:
+            return URGENT_PRIORITY
+        return getattr(thread_state, "priority", USER_PRIORITY)
+
+    @staticmethod
+    def get_chat_key(endpoint: str, data: Dict[str, Any]) -> str:
+        if not endpoint.startswith(CHAT_LIMITED_ENDPOINT_PREFIXES):
+            return ""
+        return str(data.get("chat_id", "") or data.get("inline_message_id", ""))
+
+    def _get_chat_bucket(self, chat_key: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_key, None)
+        if bucket:
+            self._chat_buckets.move_to_end(chat_key)
+            return bucket
+
+        rate = self._group_chat_rate if chat_key.startswith("-") else self._private_chat_rate
+        bucket = TokenBucket(rate, self._chat_burst)
+        self._chat_buckets[chat_key] = bucket
+        while len(self._chat_buckets) > MAX_TRACKED_CHATS:
+            oldest_key, oldest_bucket = next(iter(self._chat_buckets.items()))
+            if not oldest_bucket.is_idle:
+                break
+            self._chat_buckets.pop(oldest_key)
+        return bucket
+
+    def acquire(self, chat_key: str, priority: int) -> None:
+        """Waits until the request is allowed to be sent."""
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    chat_bucket = self._get_chat_bucket(chat_key) if chat_key else None
+                    if priority == URGENT_PRIORITY:
+                        wait_time = self._global_bucket.get_block_time(now)
+                        if chat_bucket:
+                            wait_time = max(wait_time, chat_bucket.get_block_time(now))
+                        if wait_time <= 0:
+                            return
+                    else:
+                        reserve = self._background_reserve if priority == BACKGROUND_PRIORITY else 0.0
+                        wait_time = self._global_bucket.get_wait_time(now, reserve)
+                        if chat_bucket:
+                            wait_time = max(wait_time, chat_bucket.get_wait_time(now))
+                        if wait_time <= 0 and priority == BACKGROUND_PRIORITY and self._waiting[USER_PRIORITY]:
+                            wait_time = 1 / self._global_bucket.rate
+                        if wait_time <= 0:
+                            self._global_bucket.take()
+                            if chat_bucket:
+                                chat_bucket.take()
+                            return
+                    self._condition.wait(wait_time)
+            finally:
+                self._waiting[priority] -= 1
+
+    def defer(self, chat_key: str, retry_after: float) -> None:
+        """Blocks requests to the chat, or all requests if there is no chat, for the given number of seconds."""
+        until = time.monotonic() + retry_after
+        with self._condition:
+            bucket = self._get_chat_bucket(chat_key) if chat_key else self._global_bucket
+            bucket.block(until)
+        return
+
+    def send(self, endpoint: str, data: Dict[str, Any], request: Callable[[], Any]) -> Any:
+        """Sends the request once allowed, retrying after flood control errors."""
+        priority = self.get_priority(endpoint)
+        chat_key = self.get_chat_key(endpoint, data)
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            self.acquire(chat_key, priority)
+            try:
+                return request()
+            except RetryAfter as err:
+                logger.warning(f"Flood control exceeded for {endpoint} {chat_key} - retry in {err.retry_after}s")
+                if err.retry_after > MAX_RETRY_AFTER or attempt == MAX_SEND_ATTEMPTS:
+                    raise
+                if priority == URGENT_PRIORITY and not chat_key:
+                    time.sleep(err.retry_after)
+                else:
+                    self.defer(chat_key, err.retry_after)
+        return None
+
+
+class ScheduledBot(ExtBot):
+    """Bot that sends all API requests through an outbound scheduler.
+
+    Every edit or deletion of a message forgets the digests of the message, so that the edits made without checking
+    the digests first do not leave them stale. Edits made through the digest checks record the digests again.
+    """
+
+    def __init__(self, token: str, scheduler: OutboundScheduler,
+                 message_digests: Optional[MessageDigestCache] = None, **kwargs) -> None:
+        super().__init__(token, **kwargs)
+        self.scheduler = scheduler
+        self.message_digests = message_digests
+        self.pool_monitor = ConnectionPoolMonitor(self.request.con_pool_size)
+        self.request_listeners: Lst[Callable[[str, str, float], None]] = []
+
+    def add_request_listener(self, listener: Callable[[str, str, float], None]) -> None:
+        """Adds a listener that is told the endpoint, outcome and duration of every request sent to Telegram.
+        The outcome is "ok" or the name of the error raised.
+        """
+        self.request_listeners.append(listener)
+        return
+
+    def _post(self, endpoint: str, data: Dict[str, Any] = None, timeout=DEFAULT_NONE,
+              api_kwargs: Dict[str, Any] = None) -> Any:
+        if self.message_digests and endpoint.startswith(MESSAGE_CHANGING_ENDPOINT_PREFIXES):
+            request_data = {**(data or {}), **(api_kwargs or {})}
+            self.message_digests.forget(MessageDigestCache.build_key(
+                request_data.get("inline_message_id", None), request_data.get("chat_id", None),
+                request_data.get("message_id", None)
+            ))
+        request = partial(self.pool_monitor.run, partial(super()._post, endpoint, data, timeout, api_kwargs))
+        with tracing.span(f"api.{endpoint}"):
+            return self.scheduler.send(
+                endpoint, {**(data or {}), **(api_kwargs or {})}, partial(self._send_request, endpoint, request)
+            )
+
+    def _send_request(self, endpoint: str, request: Callable[[], Any]) -> Any:
+        start_time = time.perf_counter()
+        outcome = "ok"
+        try:
+            return request()
+        except Exception as error:
+            outcome = type(error).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            for listener in self.request_listeners:
+                listener(endpoint, outcome, duration)
+
+
+def set_thread_priority(priority: int) -> None:
+    """Sets the priority of outbound requests sent from the current thread."""
+    thread_state.priority = priority
+    return
@@ -0,0 +1,62 @@
+"""Sampling profiler"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Dict, Optional
+
+SAMPLE_INTERVAL = 0.01  # In seconds
+MAX_STACK_DEPTH = 100
+
+
+def describe_frame(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def collapse_stack(thread_name: str, frame: Optional[FrameType]) -> str:
+    """Describes the stack from the outermost frame to the innermost one, separated by semicolons."""
+    frames = []
+    while frame and len(frames) < MAX_STACK_DEPTH:
+        frames.append(describe_frame(frame))
+        frame = frame.f_back
+    return ";".join([thread_name.replace(";", ",")] + frames[::-1])
+
+
+class SamplingProfiler(object):
+    """Periodically samples the stacks of all other threads, without tracing every call.
+
+    The samples are written in the collapsed stack format, which flame graph tools take as input.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, duration: float) -> Optional[str]:
+        """Samples all other threads for the duration. Returns None if a profile is already being taken."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(duration)
+        finally:
+            self._lock.release()
+
+    def _sample(self, duration: float) -> str:
+        stack_counts = Counter()
+        current_thread_id = threading.get_ident()
+        end_time = time.monotonic() + duration
+        while time.monotonic() < end_time:
+            thread_names: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == current_thread_id:
+                    continue
+                stack_counts[collapse_stack(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+            time.sleep(self.interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stack_counts.most_common())
@@ -0,0 +1,116 @@
+"""Callback query routing"""
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import CallbackQuery
+from telegram.ext import CallbackContext
+
+import tracing
+import util
+
+PAGE_PREFIX = "page"
+
+
+class CallbackAction(NamedTuple):
+    """Action of a callback query, eg. "page2_choice_3" has name "choice", arguments ("3",) and page number 2."""
+    text: str
+    name: str
+    args: Tuple[str, ...]
+    page_number: Optional[int]
+
+    @property
+    def is_paged(self) -> bool:
+        return self.page_number is not None
+
+    def get_int(self, i: int) -> Optional[int]:
+        """Gets the i-th argument as an integer, or None if it is missing or not a number."""
+        if i < len(self.args) and self.args[i].isdigit():
+            return int(self.args[i])
+        return None
+
+
+RouteHandler = Callable[[CallbackQuery, CallbackContext, CallbackAction, str], None]
+FallbackHandler = Callable[[CallbackQuery, CallbackContext, str, str], None]
+GeneralHandler = Callable[[CallbackQuery, CallbackContext, str], None]
+RouteListener = Callable[[str, str, float], None]
+
+
+def parse_action(text: str) -> CallbackAction:
+    """Splits an action into its name and arguments. An action that starts with a number has an empty name."""
+    page_number = None
+    name, *args = text.split("_")
+    if name.startswith(PAGE_PREFIX) and name[len(PAGE_PREFIX):].isdigit() and args:
+        page_number = int(name[len(PAGE_PREFIX):])
+        name, *args = args
+    if name.isdigit():
+        name, args = "", [name] + args
+    return CallbackAction(text, name, tuple(args), page_number)
+
+
+class CallbackRouter(object):
+    """Dispatches callback queries to handlers registered by subject and action name.
+
+    Actions without a registered handler go to the fallback handler of their subject with the raw action text.
+    """
+
+    def __init__(self) -> None:
+        self._routes: Dict[Tuple[str, str, bool], RouteHandler] = dict()
+        self._fallbacks: Dict[str, FallbackHandler] = dict()
+        self._general_handler: Optional[GeneralHandler] = None
+        self._listeners: List[RouteListener] = []
+
+    def route(self, subject: str, name: str, paged=False) -> Callable[[RouteHandler], RouteHandler]:
+        """Registers the decorated function as the handler of an action of a subject."""
+        def register(handler: RouteHandler) -> RouteHandler:
+            self._routes[(subject, name, paged)] = handler
+            return handler
+        return register
+
+    def fallback(self, subject: str) -> Callable[[FallbackHandler], FallbackHandler]:
+        """Registers the decorated function as the handler of all other actions of a subject."""
+        def register(handler: FallbackHandler) -> FallbackHandler:
+            self._fallbacks[subject] = handler
+            return handler
+        return register
+
+    def general(self, handler: GeneralHandler) -> GeneralHandler:
+        """Registers the decorated function as the handler of callback queries without a subject."""
+        self._general_handler = handler
+        return handler
+
+    def add_listener(self, listener: RouteListener) -> None:
+        """Adds a listener that is told the subject, action name and duration of every handled callback query."""
+        self._listeners.append(listener)
+        return
+
+    def dispatch(self, query: CallbackQuery, context: CallbackContext) -> bool:
+        """Handles a callback query. Returns False if the callback query has an unknown subject or corrupted data."""
+        data = query.data.strip()
+        start_time = time.perf_counter()
+
+        try:
+            decoded_data = util.decode_callback_data(data)
+        except ValueError:
+            return False
+
+        if not decoded_data:
+            subject, action_name = "", data
+            self._general_handler(query, context, data)
+        else:
+            subject, action_text, identifier = decoded_data
+            action = parse_action(action_text)
+            action_name = action.name
+            handler = self._routes.get((subject, action.name, action.is_paged), None)
+            if handler:
+                with tracing.span(f"callback.{subject}.{action.name}"):
+                    handler(query, context, action, identifier)
+            elif subject in self._fallbacks:
+                with tracing.span(f"callback.{subject}"):
+                    self._fallbacks[subject](query, context, action_text, identifier)
+            else:
+                return False
+
+        duration = time.perf_counter() - start_time
+        for listener in self._listeners:
+            listener(subject, action_name, duration)
+        return True
@@ -0,0 +1,77 @@
+"""Startup readiness"""
+import logging
+import threading
+from collections import deque
+from queue import Queue
+from typing import Deque
+
+from telegram import Update
+
+MAX_HELD_UPDATES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessGate(object):
+    """Holds back updates that arrive while the bot's data is still loading, and replays them once it is loaded.
+
+    Updates are replayed in the order they came in. Inline queries are dropped instead, as Telegram stops waiting
+    for their answers long before the data is loaded. If the data cannot be loaded, the gate is still opened so that
+    the bot stays reachable, but is marked as not loaded until the data is loaded again.
+    """
+
+    def __init__(self, max_held_updates=MAX_HELD_UPDATES) -> None:
+        self._max_held_updates = max_held_updates
+        self._held_updates: Deque[Update] = deque()
+        self._dropped_count = 0
+        self._is_ready = False
+        self._is_data_loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._is_ready
+
+    @property
+    def is_data_loaded(self) -> bool:
+        return self._is_data_loaded
+
+    def mark_data_loaded(self) -> None:
+        self._is_data_loaded = True
+        return
+
+    def hold(self, update: Update) -> bool:
+        """Holds back the update if the data is still loading. Returns False if the update can be handled now."""
+        if self._is_ready:
+            return False
+        with self._lock:
+            if self._is_ready:
+                return False
+            if update.inline_query:
+                return True
+            if len(self._held_updates) >= self._max_held_updates:
+                self._dropped_count += 1
+                logger.warning(f"Dropped update {update.update_id} as {self._max_held_updates} updates are held back")
+                return True
+            self._held_updates.append(update)
+            return True
+
+    @staticmethod
+    def report_progress(sheet: str, row_count: int, loaded_count: int, total_count: int) -> None:
+        logger.info(f"Loading data: {loaded_count}/{total_count} sheets loaded ({row_count} {sheet} rows)")
+        return
+
+    def open(self, update_queue: Queue, is_data_loaded=True) -> None:
+        """Lets updates through, and queues the held back updates to be handled again."""
+        with self._lock:
+            self._is_ready = True
+            self._is_data_loaded = is_data_loaded
+            held_updates, self._held_updates = self._held_updates, deque()
+            for update in held_updates:
+                update_queue.put(update)
+        if not is_data_loaded:
+            logger.critical("Bot is opened WITHOUT its data loaded, saving is disabled until the data is loaded")
+        logger.info(
+            f"Bot is ready, replaying {len(held_updates)} held back updates and dropped {self._dropped_count} updates"
+        )
+        return
@@ -0,0 +1,73 @@
+"""Round trips of callback data through encoding, decoding and routing"""
+from types import SimpleNamespace
+
+import models
+import ui
+import util
+from router import CallbackAction, CallbackRouter, parse_action
+
+
+def build_router(calls: list) -> CallbackRouter:
+    callback_router = CallbackRouter()
+
+    @callback_router.general
+    def handle_general(query, context, action):
+        calls.append(("", action, ""))
+
+    @callback_router.route(models.LIST_SUBJECT, models.CHOICE, paged=True)
+    def handle_paged_choice(query, context, action, identifier):
+        calls.append((models.LIST_SUBJECT, action.text, identifier, action.page_number, action.get_int(0)))
+
+    @callback_router.fallback(models.POLL_SUBJECT)
+    def handle_poll(query, context, action, identifier):
+        calls.append((models.POLL_SUBJECT, action, identifier))
+
+    return callback_router
+
+
+def dispatch(button) -> list:
+    calls = []
+    assert build_router(calls).dispatch(SimpleNamespace(data=button.callback_data), None)
+    return calls
+
+
+def test_general_page_button_round_trip():
+    pagination = ui.PaginationTextGroup([f"Poll {i}" for i in range(12)], ("", models.POLL, ""))
+    next_button = pagination.build_next_button(0)
+    assert next_button.callback_data == f"{models.PAGE}1_{models.POLL}"
+    assert util.decode_callback_data(next_button.callback_data) is None
+    assert dispatch(next_button) == [("", f"{models.PAGE}1_{models.POLL}", "")]
+
+    previous_button = pagination.build_previous_button(0)
+    assert dispatch(previous_button) == [("", f"{models.PAGE}2_{models.POLL}", "")]
+
+
+def test_subject_page_button_round_trip():
+    pagination = ui.PaginationButtonGroup(
+        [f"Choice {i}" for i in range(12)], (models.LIST_SUBJECT, models.CHOICE, "abcd1234")
+    )
+    next_button = pagination.build_next_button(0)
+    assert util.decode_callback_data(next_button.callback_data) == \
+        (models.LIST_SUBJECT, f"{models.PAGE}1_{models.CHOICE}", "abcd1234")
+    assert dispatch(next_button) == [(models.LIST_SUBJECT, f"{models.PAGE}1_{models.CHOICE}", "abcd1234", 1, None)]
+
+
+def test_subject_button_round_trip():
+    button = util.build_button("Option", models.POLL_SUBJECT, "12", "abcd1234")
+    assert dispatch(button) == [(models.POLL_SUBJECT, "12", "abcd1234")]
+
+
+def test_general_button_round_trip():
+    button = util.build_button("Cancel", "", models.RESET)
+    assert button.callback_data == models.RESET
+    assert dispatch(button) == [("", models.RESET, "")]
+
+
+def test_parse_action():
+    assert parse_action("choice_3") == CallbackAction("choice_3", "choice", ("3",), None)
+    assert parse_action("page2_choice_3") == CallbackAction("page2_choice_3", "choice", ("3",), 2)
+    # Actions that start with a number have an empty name
+    assert parse_action("12") == CallbackAction("12", "", ("12",), None)
+    # A page prefix without an action after it is the name itself
+    assert parse_action("page2") == CallbackAction("page2", "page2", (), None)
+    assert parse_action("page2_choice_x").get_int(0) is None
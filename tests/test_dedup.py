@@ -0,0 +1,79 @@
+"""Duplicate update and repeated tap detection"""
+from types import SimpleNamespace
+
+import pytest
+
+import dedup
+from dedup import RecentKeys, TapSuppressor
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the monotonic clock of the dedup module with one that only moves when told to."""
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(dedup.time, "monotonic", lambda: clock.now)
+    return clock
+
+
+def test_recent_keys_drop_repeats_within_window(clock):
+    recent_keys = RecentKeys(window=10)
+    assert recent_keys.add(1)
+    assert not recent_keys.add(1)
+    clock.now += 9.9
+    assert not recent_keys.add(1)
+    assert recent_keys.add(2)
+
+
+def test_recent_keys_expire_after_window(clock):
+    recent_keys = RecentKeys(window=10)
+    recent_keys.add(1)
+    clock.now += 5
+    recent_keys.add(2)
+    clock.now += 5
+    assert len(recent_keys) == 2
+    assert recent_keys.add(1)
+    # Only the keys that expired are dropped
+    assert not recent_keys.add(2)
+
+
+def test_recent_keys_drop_oldest_over_maximum(clock):
+    recent_keys = RecentKeys(max_keys=2, window=10)
+    for key in (1, 2, 3):
+        recent_keys.add(key)
+    assert len(recent_keys) == 2
+    assert not recent_keys.add(3)
+    assert recent_keys.add(1)
+
+
+def test_tap_suppressor_applies_first_tap_only(clock):
+    taps = TapSuppressor(window=1.0)
+    calls = []
+
+    def vote() -> str:
+        calls.append(len(calls))
+        return f"Voted {len(calls)}"
+
+    assert taps.apply((1, "poll"), vote) == ("Voted 1", True)
+    clock.now += 0.5
+    assert taps.apply((1, "poll"), vote) == ("Voted 1", False)
+    # Taps by other users or on other buttons are applied
+    assert taps.apply((2, "poll"), vote) == ("Voted 2", True)
+    assert len(calls) == 2
+
+
+def test_tap_suppressor_applies_taps_after_window(clock):
+    taps = TapSuppressor(window=1.0)
+    assert taps.apply("key", lambda: "First") == ("First", True)
+    clock.now += 1.0
+    assert taps.apply("key", lambda: "Second") == ("Second", True)
+
+
+def test_tap_suppressor_answers_tap_still_being_applied(clock):
+    taps = TapSuppressor(window=1.0)
+
+    def vote() -> str:
+        # A repeated tap while the first one is still applied gets an empty status
+        assert taps.apply("key", lambda: "Repeated") == ("", False)
+        return "Voted"
+
+    assert taps.apply("key", vote) == ("Voted", True)
@@ -0,0 +1,94 @@
+"""Inline query answer caching and tracking"""
+import threading
+from types import SimpleNamespace
+
+from telegram import InlineQuery, User
+
+from inline import InlineAnswer, InlineAnswerCache, InlineQueryKey, InlineQueryTracker, get_response_versions
+
+
+def build_query(uid: int, text: str, offset="", query_id="1", chat_type="private") -> InlineQuery:
+    return InlineQuery(query_id, User(uid, "User", False), text, offset, chat_type=chat_type)
+
+
+def build_answer(text: str) -> InlineAnswer:
+    return InlineAnswer((), text, "start", None, 0, True)
+
+
+def test_key_normalises_query():
+    key = InlineQueryKey.of(build_query(1, "  Lunch "), 5)
+    assert key == InlineQueryKey(1, "private", "Lunch", "", 5)
+    assert key.page == ("private", "Lunch", "")
+
+
+def test_cache_returns_answer_for_same_page_and_data_version():
+    cache = InlineAnswerCache()
+    key = InlineQueryKey.of(build_query(1, "Lunch"), 5)
+    cache.put(key, build_answer("Lunch"))
+    assert cache.get(InlineQueryKey.of(build_query(1, "Lunch "), 5)) == build_answer("Lunch")
+    # Answers are kept for each user, page and chat type
+    assert cache.get(InlineQueryKey.of(build_query(2, "Lunch"), 5)) is None
+    assert cache.get(InlineQueryKey.of(build_query(1, "Lunch", offset="10"), 5)) is None
+    assert cache.get(InlineQueryKey.of(build_query(1, "Lunch", chat_type="group"), 5)) is None
+
+
+def test_cache_invalidates_answers_of_older_data_versions():
+    cache = InlineAnswerCache()
+    cache.put(InlineQueryKey.of(build_query(1, "Lunch"), 5), build_answer("Old"))
+    assert cache.get(InlineQueryKey.of(build_query(1, "Lunch"), 6)) is None
+
+    cache.put(InlineQueryKey.of(build_query(1, "Lunch"), 6), build_answer("New"))
+    assert len(cache) == 1
+    assert cache.get(InlineQueryKey.of(build_query(1, "Lunch"), 6)) == build_answer("New")
+
+
+def test_cache_invalidates_answers_when_shown_responses_change():
+    cache = InlineAnswerCache()
+    poll, other_poll = SimpleNamespace(response_version=1), SimpleNamespace(response_version=1)
+    key = InlineQueryKey.of(build_query(1, "Lunch"), 5)
+    cache.put(key, build_answer("Lunch"), get_response_versions([poll]))
+
+    other_poll.response_version = 2
+    assert cache.get(key) == build_answer("Lunch")
+    poll.response_version = 2
+    assert cache.get(key) is None
+
+
+def test_cache_drops_least_recently_used_answers():
+    cache = InlineAnswerCache(max_users=2, max_answers_per_user=2)
+    keys = [InlineQueryKey.of(build_query(1, text), 5) for text in ("A", "B", "C")]
+    for key in keys[:2]:
+        cache.put(key, build_answer(key.text))
+    cache.get(keys[0])
+    cache.put(keys[2], build_answer("C"))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == build_answer("A")
+
+    cache.put(InlineQueryKey.of(build_query(2, "A"), 5), build_answer("A"))
+    cache.get(keys[0])
+    cache.put(InlineQueryKey.of(build_query(3, "A"), 5), build_answer("A"))
+    assert cache.get(InlineQueryKey.of(build_query(2, "A"), 5)) is None
+    assert cache.get(keys[0]) == build_answer("A")
+
+
+def test_tracker_marks_older_queries_stale():
+    tracker = InlineQueryTracker()
+    first_query, second_query = build_query(1, "L", query_id="1"), build_query(1, "Lu", query_id="2")
+    tracker.track(first_query)
+    assert not tracker.is_stale(first_query)
+    tracker.track(second_query)
+    assert tracker.is_stale(first_query)
+    assert not tracker.is_stale(second_query)
+    assert not tracker.is_stale(build_query(2, "L", query_id="3"))
+
+
+def test_tracker_debounce_stops_when_newer_query_comes_in():
+    tracker = InlineQueryTracker()
+    first_query = build_query(1, "L", query_id="1")
+    tracker.track(first_query)
+    assert tracker.debounce(first_query, 0.01)
+
+    timer = threading.Timer(0.05, tracker.track, (build_query(1, "Lu", query_id="2"),))
+    timer.start()
+    assert not tracker.debounce(first_query, 5)
+    timer.join()
@@ -0,0 +1,48 @@
+"""Rendering of metrics in the Prometheus text format"""
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_renders_each_label_set():
+    counter = Counter("requests_total", "Requests sent", ("method", "outcome"))
+    counter.increment(("sendMessage", "ok"))
+    counter.increment(("sendMessage", "ok"), 2)
+    counter.increment(("editMessageText", 'Bad "request"'))
+    assert counter.get(("sendMessage", "ok")) == 3
+    assert counter.render() == [
+        "# HELP requests_total Requests sent",
+        "# TYPE requests_total counter",
+        'requests_total{method="editMessageText",outcome="Bad \\"request\\""} 1.0',
+        'requests_total{method="sendMessage",outcome="ok"} 3.0',
+    ]
+
+
+def test_gauge_reads_values_when_rendered():
+    items = [1, 2]
+    gauge = Gauge("items", "Stored items")
+    gauge.read_from(lambda: len(items))
+    items.append(3)
+    assert gauge.render_samples() == ["items 3.0"]
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ("handler",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(("vote",), value)
+    assert histogram.get_count(("vote",)) == 3
+    assert histogram.render_samples() == [
+        'latency_seconds_bucket{handler="vote",le="0.1"} 1',
+        'latency_seconds_bucket{handler="vote",le="1.0"} 2',
+        'latency_seconds_bucket{handler="vote",le="+Inf"} 3',
+        'latency_seconds_sum{handler="vote"} 5.55',
+        'latency_seconds_count{handler="vote"} 3',
+    ]
+
+
+def test_registry_renders_all_metrics():
+    registry = Registry()
+    registry.register(Counter("first_total", "First")).increment()
+    registry.register(Gauge("second", "Second")).read_from(lambda: 2)
+    assert registry.render() == "\n".join([
+        "# HELP first_total First", "# TYPE first_total counter", "first_total 1.0",
+        "# HELP second Second", "# TYPE second gauge", "second 2.0",
+    ]) + "\n"
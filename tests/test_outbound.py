@@ -0,0 +1,184 @@
+"""Flood control pacing, message digests and background refreshes"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import outbound
+from outbound import FanOutExecutor, MessageDigestCache, RefreshScheduler, ScheduledBot, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the monotonic clock of the outbound module with one that only moves when told to."""
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(outbound.time, "monotonic", lambda: clock.now)
+    return clock
+
+
+def build_markup(text: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=text)]])
+
+
+def test_token_bucket_waits_for_missing_tokens(clock):
+    bucket = TokenBucket(2, 2)
+    assert bucket.get_wait_time(clock.now) == 0.0
+    bucket.take()
+    bucket.take()
+    assert bucket.get_wait_time(clock.now) == pytest.approx(0.5)
+    assert bucket.get_wait_time(clock.now + 0.25) == pytest.approx(0.25)
+    assert bucket.get_wait_time(clock.now + 0.5) == 0.0
+
+
+def test_token_bucket_keeps_reserve(clock):
+    bucket = TokenBucket(10, 10)
+    for _ in range(5):
+        bucket.take()
+    assert bucket.get_wait_time(clock.now) == 0.0
+    assert bucket.get_wait_time(clock.now, reserve=5) == pytest.approx(0.1)
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(1, 3)
+    for _ in range(3):
+        bucket.take()
+    assert not bucket.is_idle
+    clock.now += 100
+    assert bucket.get_wait_time(clock.now) == 0.0
+    assert bucket.is_idle
+    for _ in range(3):
+        bucket.take()
+    assert bucket.get_wait_time(clock.now) == pytest.approx(1.0)
+
+
+def test_token_bucket_block_overrides_tokens(clock):
+    bucket = TokenBucket(30, 30)
+    bucket.block(clock.now + 5)
+    assert bucket.get_block_time(clock.now) == pytest.approx(5)
+    assert bucket.get_wait_time(clock.now + 2) == pytest.approx(3)
+    # A shorter block does not end a longer one early
+    bucket.block(clock.now + 1)
+    assert bucket.get_block_time(clock.now) == pytest.approx(5)
+    assert bucket.get_wait_time(clock.now + 5) == 0.0
+
+
+def test_message_digests_detect_changes():
+    digests = MessageDigestCache()
+    key = MessageDigestCache.build_key(chat_id=1, message_id=2)
+    assert key == "1_2"
+    assert digests.get_changes(key, "Text", build_markup("A")) == (True, True)
+
+    digests.record(key, "Text", build_markup("A"))
+    assert digests.get_changes(key, "Text", build_markup("A")) == (False, False)
+    assert digests.get_changes(key, "Other text", build_markup("A")) == (True, False)
+    assert digests.get_changes(key, "Text", build_markup("B")) == (False, True)
+    # An empty text leaves the text as it is
+    assert digests.get_changes(key, "", build_markup("A")) == (False, False)
+
+
+def test_message_digests_keep_text_when_only_markup_recorded():
+    digests = MessageDigestCache()
+    digests.record("mid", "Text", build_markup("A"))
+    digests.record("mid", "", build_markup("B"))
+    assert digests.get_changes("mid", "Text", build_markup("B")) == (False, False)
+
+
+def test_message_digests_distrust_markup_changed_elsewhere():
+    digests = MessageDigestCache()
+    digests.record("mid", "Text", build_markup("A"))
+    assert digests.get_changes("mid", "Text", build_markup("A"), current_markup=build_markup("A")) == (False, False)
+    assert digests.get_changes("mid", "Text", build_markup("A"), current_markup=build_markup("C")) == (True, True)
+
+
+def test_message_digests_forget_and_evict():
+    digests = MessageDigestCache(max_size=2)
+    digests.record("first", "Text", None)
+    digests.record("second", "Text", None)
+    digests.forget("second")
+    assert digests.get_changes("second", "Text", None) == (True, True)
+
+    digests.record("second", "Text", None)
+    digests.get_changes("first", "Text", None)
+    digests.record("third", "Text", None)
+    assert len(digests) == 2
+    # The least recently used message is forgotten first
+    assert digests.get_changes("second", "Text", None) == (True, True)
+    assert digests.get_changes("first", "Text", None) == (False, False)
+
+
+class FakeRequest(object):
+    con_pool_size = 1
+
+    def __init__(self) -> None:
+        self.endpoints = []
+
+    def post(self, url: str, data: dict, timeout: float = None) -> bool:
+        self.endpoints.append(url.rsplit("/", 1)[-1])
+        return True
+
+
+def test_scheduled_bot_forgets_digests_of_changed_messages():
+    digests = MessageDigestCache()
+    digests.record("mid", "Text", None)
+    digests.record("1_2", "Text", None)
+    request = FakeRequest()
+    bot = ScheduledBot("123456:TestToken", outbound.OutboundScheduler(), digests, request=request)
+
+    bot.edit_message_text("New text", inline_message_id="mid")
+    assert digests.get_changes("mid", "Text", None) == (True, True)
+    assert digests.get_changes("1_2", "Text", None) == (False, False)
+    bot.delete_message(1, 2)
+    assert digests.get_changes("1_2", "Text", None) == (True, True)
+    assert request.endpoints == ["editMessageText", "deleteMessage"]
+
+
+class FakeJobQueue(object):
+    def __init__(self) -> None:
+        self.jobs = []
+
+    def run_once(self, callback, when, context=None, name=None) -> None:
+        self.jobs.append((callback, context))
+        return
+
+    def run_all(self) -> None:
+        jobs, self.jobs = self.jobs, []
+        for callback, context in jobs:
+            callback(SimpleNamespace(job=SimpleNamespace(context=context)))
+        return
+
+
+def test_refresh_scheduler_coalesces_refreshes():
+    job_queue, refreshes = FakeJobQueue(), []
+    scheduler = RefreshScheduler()
+    scheduler.schedule(job_queue, "poll", lambda *args: refreshes.append(("first",) + args), only_buttons=True,
+                       fresh_mid="a")
+    scheduler.schedule(job_queue, "poll", lambda *args: refreshes.append(("second",) + args), only_buttons=False,
+                       fresh_mid="b")
+    assert len(job_queue.jobs) == 1
+    assert scheduler.pending_count == 1
+
+    job_queue.run_all()
+    # The latest refresh is run once, for all changes, and only the latest change's message is still fresh
+    assert refreshes == [("second", False, {"b"})]
+    assert scheduler.pending_count == 0
+
+
+def test_refresh_scheduler_keeps_only_buttons_if_all_changes_are():
+    job_queue, refreshes = FakeJobQueue(), []
+    scheduler = RefreshScheduler()
+    for _ in range(2):
+        scheduler.schedule(job_queue, "list", lambda *args: refreshes.append(args), only_buttons=True)
+    job_queue.run_all()
+    assert refreshes == [(True, set())]
+
+
+def test_fan_out_executor_runs_tasks_of_a_key_in_order():
+    executor = FanOutExecutor(workers=3)
+    results, done = [], threading.Event()
+    for i in range(50):
+        executor.submit("mid", lambda i=i: results.append(i))
+    executor.submit("mid", done.set)
+    assert done.wait(5)
+    assert results == list(range(50))
+    assert executor.queue_depth == 0
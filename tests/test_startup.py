@@ -0,0 +1,65 @@
+"""Holding back and replaying updates until the data is loaded"""
+from queue import Queue
+
+from telegram import InlineQuery, Message, Update, User
+
+from startup import ReadinessGate
+
+USER = User(1, "User", False)
+
+
+def build_message_update(update_id: int) -> Update:
+    return Update(update_id, message=Message(update_id, None, None, from_user=USER, text=f"Message {update_id}"))
+
+
+def build_inline_query_update(update_id: int) -> Update:
+    return Update(update_id, inline_query=InlineQuery(str(update_id), USER, "query", ""))
+
+
+def get_queued_ids(update_queue: Queue) -> list:
+    update_ids = []
+    while not update_queue.empty():
+        update_ids.append(update_queue.get().update_id)
+    return update_ids
+
+
+def test_holds_updates_until_open_and_replays_in_order():
+    gate, update_queue = ReadinessGate(), Queue()
+    assert not gate.is_ready
+    assert all(gate.hold(build_message_update(update_id)) for update_id in (1, 2, 3))
+    assert update_queue.empty()
+
+    gate.open(update_queue)
+    assert gate.is_ready and gate.is_data_loaded
+    assert get_queued_ids(update_queue) == [1, 2, 3]
+    # Updates are handled straight away once the gate is open
+    assert not gate.hold(build_message_update(4))
+    assert update_queue.empty()
+
+
+def test_drops_inline_queries_while_loading():
+    gate, update_queue = ReadinessGate(), Queue()
+    assert gate.hold(build_inline_query_update(1))
+    assert gate.hold(build_message_update(2))
+    gate.open(update_queue)
+    assert get_queued_ids(update_queue) == [2]
+
+
+def test_drops_updates_over_maximum():
+    gate, update_queue = ReadinessGate(max_held_updates=2), Queue()
+    for update_id in (1, 2, 3):
+        assert gate.hold(build_message_update(update_id))
+    gate.open(update_queue)
+    assert get_queued_ids(update_queue) == [1, 2]
+
+
+def test_opens_without_data_until_loaded():
+    gate, update_queue = ReadinessGate(), Queue()
+    gate.hold(build_message_update(1))
+    gate.open(update_queue, is_data_loaded=False)
+    assert gate.is_ready
+    assert not gate.is_data_loaded
+    assert get_queued_ids(update_queue) == [1]
+
+    gate.mark_data_loaded()
+    assert gate.is_data_loaded
@@ -0,0 +1,137 @@
+"""Sampled tracing of update handling"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List as Lst
+
+logger = logging.getLogger(__name__)
+
+# Trace of the update being handled by the current thread, if it is sampled
+thread_state = threading.local()
+
+
+class Span(object):
+    __slots__ = ("name", "depth", "start_time", "end_time")
+
+    def __init__(self, name: str, depth: int) -> None:
+        self.name = name
+        self.depth = depth
+        self.start_time = time.perf_counter()
+        self.end_time = self.start_time
+
+
+class Trace(object):
+    """Timings of the spans opened while handling one update, in the order they were opened."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.spans: Lst[Span] = []
+        self.depth = 0
+        self.start_time = time.perf_counter()
+        self.end_time = self.start_time
+        self.is_logged = False
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        self.depth += 1
+        span = Span(name, self.depth)
+        self.spans.append(span)
+        try:
+            yield
+        finally:
+            span.end_time = time.perf_counter()
+            self.depth -= 1
+
+    def to_json(self) -> dict:
+        return {
+            "trace": self.name,
+            **self.attributes,
+            "duration_ms": round(self.duration * 1000, 3),
+            "spans": [
+                {
+                    "name": span.name,
+                    "depth": span.depth,
+                    "start_ms": round((span.start_time - self.start_time) * 1000, 3),
+                    "duration_ms": round((span.end_time - span.start_time) * 1000, 3),
+                } for span in self.spans
+            ],
+        }
+
+
+class Tracer(object):
+    """Traces a sample of updates, and logs the traces of updates that took longer than the slow threshold.
+
+    Whether an update is traced is decided once, before any of its handlers run, and the trace is kept in the
+    callback context that all handlers of the update share. Each handler of a traced update adds its span to the
+    trace, even if it runs on another thread.
+    """
+
+    def __init__(self, sample_rate: float, slow_threshold: float) -> None:
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    def sample_update(self, update: object, context: object) -> None:
+        """Decides whether the update is traced. Must be the handler of the lowest group."""
+        is_sampled = random.random() < self.sample_rate
+        context.trace = Trace("update", {"update_id": getattr(update, "update_id", None)}) if is_sampled else None
+        return
+
+    def traced_handler(self, callback: Callable) -> Callable:
+        """Adds a span for the handler callback to the trace of every traced update it handles."""
+        @wraps(callback)
+        def traced_callback(update: object, context: object) -> Any:
+            trace = getattr(context, "trace", None)
+            if not trace:
+                return callback(update, context)
+
+            previous_trace = getattr(thread_state, "trace", None)
+            thread_state.trace = trace
+            try:
+                with trace.span(callback.__name__):
+                    return callback(update, context)
+            finally:
+                thread_state.trace = previous_trace
+                self.finish(trace)
+        return traced_callback
+
+    def finish(self, trace: Trace) -> None:
+        """Ends the trace after a handler is done, and logs it the first time that it is slow."""
+        trace.end_time = time.perf_counter()
+        if trace.duration >= self.slow_threshold and not trace.is_logged:
+            trace.is_logged = True
+            logger.warning(f"Slow trace {json.dumps(trace.to_json())}")
+        return
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the enclosed work as part of the current thread's trace, if there is one."""
+    trace = getattr(thread_state, "trace", None)
+    if not trace:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def traced(function: Callable) -> Callable:
+    """Times every call to the decorated function as part of the current thread's trace, if there is one."""
+    name = function.__qualname__
+
+    @wraps(function)
+    def traced_function(*args, **kwargs):
+        trace = getattr(thread_state, "trace", None)
+        if not trace:
+            return function(*args, **kwargs)
+        with trace.span(name):
+            return function(*args, **kwargs)
+    return traced_function
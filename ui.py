@@ -79,7 +79,7 @@ class Pagination(object):
 
     def build_navigation_button(self, text: str, page_number: int) -> InlineKeyboardButton:
         subject, action, identifier = self.button_data
-        return util.build_button(text, subject, f"page{page_number}_{action}", identifier)
+        return util.build_button(text, subject, action, identifier, page_number=page_number)
 
 
 class PaginationButtonGroup(Pagination):
@@ -1,16 +1,45 @@
 """Util methods"""
+from __future__ import annotations
+
+import json
 import string
 import random
 import re
 from datetime import datetime
 from hashlib import blake2b as blake
 import requests
-from typing import List, Tuple, Set, Union, Dict
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from typing import List, Tuple, Set, Union, Dict, Optional, Callable, Hashable
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 
 ENCODE_KEY = string.digits + string.ascii_letters
 NEGATIVE_SYMBOL = "Z"
 
+# Callback data codec, subjects and words are packed by their index so their order must never change
+CALLBACK_DATA_MARK = "#"
+CALLBACK_DATA_VERSION = "1"
+CALLBACK_SUBJECTS = ("u", "p", "l", "g", "tp", "tl")
+CALLBACK_WORDS = (
+    "poll", "list", "group", "publish", "refresh", "title", "descr", "opt", "opts", "choice", "choices", "name",
+    "userRefresh", "refreshOpt", "response", "comment", "editComment", "vote", "back", "mem", "set", "pass",
+    "invite", "leave", "bot", "promote", "close", "reset", "done", "skip", "show", "hide", "temp", "tPoll", "tList",
+    "guide", "tTitle", "tDescr", "tTitleCode", "tDescrCode", "edit", "rename", "add", "view", "del", "delYes",
+    "return"
+)
+CALLBACK_SUBJECT_CODES = {subject: ENCODE_KEY[i] for i, subject in enumerate(CALLBACK_SUBJECTS)}
+CALLBACK_WORD_CODES = {word: ENCODE_KEY[i] for i, word in enumerate(CALLBACK_WORDS)}
+CALLBACK_PAGE_PREFIX = "*"
+CALLBACK_WORD_PREFIX = "~"
+CALLBACK_LITERAL_PREFIX = "'"
+CALLBACK_TOKEN_SEPARATOR = "."
+CALLBACK_IDENTIFIER_SEPARATOR = ":"
+
+# Markup caches
+STATIC_MARKUP_CACHE_SIZE = 256
+
 
 def create_random_string(n: int) -> str:
     return ''.join(random.choices(string.ascii_letters + string.digits, k=n))
@@ -78,9 +107,95 @@ def simple_hash(text: str, salt="", length=16, variance=True) -> str:
     return encoded_digest[:length]
 
 
-def build_button(text: str, subject: str = "", action: str = "", identifier: str = "") -> InlineKeyboardButton:
-    data = f"{subject} {action} {identifier}".strip()
-    return InlineKeyboardButton(text, callback_data=data)
+def pack_number(num: int) -> str:
+    code = ""
+    while True:
+        num, i = divmod(num, len(ENCODE_KEY))
+        code = ENCODE_KEY[i] + code
+        if num == 0:
+            return code
+
+
+def unpack_number(code: str) -> int:
+    if not code:
+        raise ValueError("Empty packed number")
+    num = 0
+    for value in code:
+        num = num * len(ENCODE_KEY) + ENCODE_KEY.index(value)
+    return num
+
+
+def compute_callback_checksum(body: str) -> str:
+    return ENCODE_KEY[zlib.crc32(body.encode()) % len(ENCODE_KEY)]
+
+
+def encode_callback_data(subject: str, action: str, identifier: str, page_number: Optional[int] = None) -> str:
+    """Packs the callback data of a subject button. Falls back to the plain format if the data cannot be packed."""
+    subject_code = CALLBACK_SUBJECT_CODES.get(subject, "")
+    if not subject_code or not identifier.isalnum():
+        return encode_plain_callback_data(subject, action, identifier, page_number)
+
+    tokens = [f"{CALLBACK_PAGE_PREFIX}{pack_number(page_number)}"] if page_number is not None else []
+    for token in action.split("_"):
+        if token.isdigit() and str(int(token)) == token:
+            tokens.append(pack_number(int(token)))
+        elif token in CALLBACK_WORD_CODES:
+            tokens.append(f"{CALLBACK_WORD_PREFIX}{CALLBACK_WORD_CODES[token]}")
+        elif token.isalnum():
+            tokens.append(f"{CALLBACK_LITERAL_PREFIX}{token}")
+        else:
+            return encode_plain_callback_data(subject, action, identifier, page_number)
+
+    body = f"{CALLBACK_DATA_MARK}{CALLBACK_DATA_VERSION}{subject_code}" \
+           f"{CALLBACK_TOKEN_SEPARATOR.join(tokens)}{CALLBACK_IDENTIFIER_SEPARATOR}{identifier}"
+    return f"{body}{compute_callback_checksum(body)}"
+
+
+def encode_plain_callback_data(subject: str, action: str, identifier: str, page_number: Optional[int] = None) -> str:
+    if page_number is not None:
+        action = f"page{page_number}_{action}"
+    return f"{subject} {action} {identifier}".strip()
+
+
+def decode_callback_data(data: str) -> Optional[Tuple[str, str, str]]:
+    """Unpacks callback data into its subject, action and identifier, accepting both packed and plain formats.
+
+    Returns None if the data has no subject, and raises ValueError if packed data is corrupted.
+    """
+    if not data.startswith(CALLBACK_DATA_MARK):
+        parts = data.split()
+        return (parts[0], parts[1], parts[2]) if len(parts) == 3 else None
+
+    body, checksum = data[:-1], data[-1:]
+    if body[1:2] != CALLBACK_DATA_VERSION:
+        raise ValueError(f"Unsupported callback data version: {data}")
+    if checksum != compute_callback_checksum(body):
+        raise ValueError(f"Invalid callback data checksum: {data}")
+
+    packed_action, _, identifier = body[3:].partition(CALLBACK_IDENTIFIER_SEPARATOR)
+    try:
+        subject = CALLBACK_SUBJECTS[ENCODE_KEY.index(body[2])]
+        page_prefix, words = "", []
+        for token in packed_action.split(CALLBACK_TOKEN_SEPARATOR):
+            if token.startswith(CALLBACK_PAGE_PREFIX):
+                page_prefix = f"page{unpack_number(token[1:])}_"
+            elif token.startswith(CALLBACK_WORD_PREFIX):
+                words.append(CALLBACK_WORDS[ENCODE_KEY.index(token[1:])])
+            elif token.startswith(CALLBACK_LITERAL_PREFIX):
+                words.append(token[1:])
+            else:
+                words.append(str(unpack_number(token)))
+    except IndexError:
+        raise ValueError(f"Invalid callback data: {data}")
+    return subject, page_prefix + "_".join(words), identifier
+
+
+def build_button(text: str, subject: str = "", action: str = "", identifier: str = "",
+                 page_number: Optional[int] = None) -> InlineKeyboardButton:
+    if not subject:
+        data = encode_plain_callback_data(subject, action, identifier, page_number)
+        return InlineKeyboardButton(text, callback_data=data)
+    return InlineKeyboardButton(text, callback_data=encode_callback_data(subject, action, identifier, page_number))
 
 
 def build_switch_button(text: str, placeholder: str, to_self=False) -> InlineKeyboardButton:
@@ -88,6 +203,62 @@ def build_switch_button(text: str, placeholder: str, to_self=False) -> InlineKey
         else InlineKeyboardButton(text, switch_inline_query=placeholder)
 
 
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """Inline keyboard markup that is serialised only once, so it can be shared and sent any number of times."""
+    __slots__ = ("_dict", "_json")
+
+    def __init__(self, inline_keyboard: List[List[InlineKeyboardButton]]) -> None:
+        super().__init__(tuple(tuple(row) for row in inline_keyboard))
+        self._dict = super().to_dict()
+        self._json = json.dumps(self._dict)
+
+    @classmethod
+    def freeze(cls, markup: InlineKeyboardMarkup) -> FrozenInlineKeyboardMarkup:
+        return markup if isinstance(markup, cls) else cls(markup.inline_keyboard)
+
+    def to_dict(self) -> dict:
+        return self._dict
+
+    def to_json(self) -> str:
+        return self._json
+
+
+class MarkupCache(object):
+    """Least recently used cache of frozen markups, keyed by entity id, entity version and how they were built."""
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._markups: OrderedDict[Hashable, FrozenInlineKeyboardMarkup] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._markups)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], InlineKeyboardMarkup]) -> FrozenInlineKeyboardMarkup:
+        with self._lock:
+            markup = self._markups.get(key, None)
+            if markup:
+                self._markups.move_to_end(key)
+                return markup
+
+        markup = FrozenInlineKeyboardMarkup.freeze(build())
+        with self._lock:
+            self._markups[key] = markup
+            while len(self._markups) > self._max_size:
+                self._markups.popitem(last=False)
+        return markup
+
+
+def freeze_markup(build: Callable[..., InlineKeyboardMarkup]) -> Callable[..., FrozenInlineKeyboardMarkup]:
+    """Builds a static markup only once for each set of arguments."""
+    @lru_cache(maxsize=STATIC_MARKUP_CACHE_SIZE)
+    @wraps(build)
+    def build_frozen_markup(*args, **kwargs) -> FrozenInlineKeyboardMarkup:
+        return FrozenInlineKeyboardMarkup.freeze(build(*args, **kwargs))
+    return build_frozen_markup
+
+
+@freeze_markup
 def build_single_button_markup(text: str, action: str) -> InlineKeyboardMarkup:
     button = InlineKeyboardButton(text, callback_data=action)
     return InlineKeyboardMarkup([[button]])
@@ -98,6 +269,7 @@ def build_single_switch_button_markup(text: str, placeholder: str) -> InlineKeyb
     return InlineKeyboardMarkup([[button]])
 
 
+@freeze_markup
 def build_multiple_buttons_markup(*button_details: Tuple[str, str, bool, bool]) -> InlineKeyboardMarkup:
     buttons = []
     for text, action, is_switch, to_self in button_details: